@@ -0,0 +1,64 @@
+"""Median/p90 latency over month sketches vs sorting amounts: python benchmarks/bench_distribution.py"""
+from datetime import date
+from pathlib import Path
+import random
+import sys
+import time
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from tools.expense_table import ExpenseTable  # noqa: E402
+from tools.rollup_cube import RollupCube  # noqa: E402
+
+
+def _timed(fn, repeat: int) -> float:
+	t0 = time.perf_counter()
+	for _ in range(repeat):
+		fn()
+	return (time.perf_counter() - t0) / repeat
+
+
+def main(n_rows: int = 300_000, n_vendors: int = 2_000, repeat: int = 10) -> None:
+	rng = random.Random(17)
+	vendors = [f"Vendor {i}" for i in range(n_vendors)]
+	categories = ["Meals", "Travel", "Office Supplies", "Utilities", "Software"]
+	rows = [
+		{
+			"vendor": rng.choice(vendors),
+			"category": rng.choice(categories),
+			"date": date(2023 + rng.randrange(2), rng.randrange(1, 13), rng.randrange(1, 29)).isoformat(),
+			"amount": round(rng.lognormvariate(3.5, 1.0), 2),
+		}
+		for _ in range(n_rows)
+	]
+	cube, table = RollupCube(), ExpenseTable()
+	t0 = time.perf_counter()
+	cube.sync(rows)
+	build = time.perf_counter() - t0
+	table.sync(rows)
+
+	everything = (cube.select({}, None, None), table.select({}, None, None))
+	year = (cube.select({}, date(2024, 1, 1), date(2024, 12, 31)), table.select({}, date(2024, 1, 1), date(2024, 12, 31)))
+	travel = (cube.select({"categories": ["Travel"]}, None, None), table.select({"categories": ["Travel"]}, None, None))
+	amounts = [r["amount"] for r in rows]
+	# The month sketches are built from the rows on the first stats call and kept on append after that
+	sketch_build = _timed(lambda: cube.stats(everything[0]), 1)
+	sketched, exact = cube.stats(everything[0]), table.stats(everything[1])
+	error = max(abs(sketched[m] - exact[m]) / exact[m] for m in ("median", "p90"))
+
+	results = {
+		"python sorted() all rows": _timed(lambda: sorted(amounts), 3),
+		"table stats (all time)": _timed(lambda: table.stats(everything[1]), repeat),
+		"cube sketches (all time)": _timed(lambda: cube.stats(everything[0]), repeat),
+		"table stats (one year)": _timed(lambda: table.stats(year[1]), repeat),
+		"cube sketches (one year)": _timed(lambda: cube.stats(year[0]), repeat),
+		"table stats per category": _timed(lambda: table.stats(travel[1], "category"), repeat),
+		"cube sketches per category": _timed(lambda: cube.stats(travel[0], "category"), repeat),
+	}
+	print(f"rows={n_rows} vendors={n_vendors} cube_build={build:.2f}s sketch_build={sketch_build:.2f}s max_quantile_error={error:.3%}")
+	for name, seconds in results.items():
+		print(f"  {name:<28} {seconds * 1000:9.3f} ms")
+
+
+if __name__ == "__main__":
+	main()
@@ -0,0 +1,68 @@
+"""Top-N latency with 50k distinct vendors: python benchmarks/bench_leaderboards.py"""
+from datetime import date
+from pathlib import Path
+import random
+import sys
+import time
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from tools.expense_table import ExpenseTable  # noqa: E402
+from tools.rollup_cube import RollupCube  # noqa: E402
+
+
+def _timed(fn, repeat: int) -> float:
+	t0 = time.perf_counter()
+	for _ in range(repeat):
+		fn()
+	return (time.perf_counter() - t0) / repeat
+
+
+def main(n_rows: int = 300_000, n_vendors: int = 50_000, k: int = 5, repeat: int = 20) -> None:
+	rng = random.Random(11)
+	vendors = [f"Vendor {i}" for i in range(n_vendors)]
+	categories = ["Meals", "Travel", "Office Supplies", "Utilities", "Software"]
+	rows = [
+		{
+			"vendor": rng.choice(vendors),
+			"category": rng.choice(categories),
+			"date": date(2023 + rng.randrange(2), rng.randrange(1, 13), rng.randrange(1, 29)).isoformat(),
+			"amount": round(rng.uniform(1, 500), 2),
+		}
+		for _ in range(n_rows)
+	]
+	cube, table = RollupCube(), ExpenseTable()
+	t0 = time.perf_counter()
+	cube.sync(rows)
+	build = time.perf_counter() - t0
+	table.sync(rows)
+
+	everything = cube.select({}, None, None)
+	one_month = cube.select({}, date(2024, 3, 1), date(2024, 3, 31))
+	quarter = cube.select({}, date(2024, 1, 1), date(2024, 3, 31))
+	assert cube.top(everything, "vendor", k) == table.top(table.select({}, None, None), "vendor", k)
+
+	def full_sort() -> list:
+		# The previous approach: total every vendor, then sort them all
+		totals: dict = {}
+		for r in rows:
+			totals[r["vendor"]] = totals.get(r["vendor"], 0.0) + r["amount"]
+		return sorted(totals.items(), key=lambda kv: -kv[1])[:k]
+
+	all_rows = table.select({}, None, None)
+	# A month's boards are built from its cells on the first top-N read of that month
+	first_read = _timed(lambda: cube.top(one_month, "vendor", k), 1)
+	results = {
+		"full dict + sort": _timed(full_sort, 3),
+		"table partial select": _timed(lambda: table.top(all_rows, "vendor", k), repeat),
+		"cube leaderboard (all time)": _timed(lambda: cube.top(everything, "vendor", k), repeat),
+		"cube leaderboard (one month)": _timed(lambda: cube.top(one_month, "vendor", k), repeat),
+		"cube nlargest (three months)": _timed(lambda: cube.top(quarter, "vendor", k), repeat),
+	}
+	print(f"rows={n_rows} vendors={n_vendors} k={k} cube_build={build:.2f}s month_board_first_read={first_read * 1000:.1f}ms")
+	for name, seconds in results.items():
+		print(f"  {name:<30} {seconds * 1000:9.3f} ms")
+
+
+if __name__ == "__main__":
+	main()
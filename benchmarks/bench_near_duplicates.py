@@ -0,0 +1,37 @@
+"""Near-duplicate lookup latency at 100k rows: python benchmarks/bench_near_duplicates.py"""
+from datetime import date, timedelta
+from pathlib import Path
+import random
+import sys
+import time
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from tools.duplicate_index import DuplicateIndex  # noqa: E402
+
+
+def main(n_rows: int = 100_000, n_lookups: int = 5_000) -> None:
+	rng = random.Random(7)
+	vendors = [f"Vendor {i}" for i in range(2_000)]
+	start = date(2022, 1, 1)
+	rows = [
+		{"vendor": rng.choice(vendors), "date": (start + timedelta(days=rng.randrange(900))).isoformat(), "amount": round(rng.uniform(1, 500), 2)}
+		for _ in range(n_rows)
+	]
+	index = DuplicateIndex()
+	t0 = time.perf_counter()
+	index.sync(rows)
+	build = time.perf_counter() - t0
+
+	probes = []
+	for row in rng.sample(rows, n_lookups):
+		d = date.fromisoformat(row["date"]) + timedelta(days=rng.choice([0, 1]))
+		probes.append({"vendor": row["vendor"].upper(), "date": d.isoformat(), "amount": row["amount"]})
+	t0 = time.perf_counter()
+	hits = sum(1 for p in probes if index.find(p) is not None)
+	per_lookup = (time.perf_counter() - t0) / n_lookups
+	print(f"rows={n_rows} build={build:.2f}s lookups={n_lookups} hits={hits} per_lookup={per_lookup * 1e6:.1f}us")
+
+
+if __name__ == "__main__":
+	main()
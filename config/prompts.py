@@ -45,9 +45,10 @@ SCHEMA (all fields required, use null if unknown):
   "time_range": {{"start_date": "YYYY-MM-DD|null", "end_date": "YYYY-MM-DD|null", "relative": "last_month|this_month|this_year|last_quarter|last_7_days|last_90_days|custom|null"}},
   "filters": {{"vendors": ["string"]|null, "categories": ["string"]|null, "min_amount": number|null, "max_amount": number|null, "text_search": "string|null"}},
   "group_by": "none|vendor|category|date",
+  "metric": "total|count|mean|median|p90|min|max|stddev",
   "trend": {{"enabled": boolean, "granularity": "day|week|month|quarter|year"}},
   "top_n": {{"enabled": boolean, "dimension": "vendor|category", "limit": number}},
-  "compare": {{"enabled": boolean, "baseline": {{"start_date": "YYYY-MM-DD", "end_date": "YYYY-MM-DD"}}|null, "target": {{"start_date": "YYYY-MM-DD", "end_date": "YYYY-MM-DD"}}|null}},
+  "compare": {{"enabled": boolean, "baseline": {{"start_date": "YYYY-MM-DD", "end_date": "YYYY-MM-DD"}}|null, "target": {{"start_date": "YYYY-MM-DD", "end_date": "YYYY-MM-DD"}}|null, "periods": [{{"label": "string", "start_date": "YYYY-MM-DD", "end_date": "YYYY-MM-DD"}}]|null, "series": {{"granularity": "week|month|quarter|year", "count": number}}|null, "relative_to": "previous|first|year_ago"}},
   "sort": {{"by": "amount|date|vendor|category|count|total", "direction": "asc|desc"}},
   "output": {{"format": "summary|table|detailed|chart", "chart": {{"type": "bar|line|pie|area|null", "dimension": "vendor|category|date|null", "metric": "amount|count|total|null"}}}}
 }}
@@ -56,6 +57,8 @@ RULES:
 - If the user does NOT mention a time period, leave start_date/end_date/relative all null (means *all time*).
 - Only populate filters.categories when the user explicitly names a category (see list below). Do NOT infer from a vendor.
 - When the query asks for a *total* spend at a vendor or category (e.g. "total spent in Walmart"), set intent="summary", group_by="none", output.format="summary".
+- For two periods use compare.baseline/target. For more, list them in compare.periods, or set compare.series to cut time_range into buckets (e.g. "each month this year": series month, relative this_year; "last 4 quarters compared": series quarter, count 4, no time_range). Use relative_to="year_ago" for "vs the same month last year".
+- metric is "total" unless the user asks about typical or unusual amounts: "typical"/"median" -> median, "average" -> mean, "unusually high"/"90th percentile" -> p90, "smallest"/"largest single" -> min/max, "how much does it vary" -> stddev. Use group_by vendor/category for one answer per vendor or category.
 - Do not add extra keys; if unsure set the JSON field to null.
 
 CATEGORIES: Office Supplies, Groceries, Travel & Transportation, Meals & Entertainment, Equipment & Software, Professional Services, Marketing & Advertising, Utilities & Communications, Training & Education, Maintenance & Repairs, Other Business Expenses
@@ -64,6 +67,6 @@ CURRENT DATE: {current_date}
 USER QUERY: {user_query}
 
 EXAMPLES:
-{{"intent":"top_n","time_range":{{"start_date":null,"end_date":null,"relative":"last_90_days"}},"filters":{{"vendors":null,"categories":null,"min_amount":null,"max_amount":null,"text_search":null}},"group_by":"vendor","trend":{{"enabled":false,"granularity":"month"}},"top_n":{{"enabled":true,"dimension":"vendor","limit":5}},"compare":{{"enabled":false,"baseline":null,"target":null}},"sort":{{"by":"total","direction":"desc"}},"output":{{"format":"summary","chart":{{"type":null,"dimension":null,"metric":null}}}}}}
-{{"intent":"search","time_range":{{"start_date":null,"end_date":null,"relative":"this_year"}},"filters":{{"vendors":["Walmart"],"categories":["Groceries"],"min_amount":20,"max_amount":null,"text_search":null}},"group_by":"none","trend":{{"enabled":false,"granularity":"month"}},"top_n":{{"enabled":false,"dimension":"vendor","limit":5}},"compare":{{"enabled":false,"baseline":null,"target":null}},"sort":{{"by":"date","direction":"desc"}},"output":{{"format":"table","chart":{{"type":null,"dimension":null,"metric":null}}}}}}
+{{"intent":"top_n","time_range":{{"start_date":null,"end_date":null,"relative":"last_90_days"}},"filters":{{"vendors":null,"categories":null,"min_amount":null,"max_amount":null,"text_search":null}},"group_by":"vendor","metric":"total","trend":{{"enabled":false,"granularity":"month"}},"top_n":{{"enabled":true,"dimension":"vendor","limit":5}},"compare":{{"enabled":false,"baseline":null,"target":null}},"sort":{{"by":"total","direction":"desc"}},"output":{{"format":"summary","chart":{{"type":null,"dimension":null,"metric":null}}}}}}
+{{"intent":"search","time_range":{{"start_date":null,"end_date":null,"relative":"this_year"}},"filters":{{"vendors":["Walmart"],"categories":["Groceries"],"min_amount":20,"max_amount":null,"text_search":null}},"group_by":"none","metric":"total","trend":{{"enabled":false,"granularity":"month"}},"top_n":{{"enabled":false,"dimension":"vendor","limit":5}},"compare":{{"enabled":false,"baseline":null,"target":null}},"sort":{{"by":"date","direction":"desc"}},"output":{{"format":"table","chart":{{"type":null,"dimension":null,"metric":null}}}}}}
 """ 
\ No newline at end of file
@@ -1,5 +1,5 @@
 import os
-from dataclasses import dataclass
+from dataclasses import dataclass, field
 from typing import Optional
 
 
@@ -17,12 +17,20 @@ def getenv_int(key: str, default: int) -> int:
 		return default
 
 
+def getenv_float(key: str, default: float) -> float:
+	try:
+		return float(os.getenv(key, default))
+	except ValueError:
+		return default
+
+
 @dataclass
 class WatsonxConfig:
 	api_key: str
 	project_id: str
 	url: str
 	model_id: str
+	iam_refresh_margin_seconds: float = 300.0
 
 
 @dataclass
@@ -54,8 +62,26 @@ class BusinessRules:
 	timezone: str = "America/New_York"
 	auto_categorization_enabled: bool = True
 	duplicate_detection_enabled: bool = True
+	near_duplicate_detection_enabled: bool = True
 	require_approval: bool = False
 	top_vendors_limit: int = 5
+	search_page_size: int = 20
+
+
+@dataclass
+class CacheConfig:
+	rows_max_staleness_seconds: float = 30.0
+	write_batch_size: int = 1
+	write_batch_max_age_seconds: float = 2.0
+	sqlite_mirror_path: str = ""
+	receipt_cache_dir: str = ".cache/receipts"
+	receipt_cache_max_entries: int = 1000
+	image_hash_max_distance: int = -1
+	plan_cache_path: str = ".cache/query_plans.json"
+	plan_cache_ttl_seconds: float = 86400.0
+	plan_cache_max_entries: int = 512
+	semantic_plan_cache_enabled: bool = True
+	result_cache_max_entries: int = 256
 
 
 @dataclass
@@ -65,6 +91,7 @@ class Settings:
 	slack: SlackConfig
 	ocr: OcrConfig
 	rules: BusinessRules
+	cache: CacheConfig = field(default_factory=CacheConfig)
 	file_storage_type: Optional[str] = None
 	database_url: Optional[str] = None
 
@@ -76,6 +103,7 @@ def load_settings() -> Settings:
 		project_id=os.getenv("WATSONX_PROJECT_ID", ""),
 		url=os.getenv("WATSONX_URL", "https://us-south.ml.cloud.ibm.com"),
 		model_id=os.getenv("GRANITE_MODEL_ID", "ibm/granite-3.3-8b-instruct"),
+		iam_refresh_margin_seconds=getenv_float("IAM_TOKEN_REFRESH_MARGIN_SECONDS", 300.0),
 	)
 
 	google = GoogleSheetsConfig(
@@ -104,8 +132,25 @@ def load_settings() -> Settings:
 		timezone=os.getenv("TIMEZONE", "America/New_York"),
 		auto_categorization_enabled=getenv_bool("AUTO_CATEGORIZATION_ENABLED", True),
 		duplicate_detection_enabled=getenv_bool("DUPLICATE_DETECTION_ENABLED", True),
+		near_duplicate_detection_enabled=getenv_bool("NEAR_DUPLICATE_DETECTION_ENABLED", True),
 		require_approval=getenv_bool("REQUIRE_APPROVAL", False),
 		top_vendors_limit=getenv_int("TOP_VENDORS_LIMIT", 5),
+		search_page_size=getenv_int("SEARCH_PAGE_SIZE", 20),
+	)
+
+	cache = CacheConfig(
+		rows_max_staleness_seconds=getenv_float("ROW_CACHE_MAX_STALENESS_SECONDS", 30.0),
+		write_batch_size=getenv_int("SHEETS_WRITE_BATCH_SIZE", 1),
+		write_batch_max_age_seconds=getenv_float("SHEETS_WRITE_BATCH_MAX_AGE_SECONDS", 2.0),
+		sqlite_mirror_path=os.getenv("EXPENSE_MIRROR_PATH", ""),
+		receipt_cache_dir=os.getenv("RECEIPT_CACHE_DIR", ".cache/receipts"),
+		receipt_cache_max_entries=getenv_int("RECEIPT_CACHE_MAX_ENTRIES", 1000),
+		image_hash_max_distance=getenv_int("IMAGE_HASH_MAX_DISTANCE", -1),
+		plan_cache_path=os.getenv("PLAN_CACHE_PATH", ".cache/query_plans.json"),
+		plan_cache_ttl_seconds=getenv_float("PLAN_CACHE_TTL_SECONDS", 86400.0),
+		plan_cache_max_entries=getenv_int("PLAN_CACHE_MAX_ENTRIES", 512),
+		semantic_plan_cache_enabled=getenv_bool("SEMANTIC_PLAN_CACHE_ENABLED", True),
+		result_cache_max_entries=getenv_int("RESULT_CACHE_MAX_ENTRIES", 256),
 	)
 
 	return Settings(
@@ -114,6 +159,7 @@ def load_settings() -> Settings:
 		slack=slack,
 		ocr=ocr,
 		rules=rules,
+		cache=cache,
 		file_storage_type=os.getenv("FILE_STORAGE_TYPE"),
 		database_url=os.getenv("DATABASE_URL"),
 	) 
\ No newline at end of file
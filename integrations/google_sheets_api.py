@@ -1,4 +1,5 @@
-from typing import Dict, Any, List
+from typing import Dict, Any, List, Optional, Tuple
+import logging
 from datetime import datetime
 from zoneinfo import ZoneInfo
 import json
@@ -10,11 +11,61 @@ from google.oauth2.service_account import Credentials
 from config.settings import load_settings
 
 
+logger = logging.getLogger(__name__)
+
+
+def append_rejected(error: BaseException) -> bool:
+	"""
+	True when the Sheets API refused a write outright (bad request, rate limit), so
+	nothing was written and sending it again cannot add a duplicate row. Timeouts
+	and 5xx responses are not: the row may already be in the sheet.
+	"""
+	return isinstance(error, gspread.exceptions.APIError) and error.code in (400, 429)
+
+
+def _layout_mismatch(error: BaseException) -> bool:
+	"""A 400 naming the range or columns: the sheet's grid no longer matches the cached header layout."""
+	if not isinstance(error, gspread.exceptions.APIError) or error.code != 400:
+		return False
+	message = str(error.error.get("message", "")).lower()
+	return any(word in message for word in ("range", "grid limits", "column"))
+
+
+def _appended_offset(response: Any) -> Optional[int]:
+	"""Data rows above the first appended row, from the append response's ``updates.updatedRange`` (None when absent)."""
+	if not isinstance(response, dict):
+		return None
+	updated = str((response.get("updates") or {}).get("updatedRange") or "")
+	if not updated:
+		return None
+	try:
+		row, _ = gspread.utils.a1_to_rowcol(updated.rsplit("!", 1)[-1].split(":", 1)[0])
+	except Exception:
+		return None
+	# Row 1 is the header
+	return max(0, row - 2)
+
+
+class WrittenRecord(Dict[str, Any]):
+	"""The record ``append_row`` wrote; ``offset`` is the number of data rows above it in the sheet, when known."""
+
+	offset: Optional[int] = None
+
+
+class WrittenRows(List[Dict[str, Any]]):
+	"""The records ``append_rows`` wrote; ``offset`` is the number of data rows above the first of them, when known."""
+
+	offset: Optional[int] = None
+
+
 class GoogleSheetsClient:
 	def __init__(self) -> None:
 		self.settings = load_settings()
 		self._gc = None
 		self._sheet = None
+		# Cached header layout of the connected worksheet: raw headers and their canonical keys
+		self._headers: Optional[List[str]] = None
+		self._canon_headers: Optional[List[str]] = None
 
 	def connect(self) -> None:
 		creds = Credentials.from_service_account_file(
@@ -27,6 +78,7 @@ class GoogleSheetsClient:
 		self._gc = gspread.authorize(creds)
 		ss = self._gc.open_by_key(self.settings.google_sheets.spreadsheet_id)
 		self._sheet = ss.worksheet(self.settings.google_sheets.worksheet_name)
+		self.refresh_layout()
 
 	def create_spreadsheet(self, title: str) -> Any:
 		if self._gc is None:
@@ -66,28 +118,27 @@ class GoogleSheetsClient:
 	def _canon(s: str) -> str:
 		return (s or "").strip().lower().replace(" ", "_").replace("-", "_")
 
-	def append_row(self, expense: Dict[str, Any]) -> None:
-		if self._sheet is None:
-			self.connect()
-
-		# Ensure header row exists; if empty, seed from template
-		values = self._sheet.get_all_values()
-		if not values or (values and not any(values[0])):
-			headers = self._load_default_headers()
-			self._sheet.update("A1", [headers])
-			values = [headers]
-
-		headers = values[0]
-		canon_headers = [self._canon(h) for h in headers]
+	def refresh_layout(self) -> None:
+		"""Drop the cached header layout; the next append or tail read re-reads row 1."""
+		self._headers = None
+		self._canon_headers = None
 
-		# Compute processed date now
-		try:
-			processed_dt = datetime.now(ZoneInfo(self.settings.rules.timezone)).isoformat()
-		except Exception:
-			processed_dt = datetime.now().isoformat()
+	def _layout(self, seed: bool = True) -> Tuple[List[str], List[str]]:
+		if self._headers is None or self._canon_headers is None:
+			# Read only the header row; if empty, seed from template
+			headers = list(self._sheet.row_values(1) or [])
+			if not any(headers):
+				if not seed:
+					return [], []
+				headers = self._load_default_headers()
+				self._sheet.update("A1", [headers])
+			self._headers = headers
+			self._canon_headers = [self._canon(h) for h in headers]
+		return self._headers, self._canon_headers
 
+	def _field_values(self, expense: Dict[str, Any], processed_dt: str) -> Dict[str, Any]:
 		# Map known fields to canonical keys
-		field_values: Dict[str, Any] = {
+		return {
 			"date": expense.get("date", ""),
 			"vendor": expense.get("vendor", ""),
 			"amount": expense.get("amount", ""),
@@ -98,15 +149,65 @@ class GoogleSheetsClient:
 			"receipt_number": expense.get("receipt_number", ""),
 			"tax_amount": expense.get("tax_amount", ""),
 			"location": expense.get("location", ""),
-			"processed_date": processed_dt,
+			# Stamped by the caller when the row was queued (see SheetsManager), else at write time
+			"processed_date": expense.get("processed_date") or processed_dt,
 			"confidence_score": expense.get("confidence", ""),
 		}
 
-		row: List[Any] = []
-		for key in canon_headers:
-			row.append(field_values.get(key, ""))
+	def processed_timestamp(self) -> str:
+		"""Current time in the configured timezone, as written to the Processed_Date column."""
+		try:
+			return datetime.now(ZoneInfo(self.settings.rules.timezone)).isoformat()
+		except Exception:
+			return datetime.now().isoformat()
+
+	def append_row(self, expense: Dict[str, Any]) -> WrittenRecord:
+		if self._sheet is None:
+			self.connect()
+
+		field_values = self._field_values(expense, self.processed_timestamp())
+		headers, canon_headers = self._layout()
+		row = [field_values.get(key, "") for key in canon_headers]
+		try:
+			response = self._sheet.append_row(row, value_input_option="USER_ENTERED")
+		except gspread.exceptions.APIError as e:
+			# Appends are not idempotent: only a rejected range (columns removed under us) is re-sent, once
+			if not _layout_mismatch(e):
+				raise
+			logger.warning("Append rejected for the cached header layout; refreshing layout and retrying: %s", e)
+			self.refresh_layout()
+			headers, canon_headers = self._layout()
+			row = [field_values.get(key, "") for key in canon_headers]
+			response = self._sheet.append_row(row, value_input_option="USER_ENTERED")
+		# Return the record as written, and where it landed, so callers can update local caches without a re-read
+		record = WrittenRecord(self._records_from_values(headers, [row])[0])
+		record.offset = _appended_offset(response)
+		return record
+
+	def append_rows(self, expenses: List[Dict[str, Any]]) -> WrittenRows:
+		"""Append several expenses with a single ``append_rows`` call; returns the records as written."""
+		if not expenses:
+			return WrittenRows()
+		if self._sheet is None:
+			self.connect()
 
-		self._sheet.append_row(row, value_input_option="USER_ENTERED")
+		processed_dt = self.processed_timestamp()
+		field_values = [self._field_values(e, processed_dt) for e in expenses]
+		headers, canon_headers = self._layout()
+		rows = [[fv.get(key, "") for key in canon_headers] for fv in field_values]
+		try:
+			response = self._sheet.append_rows(rows, value_input_option="USER_ENTERED")
+		except gspread.exceptions.APIError as e:
+			if not _layout_mismatch(e):
+				raise
+			logger.warning("Batch append rejected for the cached header layout; refreshing layout and retrying: %s", e)
+			self.refresh_layout()
+			headers, canon_headers = self._layout()
+			rows = [[fv.get(key, "") for key in canon_headers] for fv in field_values]
+			response = self._sheet.append_rows(rows, value_input_option="USER_ENTERED")
+		written = WrittenRows(self._records_from_values(headers, rows))
+		written.offset = _appended_offset(response)
+		return written
 
 	def query(self, filters: Dict[str, Any]) -> List[Dict[str, Any]]:
 		if self._sheet is None:
@@ -119,20 +220,56 @@ class GoogleSheetsClient:
 			values = self._sheet.get_all_values()
 			if not values:
 				return []
-			headers = values[0]
-			# De-duplicate headers by suffixing duplicates
-			seen: Dict[str, int] = {}
-			unique_headers: List[str] = []
-			for h in headers:
-				key = str(h or "").strip()
-				count = seen.get(key, 0) + 1
-				seen[key] = count
-				unique_headers.append(key if count == 1 else f"{key}_{count}")
-			rows = values[1:]
-			records: List[Dict[str, Any]] = []
-			for row in rows:
-				record: Dict[str, Any] = {}
-				for i, col in enumerate(unique_headers):
-					record[col] = row[i] if i < len(row) else ""
-				records.append(record)
-			return records 
\ No newline at end of file
+			return self._records_from_values(values[0], values[1:])
+
+	def query_since(self, offset: int) -> List[Dict[str, Any]]:
+		"""Return records for the data rows after the first ``offset`` ones.
+
+		Only the tail of the sheet is downloaded, so callers that already hold the
+		first ``offset`` records can refresh incrementally. The header row is read in
+		the same request; when columns were added, removed or reordered since the
+		layout was cached, the cached layout is replaced so the tail and later
+		appends use the sheet's current columns.
+		"""
+		if self._sheet is None:
+			self.connect()
+		headers, _ = self._layout(seed=False)
+		if not headers:
+			return []
+		header_range, values = self._sheet.batch_get(["1:1", self._tail_range(offset, len(headers))])
+		current = [str(h) for h in (header_range[0] if header_range else [])]
+		if current != [str(h) for h in headers]:
+			logger.warning("Sheet header row changed since it was cached; using the new layout: %s", current)
+			self._headers = current
+			self._canon_headers = [self._canon(h) for h in current]
+			if not current:
+				return []
+			if len(current) != len(headers):
+				values = self._sheet.get_values(self._tail_range(offset, len(current)))
+			headers = current
+		# Match get_all_records, which converts numeric-looking cells to numbers
+		rows = [gspread.utils.numericise_all(list(row)) for row in values or []]
+		return self._records_from_values(headers, rows)
+
+	@staticmethod
+	def _tail_range(offset: int, width: int) -> str:
+		last_col = gspread.utils.rowcol_to_a1(1, width).rstrip("0123456789")
+		return f"A{max(0, int(offset)) + 2}:{last_col}"
+
+	@staticmethod
+	def _records_from_values(headers: List[Any], rows: List[List[Any]]) -> List[Dict[str, Any]]:
+		# De-duplicate headers by suffixing duplicates
+		seen: Dict[str, int] = {}
+		unique_headers: List[str] = []
+		for h in headers:
+			key = str(h or "").strip()
+			count = seen.get(key, 0) + 1
+			seen[key] = count
+			unique_headers.append(key if count == 1 else f"{key}_{count}")
+		records: List[Dict[str, Any]] = []
+		for row in rows:
+			record: Dict[str, Any] = {}
+			for i, col in enumerate(unique_headers):
+				record[col] = row[i] if i < len(row) else ""
+			records.append(record)
+		return records
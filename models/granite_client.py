@@ -1,11 +1,11 @@
 import json
 import logging
-import time
-from typing import Any, Dict, Optional
+from typing import Any, Dict
 
 import requests
 
 from config.settings import load_settings
+from models.iam_token import shared_token_provider
 
 
 logger = logging.getLogger(__name__)
@@ -14,9 +14,8 @@ logger = logging.getLogger(__name__)
 class GraniteClient:
 	def __init__(self) -> None:
 		self.settings = load_settings()
-		self._iam_token: Optional[str] = None
-		self._iam_token_exp: float = 0.0
-		self._iam_url = "https://iam.cloud.ibm.com/identity/token"
+		# One IAM token per API key, shared with the other watsonx clients and refreshed in the background
+		self._tokens = shared_token_provider(self.settings.watsonx.api_key, refresh_margin_seconds=self.settings.watsonx.iam_refresh_margin_seconds)
 		self._generation_version = "2023-05-29"
 
 	def build_request(self, prompt: str, temperature: float = 0.1, max_tokens: int = 512) -> Dict[str, Any]:
@@ -37,24 +36,7 @@ class GraniteClient:
 		return payload
 
 	def _ensure_token(self) -> str:
-		now = time.time()
-		if self._iam_token and now < self._iam_token_exp - 60:
-			return self._iam_token
-		resp = requests.post(
-			self._iam_url,
-			headers={"Content-Type": "application/x-www-form-urlencoded"},
-			data={
-				"grant_type": "urn:ibm:params:oauth:grant-type:apikey",
-				"apikey": self.settings.watsonx.api_key,
-			},
-			timeout=30,
-		)
-		resp.raise_for_status()
-		data = resp.json()
-		self._iam_token = data.get("access_token")
-		expires_in = float(data.get("expires_in", 3600))
-		self._iam_token_exp = now + expires_in
-		return self._iam_token  # type: ignore[return-value]
+		return self._tokens.token()
 
 	def generate(self, prompt: str, temperature: float = 0.1, max_tokens: int = 512) -> str:
 		"""Invoke IBM Watsonx text generation for Granite models.
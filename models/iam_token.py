@@ -0,0 +1,186 @@
+import logging
+import threading
+import time
+from typing import Callable, Dict, Optional, Tuple
+
+import requests
+
+
+logger = logging.getLogger(__name__)
+
+
+IAM_URL = "https://iam.cloud.ibm.com/identity/token"
+# Wait before the background refresher retries a failed refresh while the current token is still usable
+_RETRY_SECONDS = 30.0
+
+
+class IamTokenProvider:
+	"""
+	One cached IBM Cloud IAM bearer token, shared by every watsonx client that uses the API key.
+
+	``token()`` returns the cached token without touching IAM while it is valid
+	(until ``expiry_margin_seconds`` before it expires). Only the first call, or
+	one made after the token has actually expired, fetches; concurrent callers
+	then wait for that single in-flight request instead of each posting their
+	own (single-flight), and share its error if it fails. After the first fetch
+	a daemon thread refreshes the token ``refresh_margin_seconds`` before it
+	expires (never earlier than halfway through its lifetime), so request
+	threads keep reading a fresh token while the refresh is in flight.
+	"""
+
+	def __init__(
+		self,
+		api_key: str,
+		iam_url: str = IAM_URL,
+		refresh_margin_seconds: float = 300.0,
+		expiry_margin_seconds: float = 60.0,
+		timeout: float = 30.0,
+		clock: Callable[[], float] = time.time,
+	) -> None:
+		self.api_key = api_key
+		self.iam_url = iam_url
+		self.refresh_margin_seconds = float(refresh_margin_seconds)
+		self.expiry_margin_seconds = float(expiry_margin_seconds)
+		self.timeout = float(timeout)
+		self._clock = clock
+		self._cond = threading.Condition()
+		self._token: Optional[str] = None
+		self._expires_at = 0.0
+		self._refresh_at = 0.0
+		self._inflight = False
+		self._last_error: Optional[BaseException] = None
+		self._stopped = threading.Event()
+		self._wake = threading.Event()
+		self._refresher: Optional[threading.Thread] = None
+		self._metrics: Dict[str, int] = {"hits": 0, "fetches": 0, "refreshes": 0, "waits": 0, "failures": 0}
+
+	def _valid(self, now: float) -> bool:
+		return bool(self._token) and now < self._expires_at - self.expiry_margin_seconds
+
+	def token(self) -> str:
+		with self._cond:
+			if self._valid(self._clock()):
+				self._metrics["hits"] += 1
+				return self._token  # type: ignore[return-value]
+			if self._inflight:
+				# Someone else is already asking IAM; take their answer
+				self._metrics["waits"] += 1
+				while self._inflight:
+					self._cond.wait()
+				if self._valid(self._clock()):
+					return self._token  # type: ignore[return-value]
+				if self._last_error is not None:
+					raise self._last_error
+			self._inflight = True
+		return self._fetch(background=False)
+
+	def _fetch(self, background: bool) -> str:
+		"""Post to IAM; the caller has set ``_inflight``."""
+		token: Optional[str] = None
+		error: Optional[BaseException] = None
+		started = self._clock()
+		try:
+			resp = requests.post(
+				self.iam_url,
+				headers={"Content-Type": "application/x-www-form-urlencoded"},
+				data={
+					"grant_type": "urn:ibm:params:oauth:grant-type:apikey",
+					"apikey": self.api_key,
+				},
+				timeout=self.timeout,
+			)
+			resp.raise_for_status()
+			data = resp.json()
+			token = data.get("access_token")
+			if not token:
+				raise ValueError("IAM response has no access_token")
+			expires_in = float(data.get("expires_in", 3600))
+		except Exception as e:
+			error = e
+		with self._cond:
+			self._inflight = False
+			self._last_error = error
+			if error is None:
+				self._token = token
+				self._expires_at = started + expires_in
+				self._refresh_at = started + max(expires_in / 2, expires_in - self.refresh_margin_seconds)
+				self._metrics["refreshes" if background else "fetches"] += 1
+			else:
+				self._metrics["failures"] += 1
+			self._cond.notify_all()
+		if error is not None:
+			logger.warning("IAM token %s failed: %s", "refresh" if background else "fetch", error)
+			raise error
+		logger.info("IAM token %s; expires in %.0fs", "refreshed" if background else "fetched", expires_in)
+		self._start_refresher()
+		return token  # type: ignore[return-value]
+
+	def _start_refresher(self) -> None:
+		with self._cond:
+			if self._refresher is not None or self._stopped.is_set():
+				self._wake.set()
+				return
+			self._refresher = threading.Thread(target=self._refresh_loop, name="iam-token-refresh", daemon=True)
+		self._refresher.start()
+
+	def _refresh_loop(self) -> None:
+		delay = 0.0
+		while True:
+			with self._cond:
+				if not delay:
+					delay = max(0.0, self._refresh_at - self._clock())
+			self._wake.wait(delay)
+			self._wake.clear()
+			if self._stopped.is_set():
+				return
+			with self._cond:
+				if self._inflight or self._clock() < self._refresh_at:
+					# A caller is fetching, or a fetch moved the schedule: recompute
+					delay = 0.0 if not self._inflight else 1.0
+					continue
+				self._inflight = True
+			try:
+				self._fetch(background=True)
+				delay = 0.0
+			except Exception:
+				delay = _RETRY_SECONDS
+
+	def refresh(self) -> str:
+		"""Fetch a new token now, or wait for the fetch already in flight."""
+		with self._cond:
+			if self._inflight:
+				self._metrics["waits"] += 1
+				while self._inflight:
+					self._cond.wait()
+				if self._last_error is not None:
+					raise self._last_error
+				return self._token  # type: ignore[return-value]
+			self._inflight = True
+		return self._fetch(background=True)
+
+	def metrics(self) -> Dict[str, float]:
+		"""Counters (hits, fetches, refreshes, waits, failures) and seconds until the token expires."""
+		with self._cond:
+			out: Dict[str, float] = dict(self._metrics)
+			out["expires_in"] = round(self._expires_at - self._clock(), 3) if self._token else 0.0
+		return out
+
+	def stop(self) -> None:
+		"""Stop the background refresher; later calls still fetch on demand."""
+		self._stopped.set()
+		self._wake.set()
+		if self._refresher is not None and self._refresher is not threading.current_thread():
+			self._refresher.join(timeout=self.timeout)
+
+
+_providers: Dict[Tuple[str, str], IamTokenProvider] = {}
+_providers_lock = threading.Lock()
+
+
+def shared_token_provider(api_key: str, iam_url: str = IAM_URL, refresh_margin_seconds: float = 300.0) -> IamTokenProvider:
+	"""The process-wide provider for ``api_key``; the first call's settings apply."""
+	with _providers_lock:
+		provider = _providers.get((api_key, iam_url))
+		if provider is None:
+			provider = _providers[(api_key, iam_url)] = IamTokenProvider(api_key, iam_url, refresh_margin_seconds=refresh_margin_seconds)
+		return provider
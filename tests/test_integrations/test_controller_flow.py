@@ -58,4 +58,66 @@ def test_controller_detects_duplicate():
 	controller, extractor, rp, sheets = make_controller(mock_text, mock_receipt, existing_rows=existing_rows)
 
 	result = controller.handle_file_shared({"local_path": "/tmp/rcpt.png"})
-	assert result["status"] == "duplicate" 
\ No newline at end of file
+	assert result["status"] == "duplicate" 
+
+def test_controller_appends_near_duplicate_with_a_warning():
+	# Same parking fee the next day: recurring, so it is appended and only flagged
+	existing_rows = [{"vendor": "City Parking", "amount": 12.0, "date": "2024-01-01", "category": "Travel"}]
+	mock_text = "City Parking Total 12.00 on 2024-01-02"
+	mock_receipt = {"vendor": "City Parking", "amount": 12.0, "date": "2024-01-02", "category": "Travel"}
+	controller, extractor, rp, sheets = make_controller(mock_text, mock_receipt, existing_rows=existing_rows)
+
+	result = controller.handle_file_shared({"local_path": "/tmp/rcpt.png"})
+	assert result["status"] == "appended"
+	assert result["possible_duplicate"]["date"] == "2024-01-01" and not result["possible_duplicate"]["exact"]
+	sheets.append_expense.assert_called_once()
+
+
+def test_controller_reports_buffered_append_through_callback():
+	mock_text = "ACME Total 12.34 on 2024-01-01"
+	mock_receipt = {"vendor": "ACME", "amount": 12.34, "date": "2024-01-01", "category": "Office Supplies"}
+	controller, extractor, rp, sheets = make_controller(mock_text, mock_receipt)
+	sheets.append_expense.return_value = False
+
+	final = []
+	result = controller.handle_file_shared({"local_path": "/tmp/rcpt.png", "on_result": final.append})
+	assert result["status"] == "queued"
+	# Simulate the batch write completing
+	report = sheets.append_expense.call_args.kwargs["on_result"]
+	report(result["expense"], None)
+	assert final and final[0]["status"] == "appended"
+
+
+def test_controller_concurrent_identical_uploads_append_once():
+	import threading
+
+	mock_text = "ACME Total 12.34 on 2024-01-01"
+	mock_receipt = {"vendor": "ACME", "amount": 12.34, "date": "2024-01-01", "category": "Office Supplies"}
+	controller, extractor, rp, sheets = make_controller(mock_text, mock_receipt)
+
+	results = []
+	threads = [threading.Thread(target=lambda: results.append(controller.handle_file_shared({"local_path": "/tmp/rcpt.png"})["status"])) for _ in range(4)]
+	for t in threads:
+		t.start()
+	for t in threads:
+		t.join()
+	assert sorted(results) == ["appended", "duplicate", "duplicate", "duplicate"]
+	sheets.append_expense.assert_called_once()
+
+
+def test_controller_reuses_cached_results_for_identical_file(tmp_path):
+	from tools.receipt_cache import ReceiptCache
+
+	mock_text = "ACME Total 12.34 on 2024-01-01"
+	mock_receipt = {"vendor": "ACME", "amount": 12.34, "date": "2024-01-01", "category": "Office Supplies"}
+	controller, extractor, rp, sheets = make_controller(mock_text, mock_receipt)
+	controller.receipt_cache = ReceiptCache(str(tmp_path / "cache"))
+	upload = tmp_path / "rcpt.png"
+	upload.write_bytes(b"same receipt bytes")
+	again = tmp_path / "rcpt_copy.png"
+	again.write_bytes(b"same receipt bytes")
+
+	assert controller.handle_file_shared({"local_path": str(upload)})["status"] == "appended"
+	assert controller.handle_file_shared({"local_path": str(again)})["status"] == "duplicate"
+	extractor.extract.assert_called_once()
+	assert rp.granite.generate.call_count == 1
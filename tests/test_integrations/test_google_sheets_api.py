@@ -1,3 +1,4 @@
+import pytest
 from unittest.mock import patch, MagicMock
 
 from integrations.google_sheets_api import GoogleSheetsClient
@@ -57,4 +58,91 @@ def test_google_sheets_client_append_and_query():
 
 		# Open worksheet helper
 		ws = client.open_worksheet("Expenses")
-		assert ws is fake_worksheet 
\ No newline at end of file
+		assert ws is fake_worksheet 
+
+def _api_error(code, message):
+	from gspread.exceptions import APIError
+
+	response = MagicMock()
+	response.json.return_value = {"error": {"code": code, "message": message, "status": "INVALID_ARGUMENT"}}
+	return APIError(response)
+
+
+def test_google_sheets_client_query_since_reads_only_tail():
+	fake_worksheet = MagicMock()
+	fake_worksheet.row_values = MagicMock(return_value=["Date", "Vendor", "Amount"])
+	fake_worksheet.batch_get = MagicMock(return_value=[[["Date", "Vendor", "Amount"]], [["2024-01-02", "PaperCo", "5.5"]]])
+	client = GoogleSheetsClient()
+	client._sheet = fake_worksheet
+
+	records = client.query_since(3)
+	# Header row and tail in one request
+	fake_worksheet.batch_get.assert_called_once_with(["1:1", "A5:C"])
+	fake_worksheet.get_values.assert_not_called()
+	assert records == [{"Date": "2024-01-02", "Vendor": "PaperCo", "Amount": 5.5}]
+
+
+def test_google_sheets_client_query_since_detects_header_drift():
+	fake_worksheet = MagicMock()
+	fake_worksheet.row_values = MagicMock(return_value=["Date", "Vendor", "Amount"])
+	# Someone reordered the columns and added one since the layout was cached
+	fake_worksheet.batch_get = MagicMock(return_value=[[["Vendor", "Date", "Amount", "Category"]], [["PaperCo", "2024-01-02", "5.5"]]])
+	fake_worksheet.get_values = MagicMock(return_value=[["PaperCo", "2024-01-02", "5.5", "Office Supplies"]])
+	client = GoogleSheetsClient()
+	client._sheet = fake_worksheet
+	client.append_row({"date": "2024-01-01", "vendor": "ACME", "amount": 1})
+
+	records = client.query_since(1)
+	fake_worksheet.get_values.assert_called_once_with("A3:D")
+	assert records == [{"Vendor": "PaperCo", "Date": "2024-01-02", "Amount": 5.5, "Category": "Office Supplies"}]
+	# Later appends follow the new column order without re-reading row 1
+	client.append_row({"date": "2024-01-03", "vendor": "Uber", "amount": 9, "category": "Travel"})
+	assert fake_worksheet.append_row.call_args[0][0] == ["Uber", "2024-01-03", 9, "Travel"]
+	fake_worksheet.row_values.assert_called_once_with(1)
+
+
+def test_google_sheets_client_caches_header_layout_between_appends():
+	fake_worksheet = MagicMock()
+	fake_worksheet.row_values = MagicMock(return_value=["Date", "Vendor", "Amount"])
+	client = GoogleSheetsClient()
+	client._sheet = fake_worksheet
+
+	first = client.append_row({"date": "2024-01-01", "vendor": "ACME", "amount": 1})
+	client.append_row({"date": "2024-01-02", "vendor": "ACME", "amount": 2})
+	assert first == {"Date": "2024-01-01", "Vendor": "ACME", "Amount": 1}
+	fake_worksheet.row_values.assert_called_once_with(1)
+	fake_worksheet.get_all_values.assert_not_called()
+
+	# A write rejected for its range re-reads the layout once and retries with the new column order
+	fake_worksheet.row_values.return_value = ["Vendor", "Amount"]
+	fake_worksheet.append_row.side_effect = [_api_error(400, "Range ('Expenses'!A5:C5) exceeds grid limits. Max rows: 4, max columns: 2"), None]
+	client.append_row({"date": "2024-01-03", "vendor": "PaperCo", "amount": 3})
+	assert fake_worksheet.row_values.call_count == 2
+	assert fake_worksheet.append_row.call_args[0][0] == ["PaperCo", 3]
+
+
+def test_google_sheets_client_reports_where_appends_landed():
+	fake_worksheet = MagicMock()
+	fake_worksheet.row_values = MagicMock(return_value=["Date", "Vendor", "Amount"])
+	fake_worksheet.append_row.return_value = {"updates": {"updatedRange": "'Expenses'!A7:C7"}}
+	fake_worksheet.append_rows.return_value = {"updates": {"updatedRange": "Expenses!A8:C9"}}
+	client = GoogleSheetsClient()
+	client._sheet = fake_worksheet
+	assert client.append_row({"date": "2024-01-01", "vendor": "ACME", "amount": 1}).offset == 5
+	written = client.append_rows([{"vendor": "A"}, {"vendor": "B"}])
+	assert written.offset == 6 and [r["Vendor"] for r in written] == ["A", "B"]
+	fake_worksheet.append_row.return_value = None
+	assert client.append_row({"vendor": "C"}).offset is None
+
+
+def test_google_sheets_client_does_not_resend_appends_that_may_have_landed():
+	fake_worksheet = MagicMock()
+	fake_worksheet.row_values = MagicMock(return_value=["Date", "Vendor", "Amount"])
+	client = GoogleSheetsClient()
+	client._sheet = fake_worksheet
+	for error in (TimeoutError("read timed out"), _api_error(503, "The service is currently unavailable.")):
+		fake_worksheet.append_row.reset_mock()
+		fake_worksheet.append_row.side_effect = error
+		with pytest.raises(type(error)):
+			client.append_row({"date": "2024-01-03", "vendor": "PaperCo", "amount": 3})
+		assert fake_worksheet.append_row.call_count == 1
@@ -0,0 +1,128 @@
+import threading
+import time
+
+import pytest
+from unittest.mock import patch, MagicMock
+
+from models.granite_client import GraniteClient
+from models.iam_token import IamTokenProvider, shared_token_provider
+from models.vision_client import VisionClient
+
+
+def _iam_response(token: str, expires_in: float = 3600) -> MagicMock:
+	resp = MagicMock()
+	resp.raise_for_status.return_value = None
+	resp.json.return_value = {"access_token": token, "expires_in": expires_in}
+	return resp
+
+
+def _wait_for(predicate, timeout: float = 5.0) -> None:
+	deadline = time.time() + timeout
+	while not predicate():
+		assert time.time() < deadline, "timed out"
+		time.sleep(0.005)
+
+
+def test_token_is_cached_until_expiry():
+	now = [1000.0]
+	provider = IamTokenProvider("key", clock=lambda: now[0])
+	with patch("models.iam_token.requests.post", side_effect=[_iam_response("t1"), _iam_response("t2")]) as mock_post:
+		assert provider.token() == "t1"
+		assert provider.token() == "t1"
+		assert mock_post.call_count == 1
+		assert mock_post.call_args.kwargs["data"]["apikey"] == "key"
+		# Within the expiry margin the token is no longer handed out
+		now[0] += 3600 - 30
+		assert provider.token() == "t2"
+	provider.stop()
+	metrics = provider.metrics()
+	assert (metrics["fetches"], metrics["hits"], metrics["failures"]) == (2, 1, 0)
+
+
+def test_concurrent_callers_share_one_fetch():
+	provider = IamTokenProvider("key")
+	release = threading.Event()
+
+	def slow_post(*args, **kwargs):
+		release.wait(5)
+		return _iam_response("t1")
+
+	with patch("models.iam_token.requests.post", side_effect=slow_post) as mock_post:
+		tokens = []
+		threads = [threading.Thread(target=lambda: tokens.append(provider.token())) for _ in range(8)]
+		for t in threads:
+			t.start()
+		_wait_for(lambda: provider.metrics()["waits"] == 7)
+		release.set()
+		for t in threads:
+			t.join(5)
+	provider.stop()
+	assert tokens == ["t1"] * 8
+	assert mock_post.call_count == 1
+
+
+def test_waiting_callers_share_the_fetch_error():
+	provider = IamTokenProvider("key")
+	release = threading.Event()
+
+	def failing_post(*args, **kwargs):
+		release.wait(5)
+		raise ConnectionError("iam down")
+
+	errors = []
+
+	def call() -> None:
+		try:
+			provider.token()
+		except ConnectionError as e:
+			errors.append(e)
+
+	with patch("models.iam_token.requests.post", side_effect=failing_post) as mock_post:
+		threads = [threading.Thread(target=call) for _ in range(3)]
+		for t in threads:
+			t.start()
+		_wait_for(lambda: provider.metrics()["waits"] == 2)
+		release.set()
+		for t in threads:
+			t.join(5)
+	assert len(errors) == 3
+	assert mock_post.call_count == 1
+	assert provider.metrics()["failures"] == 1
+
+
+def test_background_refresh_does_not_block_callers():
+	# Refresh is due halfway through a 0.2s token's lifetime
+	provider = IamTokenProvider("key", refresh_margin_seconds=1.0, expiry_margin_seconds=0.0)
+	release = threading.Event()
+	responses = iter([_iam_response("t1", expires_in=0.2), "blocked"])
+
+	def post(*args, **kwargs):
+		resp = next(responses)
+		if resp == "blocked":
+			release.wait(5)
+			return _iam_response("t2", expires_in=60)
+		return resp
+
+	with patch("models.iam_token.requests.post", side_effect=post):
+		assert provider.token() == "t1"
+		_wait_for(lambda: provider._inflight)
+		# The refresh is stuck in IAM; callers keep the still-valid token
+		started = time.perf_counter()
+		assert provider.token() == "t1"
+		assert time.perf_counter() - started < 0.05
+		release.set()
+		_wait_for(lambda: provider.metrics()["refreshes"] == 1)
+		assert provider.token() == "t2"
+	provider.stop()
+	assert provider.metrics()["fetches"] == 1
+
+
+def test_watsonx_clients_share_one_provider():
+	with patch.dict("os.environ", {"WATSONX_API_KEY": "shared-key"}):
+		granite = GraniteClient()
+		vision = VisionClient("vision-model")
+	assert granite._tokens is vision._tokens
+	assert granite._tokens is shared_token_provider("shared-key")
+	with patch.object(granite._tokens, "token", return_value="tok"):
+		assert granite._ensure_token() == "tok"
+		assert vision._ensure_token() == "tok"
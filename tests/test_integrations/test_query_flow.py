@@ -1,12 +1,17 @@
 import json
+import threading
+import time
 from unittest.mock import MagicMock, patch
 from datetime import date
 
+import pytest
+
 from tools.query_analyzer import QueryAnalyzer
 from tools.controller import Controller
 from tools.text_extractor import TextExtractor
 from tools.receipt_processor import ReceiptProcessor
 from tools.sheets_manager import SheetsManager
+from tools.search_cursor import EXPIRED_MESSAGE
 
 
 def test_query_analyzer_parses_json():
@@ -224,4 +229,445 @@ def test_compare_this_month_vs_last_month_for_office_supplies():
 	controller = Controller(text_extractor=MagicMock(spec=TextExtractor), receipt_processor=MagicMock(spec=ReceiptProcessor), sheets_manager=sheets, query_analyzer=qa)
 	msg = controller.handle_query("Compare this month vs last month for office supplies")
 	assert msg.startswith("Compare: baseline total 30.00")
-	assert "target total 10.00" in msg 
\ No newline at end of file
+	assert "target total 10.00" in msg 
+
+def test_compare_outside_the_cube_reads_all_windows_in_one_call():
+	granite = MagicMock()
+	granite.generate.return_value = json.dumps({
+		"intent": "compare",
+		"filters": {"min_amount": 5},
+		"compare": {"enabled": True, "baseline": {"start_date": "2024-01-01", "end_date": "2024-01-31"}, "target": {"start_date": "2024-02-01", "end_date": "2024-02-29"}},
+	})
+	granite.parse_json.side_effect = lambda t: json.loads(t)
+	sheets = MagicMock(spec=SheetsManager)
+	sheets.query_expenses.return_value = [
+		{"date": "2024-01-10", "category": "Meals", "vendor": "ACME", "amount": 10},
+		# No receipt date in February: the window falls back to processed_date
+		{"date": "", "category": "Meals", "vendor": "ACME", "amount": 8, "processed_date": "2024-02-03T09:00:00"},
+	]
+	controller = Controller(text_extractor=MagicMock(spec=TextExtractor), receipt_processor=MagicMock(spec=ReceiptProcessor), sheets_manager=sheets, query_analyzer=QueryAnalyzer(granite))
+	with patch.object(controller.table, "window_totals", wraps=controller.table.window_totals) as windows, patch.object(controller.table, "select", wraps=controller.table.select) as select:
+		msg = controller.handle_query("compare january and february over $5")
+	assert msg == "Compare: baseline total 10.00 (1); target total 8.00 (1); delta -2.00 (-20.0%)"
+	windows.assert_called_once()
+	select.assert_not_called()
+
+
+def test_compare_series_reports_each_window_against_previous_and_year_ago():
+	def _analyzer(compare):
+		granite = MagicMock()
+		granite.generate.return_value = json.dumps({
+			"intent": "compare",
+			"time_range": {"start_date": "2024-01-01", "end_date": "2024-03-31", "relative": None},
+			"filters": {},
+			"compare": compare,
+		})
+		granite.parse_json.side_effect = lambda t: json.loads(t)
+		return QueryAnalyzer(granite)
+
+	sheets = MagicMock(spec=SheetsManager)
+	sheets.query_expenses.return_value = [
+		{"date": "2023-01-05", "vendor": "ACME", "category": "Meals", "amount": 20},
+		{"date": "2023-03-05", "vendor": "ACME", "category": "Meals", "amount": 40},
+		{"date": "2024-01-10", "vendor": "ACME", "category": "Meals", "amount": 10},
+		{"date": "2024-02-10", "vendor": "ACME", "category": "Meals", "amount": 15},
+		{"date": "2024-02-11", "vendor": "ACME", "category": "Meals", "amount": 5},
+		{"date": "2024-03-10", "vendor": "ACME", "category": "Meals", "amount": 30},
+	]
+	series = {"enabled": True, "series": {"granularity": "month", "count": 3}}
+	qa = _analyzer(series)
+	plan = qa.analyze("each month this quarter", current_date="2024-04-02")
+	assert [p["label"] for p in plan["compare"]["periods"]] == ["2024-01", "2024-02", "2024-03"]
+	assert plan["compare"]["periods"][1] == {"label": "2024-02", "start_date": "2024-02-01", "end_date": "2024-02-29"}
+
+	controller = Controller(text_extractor=MagicMock(spec=TextExtractor), receipt_processor=MagicMock(spec=ReceiptProcessor), sheets_manager=sheets, query_analyzer=qa)
+	msg = controller.handle_query("each month this quarter")
+	assert msg == "Compare: 2024-01 total 10.00 (1); 2024-02 total 20.00 (2), delta 10.00 (100.0%); 2024-03 total 30.00 (1), delta 10.00 (50.0%)"
+
+	controller.query_analyzer = _analyzer(dict(series, relative_to="year_ago"))
+	msg = controller.handle_query("each month this quarter vs last year")
+	assert msg.startswith("Compare: 2024-01 total 10.00 (1) vs year before 20.00 (1), delta -10.00 (-50.0%); 2024-02 total 20.00 (2) vs year before 0.00 (0)")
+	assert msg.endswith("2024-03 total 30.00 (1) vs year before 40.00 (1), delta -10.00 (-25.0%)")
+
+
+def test_controller_answers_from_sqlite_mirror_when_sheet_unavailable():
+	from tools.expense_mirror import ExpenseMirror
+
+	granite = MagicMock()
+	granite.generate.return_value = json.dumps({
+		"intent": "summary",
+		"time_range": {"start_date": "2024-01-01", "end_date": "2024-01-31", "relative": None},
+		"filters": {"categories": ["Office Supplies"]},
+		"group_by": "none",
+	})
+	granite.parse_json.side_effect = lambda t: json.loads(t)
+	qa = QueryAnalyzer(granite)
+
+	rows = [
+		{"date": "2024-01-10", "category": "Office Supplies", "vendor": "ACME", "amount": 10},
+		{"date": "2024-01-11", "category": "Office Supplies", "vendor": "PaperCo", "amount": 5.5},
+		{"date": "2024-02-01", "category": "Office Supplies", "vendor": "ACME", "amount": 20},
+	]
+	sheets = MagicMock(spec=SheetsManager)
+	sheets.query_expenses.return_value = rows
+	mirror = ExpenseMirror()
+	controller = Controller(text_extractor=MagicMock(spec=TextExtractor), receipt_processor=MagicMock(spec=ReceiptProcessor), sheets_manager=sheets, query_analyzer=qa, mirror=mirror)
+	first = controller.handle_query("sum office supplies jan 2024")
+	assert "15.50" in first and "ACME: 10.00" in first
+
+	sheets.query_expenses.side_effect = RuntimeError("rate limited")
+	assert controller.handle_query("sum office supplies jan 2024") == first
+
+
+def test_controller_answers_group_totals_from_rollup_cube():
+	granite = MagicMock()
+	granite.generate.return_value = json.dumps({
+		"intent": "aggregate",
+		"time_range": {"start_date": "2024-01-01", "end_date": "2024-01-31", "relative": None},
+		"filters": {"categories": None, "vendors": None},
+		"group_by": "category",
+	})
+	granite.parse_json.side_effect = lambda t: json.loads(t)
+	qa = QueryAnalyzer(granite)
+	sheets = MagicMock(spec=SheetsManager)
+	sheets.query_expenses.return_value = [
+		{"date": "2024-01-10", "category": "Office Supplies", "vendor": "ACME", "amount": 10},
+		{"date": "2024-01-11", "category": "Travel", "vendor": "Uber", "amount": 25},
+		{"date": "2024-01-20", "category": "Office Supplies", "vendor": "PaperCo", "amount": 5.5},
+		{"date": "2024-02-01", "category": "Travel", "vendor": "Uber", "amount": 20},
+	]
+	controller = Controller(text_extractor=MagicMock(spec=TextExtractor), receipt_processor=MagicMock(spec=ReceiptProcessor), sheets_manager=sheets, query_analyzer=qa)
+	with patch.object(controller.table, "select", wraps=controller.table.select) as row_select:
+		msg = controller.handle_query("spend by category in january")
+	row_select.assert_not_called()
+	assert msg == "Travel: $25.00 (1 transactions); Office Supplies: $15.50 (2 transactions)"
+
+
+def test_controller_builds_rollup_cube_on_first_plan_it_answers():
+	granite = MagicMock()
+	granite.parse_json.side_effect = lambda t: json.loads(t)
+	sheets = MagicMock(spec=SheetsManager)
+	sheets.query_expenses.return_value = [
+		{"date": "2024-01-10", "category": "Travel", "vendor": "Uber", "amount": 25},
+		{"date": "2024-01-11", "category": "Meals", "vendor": "Cafe", "amount": 8},
+	]
+	controller = Controller(text_extractor=MagicMock(spec=TextExtractor), receipt_processor=MagicMock(spec=ReceiptProcessor), sheets_manager=sheets, query_analyzer=QueryAnalyzer(granite))
+	with patch.object(controller.rollup, "sync", wraps=controller.rollup.sync) as cube_sync:
+		granite.generate.return_value = json.dumps({"intent": "search", "filters": {"vendors": ["Uber"]}, "output": {"format": "table"}})
+		controller.handle_query("list uber expenses")
+		# Search plans never read the cube, so it is not built
+		cube_sync.assert_not_called()
+		assert len(controller.rollup) == 0
+		granite.generate.return_value = json.dumps({"intent": "aggregate", "group_by": "category"})
+		assert controller.handle_query("spend by category") == "Travel: $25.00 (1 transactions); Meals: $8.00 (1 transactions)"
+		cube_sync.assert_called_once()
+		assert len(controller.rollup) == 2
+
+
+def test_controller_routes_top_n_to_the_cube_only_for_single_month_windows():
+	granite = MagicMock()
+	granite.parse_json.side_effect = lambda t: json.loads(t)
+	sheets = MagicMock(spec=SheetsManager)
+	sheets.query_expenses.return_value = [
+		{"date": "2024-01-10", "category": "Travel", "vendor": "Uber", "amount": 25},
+		{"date": "2024-02-11", "category": "Meals", "vendor": "Cafe", "amount": 30},
+		{"date": "2024-03-20", "category": "Travel", "vendor": "Uber", "amount": 10},
+	]
+	controller = Controller(text_extractor=MagicMock(spec=TextExtractor), receipt_processor=MagicMock(spec=ReceiptProcessor), sheets_manager=sheets, query_analyzer=QueryAnalyzer(granite))
+
+	def ask(start, end):
+		granite.generate.return_value = json.dumps({
+			"intent": "top_n",
+			"time_range": {"start_date": start, "end_date": end, "relative": None},
+			"top_n": {"enabled": True, "dimension": "vendor", "limit": 2},
+		})
+		with patch.object(controller.rollup, "top", wraps=controller.rollup.top) as cube_top, patch.object(controller.table, "top", wraps=controller.table.top) as row_top:
+			msg = controller.handle_query(f"top vendors {start} {end}")
+		return msg, cube_top.call_count, row_top.call_count
+
+	assert ask(None, None) == ("Summary: Top 2 vendor(s): Uber: 35.00; Cafe: 30.00", 1, 0)
+	assert ask("2024-02-01", "2024-02-29") == ("Summary: Top 2 vendor(s): Cafe: 30.00", 1, 0)
+	# A bounded multi-month window goes to the row engine instead of merging monthly boards
+	assert ask("2024-01-01", "2024-02-29") == ("Summary: Top 2 vendor(s): Cafe: 30.00; Uber: 25.00", 0, 1)
+
+
+def test_controller_trend_on_processed_date_fallback_buckets_by_receipt_date():
+	granite = MagicMock()
+	granite.generate.return_value = json.dumps({
+		"intent": "trend",
+		"time_range": {"start_date": None, "end_date": None, "relative": "last_month"},
+		"trend": {"enabled": True, "granularity": "month"},
+	})
+	granite.parse_json.side_effect = lambda t: json.loads(t)
+	sheets = MagicMock(spec=SheetsManager)
+	# Nothing dated in May: the processed_date stage selects both rows, the undated one has no month to go in
+	sheets.query_expenses.return_value = [
+		{"date": "2024-04-28", "vendor": "ACME", "category": "Office Supplies", "amount": 10, "processed_date": "2024-05-02T09:00:00"},
+		{"date": "", "vendor": "ACME", "category": "Office Supplies", "amount": 5, "processed_date": "2024-05-03T09:00:00"},
+	]
+	controller = Controller(text_extractor=MagicMock(spec=TextExtractor), receipt_processor=MagicMock(spec=ReceiptProcessor), sheets_manager=sheets, query_analyzer=QueryAnalyzer(granite))
+	with patch("tools.controller.date") as mock_date:
+		mock_date.today.return_value = date(2024, 6, 10)
+		mock_date.side_effect = lambda *args, **kwargs: date(*args, **kwargs)
+		with patch.object(controller.rollup, "trend", wraps=controller.rollup.trend) as cube_trend:
+			msg = controller.handle_query("monthly trend last month")
+	cube_trend.assert_not_called()
+	assert "2024-04" in msg and "10.00" in msg
+	assert "2024-05" not in msg and "15.00" not in msg
+
+
+def test_query_analyzer_plan_cache_reuses_plans_across_days(tmp_path):
+	from tools.plan_cache import PlanCache
+
+	granite = MagicMock()
+	granite.parse_json.side_effect = lambda t: json.loads(t)
+	granite.generate.return_value = json.dumps({
+		"intent": "summary",
+		"time_range": {"start_date": "2024-04-01", "end_date": "2024-04-30", "relative": "last_month"},
+	})
+	path = tmp_path / "plans.json"
+	qa = QueryAnalyzer(granite, plan_cache=PlanCache(str(path)))
+	assert qa.analyze("How much did we spend last month?", current_date="2024-05-15")["time_range"]["start_date"] == "2024-04-01"
+	# Same question, different wording and day, after a restart: no Granite call, range re-resolved
+	qa = QueryAnalyzer(granite, plan_cache=PlanCache(str(path)))
+	plan = qa.analyze("  how much did we spend LAST month ", current_date="2024-07-02")
+	assert granite.generate.call_count == 1
+	assert plan["time_range"] == {"start_date": "2024-06-01", "end_date": "2024-06-30", "relative": "last_month"}
+
+	# Explicit dates are only reused on the day they were resolved
+	granite.generate.return_value = json.dumps({"intent": "summary", "time_range": {"start_date": "2024-01-01", "end_date": "2024-01-31", "relative": None}})
+	qa.analyze("spend in january", current_date="2024-07-02")
+	qa.analyze("spend in january", current_date="2024-07-02")
+	assert granite.generate.call_count == 2
+	qa.analyze("spend in january", current_date="2025-07-02")
+	assert granite.generate.call_count == 3
+
+
+def test_query_analyzer_does_not_cache_unusable_granite_output():
+	from tools.plan_cache import PlanCache
+
+	granite = MagicMock()
+	granite.parse_json.side_effect = lambda t: json.loads(t)
+	qa = QueryAnalyzer(granite, plan_cache=PlanCache())
+	for text in ("[1, 2]", json.dumps({"intent": "chitchat"}), json.dumps({"filters": {}})):
+		granite.generate.return_value = text
+		assert qa.analyze("how much last month", current_date="2024-05-15")["intent"] == "summary"
+	assert granite.generate.call_count == 3
+	assert len(qa.plan_cache) == 0
+	# A valid plan is cached and answers the next ask
+	granite.generate.return_value = json.dumps({"intent": "trend", "time_range": {"relative": "last_month"}})
+	qa.analyze("how much last month", current_date="2024-05-15")
+	assert qa.analyze("how much last month", current_date="2024-05-15")["intent"] == "trend"
+	assert granite.generate.call_count == 4
+
+
+def test_plan_cache_expires_and_evicts(monkeypatch):
+	from tools import plan_cache as plan_cache_module
+	from tools.plan_cache import PlanCache
+
+	now = [1000.0]
+	monkeypatch.setattr(plan_cache_module.time, "time", lambda: now[0])
+	cache = PlanCache(ttl_seconds=60, max_entries=2)
+	cache.put("a", {"intent": "summary"})
+	cache.put("b", {"intent": "search"})
+	assert cache.get("a") == {"intent": "summary"}
+	cache.put("c", {"intent": "trend"})
+	assert cache.get("b") is None
+	now[0] += 61
+	assert cache.get("a") is None and cache.get("c") is None
+	assert (cache.hits, cache.misses) == (1, 3)
+
+
+def test_controller_fetches_rows_while_plan_is_generated():
+	both_running = threading.Barrier(2, timeout=2)
+
+	def slow_generate(prompt):
+		# Only returns once the row fetch is in flight at the same time
+		both_running.wait()
+		time.sleep(0.05)
+		return json.dumps({"intent": "summary", "filters": {"vendors": ["ACME"]}})
+
+	def slow_rows(filters):
+		both_running.wait()
+		time.sleep(0.05)
+		return [{"date": "2024-01-10", "category": "Office Supplies", "vendor": "ACME", "amount": 10}]
+
+	granite = MagicMock()
+	granite.generate.side_effect = slow_generate
+	granite.parse_json.side_effect = lambda t: json.loads(t)
+	sheets = MagicMock(spec=SheetsManager)
+	sheets.query_expenses.side_effect = slow_rows
+	controller = Controller(text_extractor=MagicMock(spec=TextExtractor), receipt_processor=MagicMock(spec=ReceiptProcessor), sheets_manager=sheets, query_analyzer=QueryAnalyzer(granite))
+	assert "$10.00" in controller.handle_query("total for acme")
+
+	# An unusable plan surfaces the analyzer error; the prefetch only warmed the cache
+	granite.generate.side_effect = None
+	granite.generate.return_value = "not json"
+	granite.parse_json.side_effect = ValueError("Invalid JSON from query analysis")
+	sheets.query_expenses.side_effect = None
+	sheets.query_expenses.return_value = []
+	with pytest.raises(ValueError):
+		controller.handle_query("total for acme")
+
+
+def test_controller_result_cache_serves_repeats_until_rows_change():
+	from tools.result_cache import ResultCache
+
+	granite = MagicMock()
+	granite.generate.return_value = json.dumps({"intent": "summary", "filters": {"vendors": ["ACME"]}})
+	granite.parse_json.side_effect = lambda t: json.loads(t)
+	rows = [{"date": "2024-01-10", "category": "Office Supplies", "vendor": "ACME", "amount": 10}]
+	sheets = MagicMock(spec=SheetsManager)
+	sheets.query_expenses.return_value = rows
+	results = ResultCache()
+	controller = Controller(text_extractor=MagicMock(spec=TextExtractor), receipt_processor=MagicMock(spec=ReceiptProcessor), sheets_manager=sheets, query_analyzer=QueryAnalyzer(granite), result_cache=results)
+	first = controller.handle_query("total for acme")
+	with patch.object(controller, "_execute_plan", wraps=controller._execute_plan) as execute:
+		assert controller.handle_query("total for acme") == first
+		execute.assert_not_called()
+		# An append to the row cache bumps the data version; the cached answer is not served
+		rows.append({"date": "2024-01-12", "category": "Office Supplies", "vendor": "ACME", "amount": 5})
+		assert "$15.00" in controller.handle_query("total for acme")
+		execute.assert_called_once()
+	assert (results.hits, results.stale) == (1, 1)
+
+
+def test_controller_pages_large_search_results_in_plan_sort_order():
+	granite = MagicMock()
+	granite.generate.return_value = json.dumps({
+		"intent": "search",
+		"filters": {"vendors": ["ACME"]},
+		"sort": {"by": "amount", "direction": "desc"},
+		"output": {"format": "table"},
+	})
+	granite.parse_json.side_effect = lambda t: json.loads(t)
+	sheets = MagicMock(spec=SheetsManager)
+	sheets.query_expenses.return_value = [{"date": f"2024-01-{i % 28 + 1:02d}", "category": "Meals", "vendor": "ACME", "amount": i} for i in range(1, 46)]
+	controller = Controller(text_extractor=MagicMock(spec=TextExtractor), receipt_processor=MagicMock(spec=ReceiptProcessor), sheets_manager=sheets, query_analyzer=QueryAnalyzer(granite))
+	controller.settings.rules.search_page_size = 20
+	with patch.object(controller.table, "rows", wraps=controller.table.rows) as fetched:
+		first = controller.handle_query("list acme expenses")
+		lines = first.splitlines()
+		assert lines[1] == "2024-01-18 | ACME | 45.00 | Meals"
+		assert lines[-1] == 'Showing rows 1-20 of 45. Reply "more" for the next page.'
+		# Only the page being rendered is materialized
+		assert [len(call.args[0]) for call in fetched.call_args_list] == [20]
+		cursor = first.cursor
+		assert cursor.next_page().splitlines()[-1] == 'Showing rows 21-40 of 45. Reply "more" for the next page.'
+		last = cursor.next_page()
+		assert last.splitlines()[-2:] == ["2024-01-02 | ACME | 1.00 | Meals", "Showing rows 41-45 of 45."]
+		assert cursor.next_page() is None and not cursor.has_more
+
+
+def test_search_cursor_expires_when_the_engine_rebuilds():
+	granite = MagicMock()
+	granite.generate.return_value = json.dumps({"intent": "search", "filters": {"vendors": ["ACME"]}, "output": {"format": "table"}})
+	granite.parse_json.side_effect = lambda t: json.loads(t)
+	rows = [{"date": f"2024-01-{i % 28 + 1:02d}", "category": "Meals", "vendor": "ACME", "amount": i} for i in range(1, 46)]
+	sheets = MagicMock(spec=SheetsManager)
+	sheets.query_expenses.return_value = rows
+	controller = Controller(text_extractor=MagicMock(spec=TextExtractor), receipt_processor=MagicMock(spec=ReceiptProcessor), sheets_manager=sheets, query_analyzer=QueryAnalyzer(granite))
+	controller.settings.rules.search_page_size = 20
+	cursor = controller.handle_query("list acme expenses").cursor
+	# Appends keep the ordered row ids valid
+	rows.append({"date": "2024-01-30", "category": "Meals", "vendor": "ACME", "amount": 99})
+	controller.table.sync(rows)
+	assert cursor.next_page().splitlines()[-1] == 'Showing rows 21-40 of 45. Reply "more" for the next page.'
+	# The sheet shrank: the remaining pages would name other rows, or none
+	sheets.query_expenses.return_value = rows[:10]
+	controller.table.sync(sheets.query_expenses.return_value)
+	assert cursor.next_page() == EXPIRED_MESSAGE
+	assert cursor.expired and not cursor.has_more
+
+
+def test_controller_answers_distribution_metrics_from_sketches():
+	granite = MagicMock()
+	granite.parse_json.side_effect = lambda t: json.loads(t)
+	qa = QueryAnalyzer(granite)
+	sheets = MagicMock(spec=SheetsManager)
+	sheets.query_expenses.return_value = [
+		{"date": f"2024-01-{d:02d}", "category": "Travel", "vendor": "Uber", "amount": amt}
+		for d, amt in [(3, 12.0), (5, 18.0), (9, 20.0), (14, 22.0), (20, 95.0)]
+	] + [{"date": "2024-01-10", "category": "Meals", "vendor": "Cafe", "amount": 8.0}]
+	controller = Controller(text_extractor=MagicMock(spec=TextExtractor), receipt_processor=MagicMock(spec=ReceiptProcessor), sheets_manager=sheets, query_analyzer=qa)
+
+	granite.generate.return_value = json.dumps({"intent": "summary", "metric": "median", "filters": {"vendors": ["Uber"]}})
+	with patch.object(controller.table, "select", wraps=controller.table.select) as row_select:
+		msg = controller.handle_query("what's a typical Uber ride")
+	row_select.assert_not_called()
+	# Sketched quantiles are within 1% (the median is 20.00); mean, min, max and stddev are exact
+	assert msg == "The median expense on Uber is *$19.89* (5 transactions; average $33.40, p90 $21.98, min $12.00, max $95.00, stddev $30.98)"
+
+	granite.generate.return_value = json.dumps({"intent": "aggregate", "metric": "max", "group_by": "vendor"})
+	assert controller.handle_query("largest single expense per vendor") == "Largest expense by vendor: Uber: $95.00 (5 transactions); Cafe: $8.00 (1 transactions)"
+
+	# Sketches are per vendor or per category: both filters are answered exactly by the row engine
+	granite.generate.return_value = json.dumps({"intent": "summary", "metric": "average", "filters": {"vendors": ["Uber"], "categories": ["Travel"]}})
+	with patch.object(controller.table, "select", wraps=controller.table.select) as row_select:
+		msg = controller.handle_query("average Uber travel expense")
+	row_select.assert_called()
+	assert msg.startswith("The average expense on Uber is *$33.40* (5 transactions;")
+
+
+def test_concurrent_queries_never_sync_an_older_row_list_over_a_newer_one():
+	old = [{"date": "2024-01-10", "category": "Travel", "vendor": "Uber", "amount": 25}]
+	new = old + [{"date": "2024-01-11", "category": "Meals", "vendor": "Cafe", "amount": 8}]
+	fetching = threading.Event()
+
+	def query_expenses(_filters):
+		if not fetching.is_set():
+			# The first query's fetch is slow and returns the rows as they were before a flush
+			fetching.set()
+			time.sleep(0.1)
+			return old
+		return new
+
+	sheets = MagicMock(spec=SheetsManager)
+	sheets.query_expenses.side_effect = query_expenses
+	controller = Controller(text_extractor=MagicMock(spec=TextExtractor), receipt_processor=MagicMock(spec=ReceiptProcessor), sheets_manager=sheets)
+	slow = threading.Thread(target=controller._query_engine)
+	slow.start()
+	assert fetching.wait(2)
+	controller._query_engine()
+	slow.join(2)
+	assert len(controller.table) == 2
+	assert controller._ensure_rollup() and len(controller.rollup) == 2
+
+
+def test_controller_explain_reports_plan_fallbacks_caches_and_stage_timings(caplog):
+	from tools.result_cache import ResultCache
+
+	granite = MagicMock()
+	granite.parse_json.side_effect = lambda t: json.loads(t)
+	granite.generate.return_value = json.dumps({"intent": "summary", "time_range": {"relative": "last_month"}, "filters": {"vendors": ["ACME"]}})
+	sheets = MagicMock(spec=SheetsManager)
+	# Receipt dated December, processed in January: the receipt-date stage finds no rows, processed_date finds it
+	sheets.query_expenses.return_value = [{"date": "2023-12-30", "category": "Office Supplies", "vendor": "ACME", "amount": 10, "processed_date": "2024-01-02T09:00:00"}]
+	controller = Controller(text_extractor=MagicMock(spec=TextExtractor), receipt_processor=MagicMock(spec=ReceiptProcessor), sheets_manager=sheets, query_analyzer=QueryAnalyzer(granite), result_cache=ResultCache())
+	with patch("tools.controller.date") as mock_date, caplog.at_level("INFO", logger="tools.controller"):
+		mock_date.today.return_value = date(2024, 2, 15)
+		mock_date.side_effect = lambda *args, **kwargs: date(*args, **kwargs)
+		report = controller.handle_query("explain: what did ACME cost last month")
+		lines = report.splitlines()
+		assert lines[0] == "EXPLAIN what did ACME cost last month"
+		assert lines[1].startswith('Plan (granite): {"compare"')
+		assert 'Fallbacks: [{"stage": "receipt date", "rows": 0}, {"stage": "processed_date", "rows": 1}]' in lines
+		assert "Engine: rollup cube" in lines and "Result cache: miss, stored" in lines
+		stages = {line.strip()[2:].split(":")[0] for line in lines if line.lstrip().startswith("- ")}
+		assert stages == {"rows", "sheets", "index_sync", "analyze", "wait_rows", "execute", "select", "aggregate"}
+		assert lines[-1] == "Answer: Your total spend on ACME is *$10.00* (1 transactions)"
+
+		# Every query logs the same profile as one JSON line; a repeat is answered from the result cache
+		caplog.clear()
+		assert controller.handle_query("what did ACME cost last month") == "Your total spend on ACME is *$10.00* (1 transactions)"
+	logged = [r.getMessage() for r in caplog.records if r.getMessage().startswith("Query profile: ")]
+	record = json.loads(logged[-1][len("Query profile: "):])
+	assert record["notes"]["result_cache"].startswith("hit") and record["notes"]["plan_source"] == "granite"
+	assert {"analyze", "rows", "sheets", "index_sync", "wait_rows", "execute"} <= {s["stage"] for s in record["stages"]}
+
+	with patch("tools.controller.date") as mock_date:
+		mock_date.today.return_value = date(2024, 2, 15)
+		mock_date.side_effect = lambda *args, **kwargs: date(*args, **kwargs)
+		# A question that merely starts with "explain" is answered; --explain asks for the report
+		assert controller.handle_query("explain what ACME cost last month") == "Your total spend on ACME is *$10.00* (1 transactions)"
+		assert controller.handle_query("what did ACME cost last month --explain").startswith("EXPLAIN what did ACME cost last month")
@@ -0,0 +1,40 @@
+from tools.duplicate_index import DuplicateIndex
+
+
+def test_duplicate_index_matches_normalized_keys_and_receipt_numbers():
+	rows = [
+		{"vendor": " ACME ", "date": "2024-01-01", "amount": "12.34"},
+		{"vendor": "PaperCo", "date": "2024-01-02", "amount": 5, "receipt_number": "R-77"},
+		{"vendor": "Broken", "date": "2024-01-03", "amount": "n/a"},
+	]
+	index = DuplicateIndex()
+	index.sync(rows)
+	assert index.contains({"vendor": "acme", "date": "2024-01-01", "amount": 12.34})
+	assert not index.contains({"vendor": "acme", "date": "2024-01-01", "amount": 12.35})
+	# Same receipt number at the same vendor is a duplicate even if OCR misread the amount
+	assert index.contains({"vendor": "paperco", "date": "2024-01-02", "amount": 50, "receipt_number": "r-77"})
+	assert not index.contains({"vendor": "Broken", "date": "2024-01-03", "amount": None})
+
+	rows.append({"vendor": "Uber", "date": "2024-01-04", "amount": 9})
+	index.sync(rows)
+	assert index.contains({"vendor": "uber", "date": "2024-01-04", "amount": "9.00"})
+	# A replaced row list rebuilds the index
+	index.sync([])
+	assert not index.contains({"vendor": "uber", "date": "2024-01-04", "amount": 9})
+
+
+def test_duplicate_index_finds_near_duplicates_from_ocr_noise():
+	index = DuplicateIndex()
+	index.sync([
+		{"vendor": "Walmart", "date": "2024-03-10", "amount": 38.68},
+		{"vendor": "Staples", "date": "2024-03-10", "amount": 38.66},
+	])
+	match = index.find({"vendor": "WAL*MART", "date": "2024-03-10", "amount": 38.66})
+	assert match is not None and not match.exact
+	assert match.row["vendor"] == "Walmart" and 0.8 < match.score < 1.0
+	# Date off by one day with the same amount
+	assert index.find({"vendor": "Walmart", "date": "2024-03-11", "amount": 38.68}).row["vendor"] == "Walmart"
+	# Date and amount both off, or a different vendor, are not duplicates
+	assert index.find({"vendor": "Walmart", "date": "2024-03-11", "amount": 38.60}) is None
+	assert index.find({"vendor": "Uber", "date": "2024-03-10", "amount": 38.68}) is None
+	assert index.find({"vendor": "WAL*MART", "date": "2024-03-10", "amount": 38.66}, near=False) is None
@@ -0,0 +1,64 @@
+from datetime import date
+
+from tools.expense_mirror import ExpenseMirror
+from tools.expense_table import ExpenseTable
+
+
+ROWS = [
+	{"date": "2024-01-10", "vendor": "ACME", "category": "Office Supplies", "amount": 10, "description": "pens", "processed_date": "2024-02-01T10:00:00-05:00"},
+	{"date": "2024-01-11", "vendor": "PaperCo", "category": "Office Supplies", "amount": "5.5", "description": "printer ink", "location": "NYC"},
+	{"date": "2024-02-02", "vendor": "ACME", "category": "Groceries", "amount": 20},
+	{"date": "not a date", "vendor": "Uber", "category": "Travel & Transportation", "amount": 7.25},
+]
+
+
+def test_expense_mirror_matches_expense_table():
+	mirror = ExpenseMirror()
+	mirror.sync(ROWS)
+	scan = ExpenseTable()
+	scan.sync(ROWS)
+	cases = [
+		({}, None, None, False),
+		({"categories": ["Office Supplies"]}, date(2024, 1, 1), date(2024, 1, 31), False),
+		({"vendors": ["ACME"], "min_amount": 15}, None, None, False),
+		({"text_search": "Ink"}, None, None, False),
+		({}, date(2024, 2, 1), date(2024, 2, 29), True),
+	]
+	for filters, start, end, processed in cases:
+		m = mirror.select(filters, start, end, processed)
+		s = scan.select(filters, start, end, processed)
+		assert mirror.total(m) == scan.total(s)
+		assert sorted(mirror.group(m, "vendor")) == sorted(scan.group(s, "vendor"))
+		assert mirror.trend(m, "quarter") == scan.trend(s, "quarter")
+		assert mirror.top(m, "category", 2) == scan.top(s, "category", 2)
+		assert mirror.stats(m) == scan.stats(s)
+		assert mirror.stats(m, "vendor") == scan.stats(s, "vendor")
+		assert mirror.stats(m, "date") == scan.stats(s, "date")
+	assert mirror.vendors() == scan.vendors()
+
+
+def test_expense_mirror_syncs_incrementally_and_rebuilds_on_new_source():
+	rows = list(ROWS[:2])
+	mirror = ExpenseMirror()
+	mirror.sync(rows)
+	rows.append(ROWS[2])
+	mirror.sync(rows)
+	assert mirror.total(mirror.select({}, None, None)) == (35.5, 3)
+	mirror.sync([ROWS[3]])
+	assert [r["vendor"] for r in mirror.rows(mirror.select({}, None, None))] == ["Uber"]
+
+
+def test_expense_mirror_orders_and_pages_like_expense_table():
+	mirror = ExpenseMirror()
+	mirror.sync(ROWS)
+	scan = ExpenseTable()
+	scan.sync(ROWS)
+	for by in ("date", "amount", "vendor", "category"):
+		for direction in ("asc", "desc"):
+			m = mirror.order(mirror.select({}, None, None), by, direction)
+			s = scan.order(scan.select({}, None, None), by, direction)
+			assert [[(r["date"], r["vendor"]) for r in mirror.page(m, offset, 2)] for offset in (0, 2)] == [[(r["date"], r["vendor"]) for r in scan.page(s, offset, 2)] for offset in (0, 2)]
+	# Pages stay pinned to the rows present when the order was taken
+	m = mirror.order(mirror.select({}, None, None), "amount", "desc")
+	mirror.sync(ROWS + [{"date": "2024-03-01", "vendor": "Late", "amount": 999}])
+	assert [r["vendor"] for r in mirror.page(m, 0, 10)] == ["ACME", "ACME", "Uber", "PaperCo"]
@@ -0,0 +1,118 @@
+from datetime import date
+
+from tools.expense_table import ExpenseTable
+
+
+def _rows(n):
+	return [
+		{"date": f"2024-{(i % 12) + 1:02d}-15", "vendor": f"V{i % 7}", "category": "Meals" if i % 2 else "Travel", "amount": i, "processed_date": "2024-06-01T09:00:00"}
+		for i in range(n)
+	]
+
+
+def test_expense_table_filters_and_aggregates():
+	rows = _rows(24) + [{"date": "", "vendor": "NoDate", "category": "Meals", "amount": "bad"}]
+	table = ExpenseTable()
+	table.sync(rows)
+	sel = table.select({"categories": ["Meals"], "min_amount": 5}, date(2024, 1, 1), date(2024, 6, 30))
+	expected = [r for r in rows[:24] if r["category"] == "Meals" and r["amount"] >= 5 and r["date"] <= "2024-06-30"]
+	assert table.total(sel) == (float(sum(r["amount"] for r in expected)), len(expected))
+	assert table.rows(sel) == expected
+	assert table.trend(table.select({}, None, None), "quarter")[0] == ("2024-Q1", float(0 + 1 + 2 + 12 + 13 + 14), 6)
+	assert table.top(table.select({}, None, None), "vendor", 1) == [("V2", float(2 + 9 + 16 + 23))]
+	assert ("NoDate", 0.0, 1) in table.group(table.select({}, None, None), "vendor")
+	# The undated row never matches a date bound
+	assert table.count(table.select({"vendors": ["NoDate"]}, date(2000, 1, 1), None)) == 0
+
+
+def test_expense_table_syncs_incrementally_and_grows():
+	rows = _rows(10)
+	table = ExpenseTable()
+	table.sync(rows)
+	rows.extend(_rows(3000))
+	table.sync(rows)
+	assert len(table) == 3010
+	assert table.total(table.select({}, None, None))[1] == 3010
+	# A replaced list (full cache reload) rebuilds the table
+	table.sync(_rows(5))
+	assert len(table) == 5
+
+
+def test_expense_table_date_index_matches_full_scan():
+	import random
+
+	rng = random.Random(3)
+	rows = []
+	table = ExpenseTable()
+	for batch in range(4):
+		# Out-of-order and undated rows, appended across several syncs
+		for _ in range(250):
+			day = date(2023, 1, 1).toordinal() + rng.randrange(730)
+			rows.append({
+				"date": date.fromordinal(day).isoformat() if rng.random() > 0.05 else "",
+				"vendor": f"V{rng.randrange(5)}",
+				"amount": rng.randrange(100),
+				"processed_date": f"{date.fromordinal(day + rng.randrange(3)).isoformat()}T10:00:00",
+			})
+		table.sync(rows)
+		for _ in range(20):
+			start = date.fromordinal(date(2023, 1, 1).toordinal() + rng.randrange(730))
+			end = date.fromordinal(start.toordinal() + rng.randrange(120))
+			for use_processed in (False, True):
+				key = "processed_date" if use_processed else "date"
+				expected = [r for r in rows if r[key] and start.isoformat() <= r[key][:10] <= end.isoformat() and r["vendor"] == "V1"]
+				assert table.rows(table.select({"vendors": ["V1"]}, start, end, use_processed_date=use_processed)) == expected
+		assert table.count(table.select({}, None, date(2024, 12, 31))) == sum(1 for r in rows if r["date"])
+
+
+def test_expense_table_select_variants_matches_separate_selects():
+	rows = _rows(60) + [{"date": "", "vendor": "NoDate", "category": "Meals", "amount": 3, "description": "team lunch"}]
+	for i, r in enumerate(rows[:60]):
+		r["description"] = "team lunch" if i % 3 else "taxi"
+	table = ExpenseTable()
+	table.sync(rows)
+	meals = {"categories": ["Meals"], "text_search": "lunch", "min_amount": 4}
+	variants = [
+		(meals, date(2024, 3, 1), date(2024, 3, 31), False),
+		(meals, date(2024, 6, 1), date(2024, 6, 30), True),
+		(dict(meals, categories=None), date(2024, 6, 1), date(2024, 6, 30), True),
+		({"vendors": ["NoDate"]}, None, None, False),
+	]
+	for combined, (filters, start, end, use_processed) in zip(table.select_variants(variants), variants):
+		assert combined.tolist() == table.select(filters, start, end, use_processed).tolist()
+
+
+def test_expense_table_window_totals_match_per_window_selects():
+	from tools.expense_mirror import ExpenseMirror
+
+	rows = _rows(120) + [{"date": "", "vendor": "NoDate", "category": "Meals", "amount": 3}]
+	table, mirror = ExpenseTable(), ExpenseMirror()
+	table.sync(rows)
+	mirror.sync(rows)
+	windows = [
+		(date(2024, 1, 1), date(2024, 3, 31)),
+		(date(2024, 3, 1), date(2024, 3, 31)),  # overlaps the first
+		(date(2024, 7, 1), None),
+		(None, date(2024, 2, 28)),
+		(date(2024, 5, 1), date(2024, 4, 1)),  # empty
+		(None, None),  # everything, undated rows included
+	]
+	filters = {"categories": ["Meals"], "min_amount": 10}
+	expected = [table.total(table.select(filters, s, e)) for s, e in windows]
+	for engine in (table, mirror):
+		got = engine.window_totals(filters, windows)
+		assert [c for _, c in got] == [c for _, c in expected]
+		assert all(abs(g - x) < 1e-9 for (g, _), (x, _) in zip(got, expected))
+	assert table.window_totals({}, [(date(2024, 6, 1), date(2024, 6, 1))], use_processed_date=True) == [(float(sum(range(120))), 120)]
+
+	# With the fallback, a window without receipt-date rows takes its processed-date totals from the same pass
+	windows.append((date(2024, 6, 1), date(2024, 6, 1)))
+	expected = []
+	for s, e in windows:
+		by_receipt = table.total(table.select(filters, s, e))
+		expected.append(by_receipt if by_receipt[1] else table.total(table.select(filters, s, e, True)))
+	assert expected[-1][1] > 0
+	for engine in (table, mirror):
+		got = engine.window_totals(filters, windows, processed_fallback=True)
+		assert [c for _, c in got] == [c for _, c in expected]
+		assert all(abs(g - x) < 1e-9 for (g, _), (x, _) in zip(got, expected))
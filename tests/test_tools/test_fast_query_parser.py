@@ -0,0 +1,159 @@
+import json
+from datetime import date
+from unittest.mock import MagicMock
+
+from tools.fast_query_parser import FastQueryParser
+from tools.query_analyzer import QueryAnalyzer
+from tools.vendor_index import VendorIndex
+
+
+def _plan(intent="summary", relative=None, vendors=None, categories=None, min_amount=None, max_amount=None, group_by="none", trend=None, top=None, fmt="summary", metric="total"):
+	# Reference plans as Granite returns them for QUERY_ANALYSIS_PROMPT
+	return {
+		"intent": intent,
+		"time_range": {"start_date": None, "end_date": None, "relative": relative},
+		"filters": {"vendors": vendors, "categories": categories, "min_amount": min_amount, "max_amount": max_amount, "text_search": None},
+		"group_by": group_by,
+		"metric": metric,
+		"trend": {"enabled": bool(trend), "granularity": trend or "month"},
+		"top_n": {"enabled": bool(top), "dimension": (top or ("vendor", 5))[0], "limit": (top or ("vendor", 5))[1]},
+		"compare": {"enabled": False, "baseline": None, "target": None},
+		"sort": {"by": "total" if group_by != "none" or trend else "date", "direction": "desc"},
+		"output": {"format": fmt, "chart": {"type": None, "dimension": None, "metric": None}},
+	}
+
+
+# (query, reference Granite plan); None marks questions the fast path must leave to Granite
+CORPUS = [
+	("total at Walmart this month", _plan(relative="this_month", vendors=["Walmart"])),
+	("How much did we spend at Starbucks last month?", _plan(relative="last_month", vendors=["Starbucks"])),
+	("how much have I spent on office depot", _plan(vendors=["Office Depot"])),
+	("total spent in Walmart", _plan(vendors=["Walmart"])),
+	("Uber spend this year", _plan(relative="this_year", vendors=["Uber"])),
+	("what did we spend on travel last quarter", _plan(relative="last_quarter", categories=["Travel & Transportation"])),
+	("total meals & entertainment this month", _plan(relative="this_month", categories=["Meals & Entertainment"])),
+	("how much on groceries in the last 90 days", _plan(relative="last_90_days", categories=["Groceries"])),
+	("top 5 vendors last quarter", _plan(intent="top_n", relative="last_quarter", group_by="vendor", top=("vendor", 5))),
+	("top vendors this year", _plan(intent="top_n", relative="this_year", group_by="vendor", top=("vendor", 5))),
+	("top 3 categories last month", _plan(intent="top_n", relative="last_month", group_by="category", top=("category", 3))),
+	("Top 10 merchants in the past 90 days", _plan(intent="top_n", relative="last_90_days", group_by="vendor", top=("vendor", 10))),
+	("spend by category this year", _plan(intent="aggregate", relative="this_year", group_by="category")),
+	("expenses by vendor last month", _plan(intent="aggregate", relative="last_month", group_by="vendor")),
+	("spending per category", _plan(intent="aggregate", group_by="category")),
+	("monthly spend this year", _plan(intent="trend", relative="this_year", trend="month")),
+	("spend by quarter", _plan(intent="trend", trend="quarter")),
+	("weekly spending at Uber", _plan(intent="trend", vendors=["Uber"], trend="week")),
+	("show expenses at Walmart over $50", _plan(intent="search", vendors=["Walmart"], min_amount=50.0, fmt="table")),
+	("list office supplies expenses under 20 this month", _plan(intent="search", relative="this_month", categories=["Office Supplies"], max_amount=20.0, fmt="table")),
+	("total spend year to date", _plan(relative="this_year")),
+	("how much did we spend in the last 7 days", _plan(relative="last_7_days")),
+	("typical Uber expense", _plan(vendors=["Uber"], metric="median")),
+	("average spend per vendor last month", _plan(intent="aggregate", relative="last_month", group_by="vendor", metric="mean")),
+	# Left to Granite: unknown vendors, comparisons, explicit dates, free text
+	("how much did we spend on food this month", None),
+	("compare this month vs last month for office supplies", None),
+	("spend at Walmart in January 2024", None),
+	("find receipts mentioning printer ink", None),
+	("total at Trader Joes last week", None),
+	("which vendor did we use most often", None),
+]
+
+
+def _parser():
+	vendors = VendorIndex()
+	vendors.sync([{"vendor": v} for v in ["Walmart", "Starbucks", "Office Depot", "Uber", "Staples"]])
+	return FastQueryParser(vendors)
+
+
+def test_fast_path_matches_reference_plans_and_reports_hit_rate():
+	parser = _parser()
+	qa = QueryAnalyzer(MagicMock())
+	today = date(2024, 5, 15)
+	for query, reference in CORPUS:
+		raw, confidence = parser.parse(query)
+		if reference is None:
+			assert raw is None, query
+			continue
+		assert raw is not None, (query, confidence)
+		assert qa._normalize(raw, today) == qa._normalize(reference, today), query
+	hit_rate = parser.hits / float(len(CORPUS))
+	print(f"fast-path hit rate: {parser.hits}/{len(CORPUS)} ({hit_rate:.0%})")
+	assert parser.hits == sum(1 for _, reference in CORPUS if reference is not None)
+
+
+def test_query_analyzer_uses_fast_path_before_granite():
+	granite = MagicMock()
+	granite.parse_json.side_effect = lambda t: json.loads(t)
+	granite.generate.return_value = json.dumps(_plan(intent="compare"))
+	qa = QueryAnalyzer(granite, fast_parser=_parser())
+	plan = qa.analyze("top 5 vendors last quarter", current_date="2024-05-15")
+	assert plan["top_n"] == {"enabled": True, "dimension": "vendor", "limit": 5}
+	assert plan["time_range"] == {"start_date": "2024-01-01", "end_date": "2024-03-31", "relative": "last_quarter"}
+	granite.generate.assert_not_called()
+	assert qa.analyze("compare this month vs last month", current_date="2024-05-15")["intent"] == "compare"
+	granite.generate.assert_called_once()
+
+
+def test_semantic_plan_cache_reuses_plans_of_paraphrases():
+	from tools.semantic_plan_cache import SemanticPlanCache
+
+	granite = MagicMock()
+	granite.parse_json.side_effect = lambda t: json.loads(t)
+	granite.generate.return_value = json.dumps(_plan(relative="last_month", vendors=["Staples"], min_amount=20))
+	cache = SemanticPlanCache()
+	# min_confidence above 1 keeps every question on the LLM path
+	qa = QueryAnalyzer(granite, fast_parser=FastQueryParser(_parser().vendors, min_confidence=1.1), semantic_cache=cache)
+	qa.analyze("how much did we spend at Staples last month over $20", current_date="2024-05-15")
+	plan = qa.analyze("Uber spend this year over 75?", current_date="2024-05-15")
+	assert granite.generate.call_count == 1
+	assert plan["filters"]["vendors"] == ["Uber"] and plan["filters"]["min_amount"] == 75.0
+	assert plan["time_range"] == {"start_date": "2024-01-01", "end_date": "2024-05-15", "relative": "this_year"}
+	assert cache.hits == 1
+
+	# A different operator word or different slots is a different question
+	qa.analyze("how much did we spend at Staples last month under $20", current_date="2024-05-15")
+	qa.analyze("how much did we spend at Staples over $20", current_date="2024-05-15")
+	assert granite.generate.call_count == 3
+
+
+def test_semantic_plan_cache_misses_paraphrases_with_extra_qualifiers():
+	from tools.semantic_plan_cache import SemanticPlanCache
+
+	granite = MagicMock()
+	granite.parse_json.side_effect = lambda t: json.loads(t)
+	granite.generate.return_value = json.dumps(_plan(relative="last_month", vendors=["Staples"]))
+	cache = SemanticPlanCache()
+	qa = QueryAnalyzer(granite, fast_parser=FastQueryParser(_parser().vendors, min_confidence=1.1), semantic_cache=cache)
+	qa.analyze("what did we spend at Staples last month", current_date="2024-05-15")
+	for question in (
+		"what did we spend at Staples last month on ink",
+		"what did we spend at Staples last month for refunds",
+		"what did we spend at Uber last month in Dallas",
+	):
+		trace = {}
+		qa.analyze(question, current_date="2024-05-15", trace=trace)
+		assert trace["plan_source"] == "granite", question
+	assert granite.generate.call_count == 4
+	# Word order, stop words and inflection alone still hit
+	trace = {}
+	qa.analyze("Staples spending last month?", current_date="2024-05-15", trace=trace)
+	assert trace["plan_source"] == "semantic_cache"
+
+
+def test_semantic_plan_cache_skips_plans_with_free_text():
+	from tools.semantic_plan_cache import SemanticPlanCache
+
+	granite = MagicMock()
+	granite.parse_json.side_effect = lambda t: json.loads(t)
+	printer = _plan(relative="this_month", vendors=["Staples"])
+	printer["filters"]["text_search"] = "printer"
+	paper = _plan(relative="this_month", vendors=["Staples"])
+	paper["filters"]["text_search"] = "paper"
+	granite.generate.side_effect = [json.dumps(printer), json.dumps(paper)]
+	cache = SemanticPlanCache()
+	qa = QueryAnalyzer(granite, fast_parser=FastQueryParser(_parser().vendors, min_confidence=1.1), semantic_cache=cache)
+	qa.analyze("show every single expense line from Staples this month that mentions printer", current_date="2024-05-15")
+	plan = qa.analyze("show every single expense line from Staples this month that mentions paper", current_date="2024-05-15")
+	assert plan["filters"]["text_search"] == "paper"
+	assert granite.generate.call_count == 2
+	assert len(cache) == 0
@@ -0,0 +1,64 @@
+import random
+
+from PIL import Image, ImageDraw, ImageEnhance
+
+from tools.image_hash import BKTree, PerceptualHashIndex, phash, hamming
+
+
+def _receipt(lines):
+	img = Image.new("RGB", (400, 600), "white")
+	draw = ImageDraw.Draw(img)
+	for i, (x, width) in enumerate(lines):
+		draw.rectangle([x, 40 + i * 45, x + width, 60 + i * 45], fill="black")
+	return img
+
+
+def test_phash_tolerates_reframing_but_separates_different_receipts():
+	original = _receipt([(40, 200), (60, 120), (40, 300), (200, 150), (40, 90), (120, 240)])
+	rephotographed = ImageEnhance.Brightness(original.crop((4, 6, 396, 594)).resize((800, 1200))).enhance(0.9)
+	other = _receipt([(200, 150), (40, 300), (60, 90), (40, 200), (150, 200), (40, 120)])
+	assert hamming(phash(original), phash(rephotographed)) <= 20
+	assert hamming(phash(original), phash(other)) > 64
+
+
+def test_bk_tree_search_matches_brute_force():
+	rng = random.Random(7)
+	hashes = [rng.getrandbits(64) for _ in range(500)]
+	tree = BKTree()
+	for i, h in enumerate(hashes):
+		tree.add(h, i)
+	probe = hashes[42] ^ 0b1011
+	expected = sorted((hamming(probe, h), i) for i, h in enumerate(hashes) if hamming(probe, h) <= 20)
+	assert sorted(tree.search(probe, 20)) == expected
+	assert tree.search(probe, 3)[0] == (3, 42)
+
+
+def test_perceptual_hash_index_persists_entries(tmp_path):
+	path = tmp_path / "image_hashes.jsonl"
+	index = PerceptualHashIndex(str(path), max_distance=2)
+	index.add(0b1111, "ACME\nTotal 12.00")
+	assert index.lookup(0b0111) == (1, "ACME\nTotal 12.00")
+	assert index.lookup(0b0000) is None
+	reloaded = PerceptualHashIndex(str(path), max_distance=2)
+	assert len(reloaded) == 1
+	assert reloaded.lookup(0b1111) == (0, "ACME\nTotal 12.00")
+
+
+def test_perceptual_hash_index_evicts_least_recently_used(tmp_path):
+	path = tmp_path / "image_hashes.jsonl"
+	index = PerceptualHashIndex(str(path), max_distance=0, max_entries=2)
+	index.add(0b0001, "first")
+	index.add(0b0010, "second")
+	assert index.lookup(0b0001) == (0, "first")
+	index.add(0b0100, "third")
+	assert len(index) == 2
+	assert index.lookup(0b0010) is None
+	assert index.lookup(0b0001) == (0, "first")
+	for i in range(3):
+		index.add(0b1000, f"fourth {i}")
+	# Compacted to the live entries once it outgrew twice the bound
+	assert len(path.read_text().splitlines()) <= 4
+	reloaded = PerceptualHashIndex(str(path), max_distance=0, max_entries=2)
+	assert len(reloaded) == 2
+	assert reloaded.lookup(0b1000) == (0, "fourth 2")
+	assert reloaded.lookup(0b0100) is None
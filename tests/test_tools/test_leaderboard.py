@@ -0,0 +1,29 @@
+import random
+
+from tools.leaderboard import Leaderboard, top_totals
+
+
+def test_leaderboard_matches_full_sort_under_updates():
+	rng = random.Random(3)
+	board = Leaderboard()
+	totals, ranks = {}, {}
+	for _ in range(5000):
+		key = f"V{rng.randrange(300)}"
+		# Refunds make totals go down as well as up
+		amount = float(rng.choice([rng.randrange(1, 50), -rng.randrange(1, 20)]))
+		board.add(key, amount)
+		ranks.setdefault(key, len(ranks))
+		totals[key] = totals.get(key, 0.0) + amount
+		if rng.random() < 0.05:
+			expected = sorted(totals.items(), key=lambda kv: (-kv[1], ranks[kv[0]]))[:5]
+			assert board.top(5) == expected
+	# Superseded heap entries are compacted away
+	assert len(board._heap) <= 2 * len(board) + 64
+
+
+def test_leaderboard_breaks_ties_by_first_seen_rank():
+	board = Leaderboard()
+	for key in ("b", "a", "c"):
+		board.add(key, 10.0)
+	assert board.top(2) == [("b", 10.0), ("a", 10.0)]
+	assert top_totals({"x": 1.0, "y": 3.0, "z": 3.0}, {"x": 0, "z": 1, "y": 2}, 2) == [("z", 3.0), ("y", 3.0)]
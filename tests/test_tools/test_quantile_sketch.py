@@ -0,0 +1,24 @@
+import random
+
+from tools.quantile_sketch import QuantileSketch, exact_stats
+
+
+def test_quantile_sketch_merges_and_stays_within_relative_error():
+	rng = random.Random(5)
+	amounts = [round(rng.lognormvariate(3, 1.2), 2) for _ in range(5000)] + [0.0, -40.0]
+	parts = [QuantileSketch() for _ in range(4)]
+	for i, a in enumerate(amounts):
+		parts[i % 4].add(a)
+	merged = QuantileSketch()
+	for part in parts:
+		merged.merge(part)
+	got, want = merged.stats(), exact_stats(sorted(amounts))
+	assert got["count"] == want["count"] == len(amounts)
+	for metric in ("total", "mean", "stddev"):
+		assert abs(got[metric] - want[metric]) < 1e-6 * max(1.0, abs(want[metric]))
+	assert (got["min"], got["max"]) == (want["min"], want["max"]) == (-40.0, max(amounts))
+	for metric in ("median", "p90"):
+		assert abs(got[metric] - want[metric]) <= 0.01 * want[metric]
+	# Size depends on the spread of amounts, not on how many were added
+	assert len(merged._buckets) < 1000
+	assert QuantileSketch().stats()["median"] is None
@@ -0,0 +1,42 @@
+import threading
+
+from tools.query_profile import QueryProfile, split_explain
+
+
+def test_split_explain_prefixes():
+	assert split_explain("explain: top 5 vendors") == (True, "top 5 vendors")
+	assert split_explain("PROFILE: spend by category") == (True, "spend by category")
+	assert split_explain("top 5 vendors --explain") == (True, "top 5 vendors")
+	assert split_explain("--profile spend by category") == (True, "spend by category")
+	# A leading word alone is an ordinary question
+	assert split_explain("explain my travel spending last month") == (False, "explain my travel spending last month")
+	assert split_explain("explain") == (False, "explain")
+	assert split_explain("explain:") == (False, "explain:")
+	assert split_explain("--explain") == (False, "--explain")
+	assert split_explain("explaining costs") == (False, "explaining costs")
+
+
+def test_query_profile_records_nested_stages_per_thread():
+	profile = QueryProfile("spend by vendor")
+	profile.plan = {"intent": "aggregate"}
+
+	def prefetch():
+		with profile.stage("rows", overlapped=True):
+			with profile.stage("sheets", rows=3):
+				pass
+
+	worker = threading.Thread(target=prefetch, name="prefetch")
+	worker.start()
+	worker.join()
+	with profile.stage("execute"):
+		with profile.stage("select", variants=2):
+			pass
+	profile.note("engine", "numpy table")
+	record = profile.record()
+	assert record["intent"] == "aggregate" and record["notes"] == {"engine": "numpy table"}
+	assert [(s["stage"], s["thread"]) for s in record["stages"]] == [("rows", "prefetch"), ("sheets", "prefetch"), ("execute", "MainThread"), ("select", "MainThread")]
+	assert all(s["wall_ms"] >= 0 and s["cpu_ms"] >= 0 for s in record["stages"])
+	lines = profile.render("ok").splitlines()
+	assert "- rows: " in lines[-6] and "  - sheets: " in lines[-5] and "(rows=3)" in lines[-5]
+	assert lines[-4].startswith("- execute: ") and lines[-3].startswith("  - select: ")
+	assert lines[-1] == "Answer: ok"
@@ -0,0 +1,24 @@
+from tools.receipt_cache import ReceiptCache, file_digest
+
+
+def test_receipt_cache_merges_fields_and_evicts_least_recently_used(tmp_path):
+	cache = ReceiptCache(str(tmp_path), max_entries=2)
+	cache.put("a", transcript="A text")
+	cache.put("a", receipt={"vendor": "ACME"})
+	cache.put("b", transcript="B text")
+	assert cache.get("a") == {"transcript": "A text", "receipt": {"vendor": "ACME"}}
+	cache.put("c", transcript="C text")
+	# "b" was least recently used
+	assert cache.get("b") is None
+	assert cache.get("c") == {"transcript": "C text"}
+	assert sorted(p.stem for p in tmp_path.glob("*.json")) == ["a", "c"]
+	# Entries survive a restart
+	assert ReceiptCache(str(tmp_path), max_entries=2).get("a")["receipt"] == {"vendor": "ACME"}
+
+
+def test_file_digest_is_content_addressed(tmp_path):
+	one = tmp_path / "one.png"
+	two = tmp_path / "two.png"
+	one.write_bytes(b"bytes")
+	two.write_bytes(b"bytes")
+	assert file_digest(str(one)) == file_digest(str(two))
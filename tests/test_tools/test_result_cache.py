@@ -0,0 +1,37 @@
+from datetime import date
+
+from tools.result_cache import QueryResult, ResultCache, plan_key
+
+
+def test_result_cache_serves_only_current_data_version():
+	cache = ResultCache(max_entries=2)
+	cache.put("a", cache.version, QueryResult("answer a"))
+	assert cache.get("a") == QueryResult("answer a")
+	cache.bump()
+	# Computed before the rows changed: dropped, never served
+	assert cache.get("a") is None
+	assert cache.stale == 1
+	# A result computed against an old version is not stored
+	cache.put("a", cache.version - 1, QueryResult("old"))
+	assert len(cache) == 0
+	assert cache.stats()["hits"] == 1 and cache.stats()["misses"] == 1
+
+
+def test_result_cache_evicts_least_recently_used():
+	cache = ResultCache(max_entries=2)
+	for key in ("a", "b"):
+		cache.put(key, cache.version, QueryResult(key))
+	cache.get("a")
+	cache.put("c", cache.version, QueryResult("c"))
+	assert cache.get("b") is None
+	assert cache.get("a").answer == "a" and cache.get("c").answer == "c"
+	assert cache.evictions == 1
+
+
+def test_plan_key_resolves_dates_and_ignores_key_order():
+	plan = {"intent": "summary", "time_range": {"relative": "this_month"}, "filters": {}}
+	same = {"filters": {}, "time_range": {"relative": "this_month"}, "intent": "summary"}
+	may, june = (date(2024, 5, 1), date(2024, 5, 31)), (date(2024, 6, 1), date(2024, 6, 30))
+	assert plan_key(plan, {"vendors": ["ACME"]}, *may) == plan_key(same, {"vendors": ["ACME"]}, *may)
+	assert plan_key(plan, {"vendors": ["ACME"]}, *may) != plan_key(plan, {"vendors": ["ACME"]}, *june)
+	assert plan_key(plan, {}, *may) != plan_key(plan, {"vendors": ["ACME"]}, *may)
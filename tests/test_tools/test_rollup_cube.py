@@ -0,0 +1,94 @@
+from datetime import date, timedelta
+
+from tools.expense_table import ExpenseTable
+from tools.rollup_cube import RollupCube
+
+
+def _rows(n):
+	return [
+		{"date": f"2024-{(i % 12) + 1:02d}-{(i % 28) + 1:02d}", "vendor": f"V{i % 7}", "category": "Meals" if i % 2 else "Travel", "amount": i, "processed_date": "2024-06-01T09:00:00"}
+		for i in range(n)
+	]
+
+
+def test_rollup_cube_matches_row_engine_for_whole_month_ranges():
+	rows = _rows(200) + [{"date": "", "vendor": "NoDate", "category": "Meals", "amount": "bad"}]
+	cube, table = RollupCube(), ExpenseTable()
+	cube.sync(rows)
+	table.sync(rows)
+	cases = [
+		({}, None, None),
+		({"categories": ["Meals"]}, date(2024, 3, 1), date(2024, 5, 31)),
+		({"vendors": ["V2", "V5"]}, date(2024, 1, 1), None),
+		({"vendors": ["NoDate"]}, None, None),
+		# Single-month and multi-month leaderboards
+		({}, date(2024, 4, 1), date(2024, 4, 30)),
+		({}, date(2024, 2, 1), date(2024, 7, 31)),
+	]
+	for filters, start, end in cases:
+		assert cube.covers(filters, start, end)
+		c, t = cube.select(filters, start, end), table.select(filters, start, end)
+		assert cube.total(c)[1] == table.total(t)[1]
+		assert abs(cube.total(c)[0] - table.total(t)[0]) < 1e-9
+		assert cube.group(c, "category") == table.group(t, "category")
+		assert cube.top(c, "vendor", 3) == table.top(t, "vendor", 3)
+		for gran in ("month", "quarter", "year"):
+			assert cube.trend(c, gran) == table.trend(t, gran)
+	windows = [(date(2024, m, 1), date(2024, m + 2, 1) - timedelta(days=1)) for m in range(1, 10)]
+	assert cube.window_totals({"categories": ["Meals"]}, windows) == [table.total(table.select({"categories": ["Meals"]}, s, e)) for s, e in windows]
+	# The processed_date rollup answers the fallback path
+	assert cube.count(cube.select({}, date(2024, 6, 1), date(2024, 6, 30), use_processed_date=True)) == 200
+
+
+def test_rollup_cube_declines_row_level_predicates_and_partial_months():
+	cube = RollupCube()
+	cube.sync(_rows(40))
+	assert not cube.covers({"min_amount": 5}, None, None)
+	assert not cube.covers({"text_search": "ink"}, None, None)
+	# January data spans days 1..25, so a range ending mid-month needs the rows
+	assert not cube.covers({}, date(2024, 1, 1), date(2024, 1, 10))
+	assert cube.covers({}, date(2023, 12, 20), date(2024, 1, 31))
+
+
+def test_rollup_cube_syncs_appended_rows_incrementally():
+	rows = _rows(10)
+	cube = RollupCube()
+	cube.sync(rows)
+	rows.append({"date": "2024-02-02", "vendor": "New", "category": "Travel", "amount": 7})
+	cube.sync(rows)
+	assert len(cube) == 11
+	assert cube.top(cube.select({"vendors": ["New"]}, None, None), "vendor", 1) == [("New", 7.0)]
+	cube.sync(_rows(3))
+	assert len(cube) == 3
+
+
+def test_rollup_cube_stats_merge_month_sketches():
+	rows = _rows(300)
+	cube, table = RollupCube(), ExpenseTable()
+	cube.sync(rows)
+	table.sync(rows)
+	cases = [
+		({}, None, None, None),
+		({"vendors": ["V1", "V3"]}, date(2024, 2, 1), date(2024, 8, 31), None),
+		({"categories": ["Meals"]}, None, None, "category"),
+		({}, date(2024, 3, 1), date(2024, 5, 31), "vendor"),
+	]
+	for filters, start, end, dim in cases:
+		c, t = cube.select(filters, start, end), table.select(filters, start, end)
+		assert cube.stats_cover(c, dim)
+		got, want = cube.stats(c, dim), table.stats(t, dim)
+		if dim is None:
+			got, want = [("", got)], [("", want)]
+		assert [k for k, _ in got] == [k for k, _ in want]
+		for (_, g), (_, w) in zip(got, want):
+			assert g["count"] == w["count"] and (g["min"], g["max"]) == (w["min"], w["max"])
+			assert abs(g["mean"] - w["mean"]) < 1e-9 and abs(g["stddev"] - w["stddev"]) < 1e-9
+			assert abs(g["median"] - w["median"]) <= 0.01 * w["median"]
+			assert abs(g["p90"] - w["p90"]) <= 0.01 * w["p90"]
+	# Built on the first stats call, then kept in step with appended rows
+	rows.append({"date": "2024-01-05", "vendor": "V1", "category": "Meals", "amount": 10_000})
+	cube.sync(rows)
+	assert cube.stats(cube.select({"vendors": ["V1"]}, None, None))["max"] == 10_000
+	# Sketches are per dimension: a vendor x category selection goes to the row engine
+	assert not cube.stats_cover(cube.select({"vendors": ["V1"], "categories": ["Meals"]}, None, None))
+	assert not cube.stats_cover(cube.select({"categories": ["Meals"]}, None, None), "vendor")
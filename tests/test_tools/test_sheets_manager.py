@@ -1,3 +1,7 @@
+from datetime import date
+import time
+from unittest.mock import patch
+
 from tools.sheets_manager import SheetsManager
 
 
@@ -17,4 +21,236 @@ def test_sheets_manager_basic():
 	sm = SheetsManager(client)  # type: ignore[arg-type]
 	sm.append_expense({"vendor": "ACME"})
 	rows = sm.query_expenses({})
-	assert rows and rows[0]["vendor"] == "ACME" 
\ No newline at end of file
+	assert rows and rows[0]["vendor"] == "ACME" 
+
+class CountingSheets(DummySheets):
+	def __init__(self, rows):
+		super().__init__()
+		self.rows = list(rows)
+		self.full_reads = 0
+		self.tail_reads = []
+
+	def append_row(self, expense):
+		self.rows.append({"Date": expense.get("date"), "Vendor": expense.get("vendor"), "Amount": expense.get("amount")})
+		return dict(self.rows[-1])
+
+	def query(self, filters):
+		self.full_reads += 1
+		return list(self.rows)
+
+	def query_since(self, offset):
+		self.tail_reads.append(offset)
+		return self.rows[offset:]
+
+
+def test_sheets_manager_row_cache_loads_once_and_tracks_appends():
+	client = CountingSheets([{"Date": "2024-01-01", "Vendor": "ACME", "Amount": 5}])
+	sm = SheetsManager(client, max_staleness_seconds=3600)  # type: ignore[arg-type]
+	assert len(sm.query_expenses({})) == 1
+	sm.append_expense({"date": "2024-01-02", "vendor": "PaperCo", "amount": 7})
+	rows = sm.query_expenses({})
+	assert client.full_reads == 1 and client.tail_reads == []
+	assert [r["vendor"] for r in rows] == ["ACME", "PaperCo"]
+
+
+def test_sheets_manager_pulls_only_new_rows_when_stale():
+	client = CountingSheets([{"Date": "2024-01-01", "Vendor": "ACME", "Amount": 5}])
+	sm = SheetsManager(client, max_staleness_seconds=0)  # type: ignore[arg-type]
+	sm.query_expenses({})
+	# Row added by another process directly in the sheet
+	client.rows.append({"Date": "2024-01-03", "Vendor": "Other", "Amount": 1})
+	rows = sm.query_expenses({})
+	assert client.full_reads == 1 and client.tail_reads == [1]
+	assert rows[-1]["vendor"] == "Other"
+	assert sm.last_refresh["refresh"] == "incremental" and sm.last_refresh["fetched"] == 1
+	assert {"download_ms", "canon_ms"} <= set(sm.last_refresh)
+
+	sm.invalidate_cache()
+	sm.query_expenses({})
+	assert client.full_reads == 2
+
+
+class PlacingSheets(CountingSheets):
+	"""Reports where each append landed, like the Sheets API's updatedRange."""
+
+	def append_row(self, expense):
+		from integrations.google_sheets_api import WrittenRecord
+
+		record = WrittenRecord(super().append_row(expense))
+		record.offset = len(self.rows) - 1
+		return record
+
+
+def test_sheets_manager_caches_rows_added_outside_between_pulls():
+	client = PlacingSheets([{"Date": "2024-01-01", "Vendor": "A", "Amount": 1}])
+	sm = SheetsManager(client, max_staleness_seconds=0)  # type: ignore[arg-type]
+	sm.query_expenses({})
+	# Someone types a row into the sheet, then the bot appends below it
+	client.rows.append({"Date": "2024-01-02", "Vendor": "MANUAL", "Amount": 2})
+	sm.append_expense({"date": "2024-01-03", "vendor": "BOT", "amount": 3})
+	rows = sm.query_expenses({})
+	assert sorted(r["vendor"] for r in rows) == ["A", "BOT", "MANUAL"]
+	assert client.tail_reads == [1, 3] and client.full_reads == 1
+
+	# Rows deleted outside: the append lands higher than expected and the cache reloads
+	del client.rows[1]
+	sm.append_expense({"date": "2024-01-04", "vendor": "BOT2", "amount": 4})
+	assert [r["vendor"] for r in sm.query_expenses({})] == ["A", "BOT", "BOT2"]
+	assert client.full_reads == 2
+
+
+class BatchSheets(CountingSheets):
+	def __init__(self, rows, fail=False):
+		super().__init__(rows)
+		self.batches = []
+		self.fail = fail
+
+	def append_rows(self, expenses):
+		if self.fail:
+			raise RuntimeError("quota exceeded")
+		self.batches.append(list(expenses))
+		return [self.append_row(e) for e in expenses]
+
+
+def test_sheets_manager_write_behind_batches_and_reports_each_item():
+	client = BatchSheets([])
+	sm = SheetsManager(client, max_staleness_seconds=3600, batch_size=2, batch_max_age_seconds=60)  # type: ignore[arg-type]
+	results = []
+	assert sm.append_expense({"date": "2024-01-01", "vendor": "ACME", "amount": 1}, on_result=lambda e, err: results.append((e["vendor"], err))) is False
+	# Buffered rows are visible before they are written
+	assert [r["vendor"] for r in sm.query_expenses({})] == ["ACME"]
+	assert client.batches == [] and results == []
+	version = sm.data_version
+	sm.append_expense({"date": "2024-01-02", "vendor": "PaperCo", "amount": 2}, on_result=lambda e, err: results.append((e["vendor"], err)))
+	assert len(client.batches) == 1 and len(client.batches[0]) == 2
+	# Written rows equal to the buffered ones leave the list alone
+	assert sm.data_version == version + 1
+	assert results == [("ACME", None), ("PaperCo", None)]
+	sm.close()
+
+
+class StampingSheets(BatchSheets):
+	def append_row(self, expense):
+		record = super().append_row(expense)
+		record["Processed_Date"] = "2024-05-02T09:00:00"
+		return record
+
+
+def test_sheets_manager_flush_replaces_rows_the_sheet_changed():
+	from tools.expense_table import ExpenseTable
+
+	client = StampingSheets([])
+	sm = SheetsManager(client, max_staleness_seconds=3600, batch_size=2, batch_max_age_seconds=60)  # type: ignore[arg-type]
+	sm.append_expense({"date": "2024-05-01", "vendor": "ACME", "amount": 1})
+	buffered = sm.query_expenses({})
+	table = ExpenseTable()
+	table.sync(buffered)
+	may = (date(2024, 5, 1), date(2024, 5, 31))
+	assert table.count(table.select({}, *may, use_processed_date=True)) == 0
+	version = sm.data_version
+	sm.append_expense({"date": "2024-05-01", "vendor": "PaperCo", "amount": 2})
+	rows = sm.query_expenses({})
+	# A new list, so indexes following the old one by length rebuild and see the processed dates
+	assert rows is not buffered and buffered[0].get("processed_date") is None
+	assert [r["processed_date"] for r in rows] == ["2024-05-02T09:00:00"] * 2
+	assert sm.data_version == version + 2
+	table.sync(rows)
+	assert table.count(table.select({}, *may, use_processed_date=True)) == 2
+
+
+def test_sheets_manager_flush_keeps_the_row_list_with_a_stamping_client():
+	from unittest.mock import MagicMock
+
+	from integrations.google_sheets_api import GoogleSheetsClient
+
+	worksheet = MagicMock()
+	worksheet.row_values.return_value = ["Date", "Vendor", "Amount", "Description", "Processed_Date"]
+	worksheet.get_all_records.return_value = []
+	client = GoogleSheetsClient()
+	client._sheet = worksheet
+	sm = SheetsManager(client, max_staleness_seconds=3600, batch_size=2, batch_max_age_seconds=60)  # type: ignore[arg-type]
+	with patch.object(client, "processed_timestamp", side_effect=["2024-05-02T09:00:00", "2024-05-02T09:00:05", "2024-05-02T09:01:00"]):
+		sm.append_expense({"date": "2024-05-01", "vendor": "ACME", "amount": 1})
+		rows = sm.query_expenses({})
+		version = sm.data_version
+		sm.append_expense({"date": "2024-05-01", "vendor": "PaperCo", "amount": 2})
+	# The write carried the stamps taken when the rows were buffered, so the cached list is kept
+	written = worksheet.append_rows.call_args[0][0]
+	assert [r[4] for r in written] == ["2024-05-02T09:00:00", "2024-05-02T09:00:05"]
+	assert sm.query_expenses({}) is rows and sm.data_version == version + 1
+	assert [r["processed_date"] for r in rows] == ["2024-05-02T09:00:00", "2024-05-02T09:00:05"]
+	assert rows[0]["description"] == ""
+
+
+def test_sheets_manager_serves_queries_while_a_batch_is_written():
+	import threading
+
+	started, release = threading.Event(), threading.Event()
+
+	class SlowSheets(BatchSheets):
+		def append_rows(self, expenses):
+			started.set()
+			release.wait(5)
+			return super().append_rows(expenses)
+
+	client = SlowSheets([])
+	sm = SheetsManager(client, max_staleness_seconds=0, batch_size=5, batch_max_age_seconds=60)  # type: ignore[arg-type]
+	sm.append_expense({"date": "2024-01-01", "vendor": "ACME", "amount": 1})
+	writer = threading.Thread(target=sm.flush)
+	writer.start()
+	assert started.wait(2)
+	threading.Timer(1.0, release.set).start()
+	begun = time.perf_counter()
+	# The in-flight row is still served, without waiting for the write
+	assert [r["vendor"] for r in sm.query_expenses({})] == ["ACME"]
+	assert time.perf_counter() - begun < 0.5
+	writer.join(5)
+	# The sheet was read during the write, so the cache reloads instead of guessing whether it saw the row
+	assert [r["vendor"] for r in sm.query_expenses({})] == ["ACME"]
+	assert client.full_reads == 2
+
+
+def test_sheets_manager_failed_flush_drops_buffered_rows():
+	client = BatchSheets([], fail=True)
+	sm = SheetsManager(client, max_staleness_seconds=3600, batch_size=5, batch_max_age_seconds=60)  # type: ignore[arg-type]
+	errors = []
+	sm.append_expense({"date": "2024-01-01", "vendor": "ACME", "amount": 1}, on_result=lambda e, err: errors.append(err))
+	with patch("tools.sheets_manager.time.sleep"):
+		sm.flush()
+	assert len(errors) == 1 and isinstance(errors[0], Exception)
+	assert sm.query_expenses({}) == []
+
+
+def test_sheets_manager_retries_only_rejected_batch_writes():
+	from gspread.exceptions import APIError
+	from unittest.mock import MagicMock
+
+	response = MagicMock()
+	response.json.return_value = {"error": {"code": 429, "message": "Quota exceeded", "status": "RESOURCE_EXHAUSTED"}}
+
+	class FlakySheets(BatchSheets):
+		def __init__(self, errors):
+			super().__init__([])
+			self.errors = list(errors)
+			self.calls = 0
+
+		def append_rows(self, expenses):
+			self.calls += 1
+			if self.errors:
+				raise self.errors.pop(0)
+			return super().append_rows(expenses)
+
+	# Rate limited: nothing was written, so the batch is sent again
+	client = FlakySheets([APIError(response)])
+	sm = SheetsManager(client, max_staleness_seconds=3600, batch_size=5, batch_max_age_seconds=60)  # type: ignore[arg-type]
+	sm.append_expense({"date": "2024-01-01", "vendor": "ACME", "amount": 1})
+	with patch("tools.sheets_manager.time.sleep"):
+		sm.flush()
+	assert client.calls == 2 and len(client.rows) == 1
+
+	# A timeout may have landed the rows: not re-sent
+	client = FlakySheets([TimeoutError("read timed out")])
+	sm = SheetsManager(client, max_staleness_seconds=3600, batch_size=5, batch_max_age_seconds=60)  # type: ignore[arg-type]
+	sm.append_expense({"date": "2024-01-01", "vendor": "ACME", "amount": 1})
+	sm.flush()
+	assert client.calls == 1
@@ -54,4 +54,37 @@ def test_slack_interface_handlers_invocation():
 		say = DummySay()
 		for h in file_handlers:
 			h(body=file_event, say=say, logger=None)
-		assert say.last == "processed" 
\ No newline at end of file
+		assert say.last == "processed" 
+
+def test_slack_interface_more_reply_continues_paged_search():
+	from tools.search_cursor import SearchCursor
+
+	class PageEngine:
+		def page(self, ordered, offset, limit):
+			return ordered[offset : offset + limit]
+
+	class PagingController:
+		def __init__(self):
+			self.queries = []
+		def handle_query(self, text):
+			self.queries.append(text)
+			cursor = SearchCursor(PageEngine(), list(range(5)), 5, 2, lambda rows: ",".join(map(str, rows)))
+			return cursor.first_page()
+
+	with patch("tools.slack_interface.App", FakeApp):
+		controller = PagingController()
+		iface = SlackInterface(bot_token="x", app_token="y", signing_secret="z", controller=controller, verify_tokens=False)
+		handler = iface.app.handlers["message"][0]
+		said = []
+
+		def send(text):
+			handler(body={"event": {"type": "message", "text": text, "channel": "C1", "user": "U1"}}, say=said.append, logger=None)
+
+		send("list everything")
+		send("more")
+		send("More!")
+		# No open cursor left: "more" goes to the controller as a query
+		send("more")
+		assert [s.splitlines()[0] for s in said] == ["0,1", "2,3", "4", "0,1"]
+		assert said[2].endswith("Showing rows 5-5 of 5.")
+		assert controller.queries == ["list everything", "more"]
@@ -35,4 +35,32 @@ def test_extract_from_pdf(mock_pdf_open):
 	tex = TextExtractor(backend="tesseract")
 	text = tex.extract_from_pdf("/tmp/sample.pdf")
 	assert text == "Page 1 Text"
-	mock_pdf_open.assert_called_once() 
\ No newline at end of file
+	mock_pdf_open.assert_called_once() 
+
+def test_extract_from_image_reuses_transcript_of_rephotographed_receipt(tmp_path):
+	from PIL import Image, ImageDraw
+
+	from tools.image_hash import PerceptualHashIndex
+
+	img = Image.new("RGB", (300, 500), "white")
+	draw = ImageDraw.Draw(img)
+	for i in range(8):
+		draw.rectangle([30 + (i * 37) % 90, 30 + i * 50, 200 + (i * 53) % 80, 50 + i * 50], fill="black")
+	first = tmp_path / "first.png"
+	second = tmp_path / "second.jpg"
+	img.save(first)
+	img.crop((3, 3, 297, 497)).save(second, quality=70)
+
+	tex = TextExtractor(backend="vision", image_index=PerceptualHashIndex(max_distance=20))
+	with patch.object(tex, "_vision_transcribe_images", return_value="ACME\nTotal 12.00\n") as mock_vision:
+		assert tex.extract_from_image(str(first)) == "ACME\nTotal 12.00"
+		assert tex.extract_from_image(str(second)) == "ACME\nTotal 12.00"
+	mock_vision.assert_called_once()
+
+
+@patch("tools.text_extractor.Image.open")
+def test_extract_from_image_skips_hashing_without_an_index(mock_open):
+	tex = TextExtractor(backend="vision")
+	with patch.object(tex, "_image_hash") as mock_hash, patch.object(tex, "_image_to_bytes", return_value=b"jpg"), patch.object(tex, "_vision_transcribe_images", return_value="ACME"):
+		assert tex.extract_from_image("/tmp/sample.png") == "ACME"
+	mock_hash.assert_not_called()
@@ -0,0 +1,23 @@
+import random
+
+import numpy as np
+
+from tools.text_index import TextIndex, search_text
+
+
+def test_text_index_matches_substring_scan():
+	rng = random.Random(11)
+	words = ["printer", "ink", "uber", "ride", "coffee", "beans", "office", "Depot", "Main St", "cartridge"]
+	rows = [
+		{"description": " ".join(rng.sample(words, 3)), "vendor": rng.choice(["Uber", "Staples", "Office Depot", "Blue Bottle"]), "location": rng.choice(["", "12 Main St", "Austin TX"])}
+		for _ in range(400)
+	]
+	index = TextIndex()
+	index.sync(rows[:150])
+	index.sync(rows)
+	for needle in ["printer ink", "uber", "ub", "e", "depot", "ter in", "main st austin", "zzz", "staples 12"]:
+		expected = [i for i, r in enumerate(rows) if needle in search_text(r)]
+		assert index.search(needle).tolist() == expected
+		# Restricted to a selection, narrow or wide
+		for candidates in (np.arange(0, 400, 7), np.arange(400)):
+			assert index.search(needle, candidates).tolist() == [i for i in expected if i in set(candidates.tolist())]
@@ -0,0 +1,37 @@
+from tools.vendor_index import VendorIndex
+
+
+def _index(names):
+	index = VendorIndex()
+	index.sync([{"vendor": n} for n in names] + [{"vendor": ""}])
+	return index
+
+
+def test_vendor_index_requires_all_candidate_tokens_and_prefers_longer_names():
+	index = _index(["Office Depot", "Office Depot Business Solutions", "Uber", "Uber Eats", "Home Depot"])
+	assert len(index) == 5
+	assert index.resolve(["uber"]) == "Uber Eats"
+	assert index.resolve(["home depot"]) == "Home Depot"
+	assert index.resolve(["depot business"]) == "Office Depot Business Solutions"
+	# "uber this month" is not a vendor: every token must be part of the name
+	assert index.resolve(["uber this month"]) is None
+	assert index.resolve([]) is None
+
+
+def test_vendor_index_corrects_misspelled_tokens():
+	index = _index(["Starbucks", "Walgreens", "Ford", "Staples"])
+	assert index.resolve(["starbuks"]) == "Starbucks"
+	assert index.resolve(["walgrenes"]) == "Walgreens"
+	# Short tokens are never corrected
+	assert index.resolve(["food"]) is None
+	# An exact match anywhere wins over a corrected one
+	assert index.resolve(["staplez", "ford"]) == "Ford"
+
+
+def test_vendor_index_follows_appended_rows():
+	rows = [{"vendor": "Lyft"}]
+	index = VendorIndex()
+	index.sync(rows)
+	rows.append({"vendor": "Blue Bottle Coffee"})
+	index.sync(rows)
+	assert index.resolve(["blue bottle"]) == "Blue Bottle Coffee"
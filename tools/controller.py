@@ -1,19 +1,32 @@
 from __future__ import annotations
 
-from typing import Any, Dict, Optional, List, Tuple
+from typing import Any, Callable, Dict, Optional, List, Tuple
 import logging
-from collections import defaultdict
 from datetime import date, datetime, timedelta
 import re
+import threading
+from concurrent.futures import ThreadPoolExecutor
 
-from tenacity import retry, stop_after_attempt, wait_exponential
+from tenacity import retry, retry_if_exception, stop_after_attempt, wait_exponential
 
 from config.settings import load_settings
+from integrations.google_sheets_api import append_rejected
 from tools.text_extractor import TextExtractor
 from tools.receipt_processor import ReceiptProcessor
 from tools.sheets_manager import SheetsManager
 from tools.query_analyzer import QueryAnalyzer
 from tools.receipt_processor import _extract_total_from_text
+from tools.query_engine import to_float
+from tools.expense_mirror import ExpenseMirror
+from tools.expense_table import ExpenseTable
+from tools.rollup_cube import ROLLUP_GRANULARITIES, RollupCube
+from tools.vendor_index import VendorIndex
+from tools.duplicate_index import DuplicateIndex, DuplicateMatch
+from tools.receipt_cache import ReceiptCache, file_digest
+from tools.quantile_sketch import DISTRIBUTION_METRICS
+from tools.query_profile import QueryProfile, split_explain
+from tools.result_cache import QueryResult, ResultCache, plan_key
+from tools.search_cursor import PagedAnswer, SearchCursor
 
 
 logger = logging.getLogger(__name__)
@@ -27,18 +40,190 @@ def _fmt_money(value: float) -> str:
 	return f"${amt:,.2f}"
 
 
+def _single_month(start: Optional[date], end: Optional[date]) -> bool:
+	"""Whether a query window is all-time or falls within one calendar month."""
+	if start is None and end is None:
+		return True
+	return start is not None and end is not None and (start.year, start.month) == (end.year, end.month)
+
+
+_METRIC_LABELS = {
+	"mean": "average expense", "median": "median expense", "p90": "90th percentile expense",
+	"min": "smallest expense", "max": "largest expense", "stddev": "standard deviation of expenses",
+}
+_METRIC_SHORT = {"median": "median", "p90": "p90", "mean": "average", "min": "min", "max": "max", "stddev": "stddev"}
+# Stage labels of the date fallbacks tried by _execute_plan, in order
+_FALLBACK_STAGES = ("receipt date", "processed_date", "processed_date, category relaxed")
+
+
 class Controller:
-	def __init__(self, text_extractor: TextExtractor, receipt_processor: ReceiptProcessor, sheets_manager: SheetsManager, query_analyzer: Optional[QueryAnalyzer] = None) -> None:
+	def __init__(self, text_extractor: TextExtractor, receipt_processor: ReceiptProcessor, sheets_manager: SheetsManager, query_analyzer: Optional[QueryAnalyzer] = None, mirror: Optional[ExpenseMirror] = None, receipt_cache: Optional[ReceiptCache] = None, vendor_index: Optional[VendorIndex] = None, result_cache: Optional[ResultCache] = None) -> None:
 		self.text_extractor = text_extractor
 		self.receipt_processor = receipt_processor
 		self.sheets = sheets_manager
 		self.settings = load_settings()
 		self.query_analyzer = query_analyzer
+		# Optional SQLite mirror; when set, query plans execute as SQL against it
+		self.mirror = mirror
+		# Default engine: columnar table kept in step with the sheet row cache
+		self.table = ExpenseTable()
+		# Month x vendor x category totals; answers plans that need no row-level predicate
+		self.rollup = RollupCube()
+		# Rows the cube follows, from the last successful refresh (None: the cube must not answer).
+		# The cube is built from them on the first plan it can answer (_ensure_rollup), not on every refresh
+		self._rollup_rows: Optional[List[Dict[str, Any]]] = None
+		# Token postings + trie of vendor names for resolving vendor mentions in queries (shared with the fast query parser)
+		self.vendors = vendor_index if vendor_index is not None else VendorIndex()
+		self.duplicates = DuplicateIndex()
+		# Optional content-addressed cache of transcripts and structured receipts
+		self.receipt_cache = receipt_cache
+		# Optional LRU of executed query results, invalidated by the data version
+		self.results = result_cache
+		# (row list identity, length, sheet data version) last seen by _query_engine
+		self._data_signature: Optional[Tuple[int, int, Any]] = None
+		# Serializes row fetch + index sync (and the signature/rollup flags) across concurrent queries,
+		# so an older row list can never be synced over a newer one
+		self._engine_lock = threading.Lock()
+		# Serializes duplicate check + append so identical concurrent uploads cannot both be appended
+		self._ingest_lock = threading.Lock()
+		# Loads/refreshes the expense rows while the query plan is being generated
+		self._prefetch = ThreadPoolExecutor(max_workers=2, thread_name_prefix="query-prefetch")
+
+	def _note_rows(self, rows: List[Dict[str, Any]]) -> None:
+		"""Bump the result cache's data version when the row cache changed since the last query; called under ``_engine_lock``."""
+		signature = (id(rows), len(rows), getattr(self.sheets, "data_version", 0))
+		if signature != self._data_signature:
+			self._data_signature = signature
+			if self.results is not None:
+				self.results.bump()
+
+	def _fetch_rows(self, profile: QueryProfile) -> List[Dict[str, Any]]:
+		with profile.stage("sheets") as stage:
+			rows = self.sheets.query_expenses({})
+			# Download vs _canon_row time of the refresh this call triggered, if any
+			stage.update(getattr(self.sheets, "last_refresh", None) or {})
+			stage["rows"] = len(rows)
+		return rows
+
+	def _query_engine(self, profile: Optional[QueryProfile] = None) -> Any:
+		profile = profile or QueryProfile("")
+		with self._engine_lock:
+			return self._sync_engine(profile)
+
+	def _sync_engine(self, profile: QueryProfile) -> Any:
+		"""Refresh the rows and bring the engines up to date; the caller holds ``_engine_lock``."""
+		if self.mirror is None:
+			rows = self._fetch_rows(profile)
+			with profile.stage("index_sync", engine="numpy table"):
+				self._note_rows(rows)
+				self.table.sync(rows)
+				self.vendors.sync(rows)
+			self._rollup_rows = rows
+			return self.table
+		self._rollup_rows = None
+		try:
+			rows = self._fetch_rows(profile)
+			with profile.stage("index_sync", engine="sqlite mirror"):
+				self._note_rows(rows)
+				self.mirror.sync(rows)
+				self.vendors.sync(rows)
+			self._rollup_rows = rows
+		except Exception as e:
+			# Keep answering from the mirror's last contents while the sheet is unavailable
+			logger.warning("Could not refresh SQLite mirror from sheet; answering from mirror: %s", e)
+		return self.mirror
+
+	def _ensure_rollup(self) -> bool:
+		"""Bring the cube up to the last refreshed rows: a full build the first time (or after a rebuild), then only appended rows."""
+		with self._engine_lock:
+			rows = self._rollup_rows
+			if rows is None:
+				return False
+			if not len(self.rollup) and rows:
+				logger.info("Building rollup cube from %d rows", len(rows))
+			self.rollup.sync(rows)
+			return True
+
+	def _vendor_index(self, engine: Any) -> VendorIndex:
+		if not len(self.vendors):
+			# Sheet unreachable since startup: seed from the engine's (mirror's) vendor list
+			for name in engine.vendors():
+				self.vendors.add(name)
+		return self.vendors
 
-	def _infer_vendor_from_query(self, query: str, rows: List[Dict[str, Any]]) -> Optional[str]:
+	def _rollup_answers(self, plan: Dict[str, Any], filters: Dict[str, Any], start: Optional[date] = None, end: Optional[date] = None) -> bool:
+		"""Whether the plan's output needs only vendor/category/month totals or sketches (mirrors handle_query's dispatch order).
+
+		Top-N lists come from the cube only for an all-time or single-month window,
+		where one leaderboard already holds the answer; merging every month's board
+		of a longer bounded window is slower than the row engine's ``top``.
+		"""
+		if self._rollup_rows is None:
+			return False
+		if (plan.get("compare") or {}).get("enabled"):
+			return True
+		intent = plan.get("intent", "summary")
+		if intent == "search":
+			return False
+		distribution = self._distribution_query(plan)
+		if distribution:
+			return self._ensure_rollup() and self.rollup.stats_cover(self.rollup.select(filters, None, None), distribution[1])
+		# A single vendor's top-N or summary is just their total
+		vendors = filters.get("vendors") if isinstance(filters.get("vendors"), list) else []
+		merged_boards = len(vendors) != 1 and not _single_month(start, end)
+		if intent == "top_n" or (plan.get("top_n") or {}).get("enabled"):
+			return not merged_boards
+		trend = plan.get("trend") or {}
+		if intent == "trend" or trend.get("enabled"):
+			return (trend.get("granularity") or "month") in ROLLUP_GRANULARITIES
+		group_by = plan.get("group_by", "none")
+		if intent == "aggregate" or group_by in {"vendor", "category", "date"}:
+			return group_by != "date"
+		# The default summary lists the top vendors
+		return not merged_boards
+
+	def _distribution_query(self, plan: Dict[str, Any]) -> Optional[Tuple[str, Optional[str]]]:
+		"""(metric, per-key dimension or None) when the plan asks for a distribution statistic; search, trend and compare plans keep their sums."""
+		metric = plan.get("metric") or "total"
+		if metric not in DISTRIBUTION_METRICS or (plan.get("compare") or {}).get("enabled"):
+			return None
+		intent = plan.get("intent", "summary")
+		if intent == "search":
+			return None
+		top_n = plan.get("top_n") or {}
+		if intent == "top_n" or top_n.get("enabled"):
+			return metric, "category" if top_n.get("dimension") == "category" else "vendor"
+		if intent == "trend" or (plan.get("trend") or {}).get("enabled"):
+			return None
+		group_by = plan.get("group_by", "none")
+		if intent == "aggregate" or group_by in {"vendor", "category", "date"}:
+			return metric, group_by if group_by in {"vendor", "category", "date"} else "vendor"
+		return metric, None
+
+	def _select_variants(self, engine: Any, variants: List[Tuple[Dict[str, Any], Optional[date], Optional[date], bool]], rollup: bool = False) -> Tuple[Any, List[Any]]:
+		"""(source, selections): all variants evaluated together, by the rollup cube when allowed and exact for every variant, else by the row engine in one pass."""
+		source = self.rollup if rollup and all(self.rollup.covers(*v) for v in variants) else engine
+		return source, source.select_variants(variants)
+
+	def _select_first(self, engine: Any, variants: List[Tuple[Dict[str, Any], Optional[date], Optional[date], bool]], rollup: bool = False, scanned: Optional[List[int]] = None) -> Tuple[Any, Any, int]:
+		"""(source, selection, variant index) for the first variant with matches, else the last; ``scanned`` receives each tried variant's row count."""
+		source, selections = self._select_variants(engine, variants, rollup)
+		for i, sel in enumerate(selections):
+			count = source.count(sel)
+			if scanned is not None:
+				scanned.append(count)
+			if count:
+				return source, sel, i
+		return source, selections[-1], len(selections) - 1
+
+	def _engine_name(self, source: Any) -> str:
+		if source is self.rollup:
+			return "rollup cube"
+		return "sqlite mirror" if source is self.mirror else "numpy table"
+
+	def _infer_vendor_from_query(self, query: str, vendors: VendorIndex) -> Optional[str]:
 		# Only infer when query explicitly mentions a vendor via preposition or is a short vendor-only query
-		known_vendors = {str(r.get("vendor", "")).strip() for r in rows if r.get("vendor")}
-		if not query or not known_vendors:
+		if not query or not len(vendors):
 			return None
 		# Explicit preposition pattern
 		m = re.search(r"\b(?:on|at|from|in)\s+([A-Za-z][A-Za-z0-9 '&.-]{1,60})\b", query, flags=re.IGNORECASE)
@@ -50,28 +235,45 @@ class Controller:
 		stop = {"top", "categories", "category", "this", "last", "month", "week", "year", "by", "processed", "date", "how", "much", "have", "i", "spent", "total", "sum"}
 		if len(tokens) <= 3 and any(t.lower() not in stop for t in tokens):
 			candidates.extend(tokens)
-		# Normalize and require token overlap, not substring
-		def vendor_tokens(name: str) -> set[str]:
-			return {t.lower() for t in re.split(r"[^A-Za-z0-9&'.-]+", name) if t}
-		best: Optional[Tuple[int, str]] = None
-		for cand in candidates:
-			cand_tokens = vendor_tokens(cand)
-			if not cand_tokens:
-				continue
-			for v in known_vendors:
-				vt = vendor_tokens(v)
-				overlap = cand_tokens & vt
-				if overlap and len(overlap) == len(cand_tokens):
-					score = len(vt)
-					if best is None or score > best[0]:
-						best = (score, v)
-		return best[1] if best else None
-
-	def handle_query(self, text: str) -> str:
+		# Require token overlap, not substring; the index also corrects misspelled tokens
+		return vendors.resolve(candidates)
+
+	def _timed_query_engine(self, profile: QueryProfile) -> Any:
+		with profile.stage("rows", overlapped=True):
+			return self._query_engine(profile)
+
+	def handle_query(self, text: str, explain: bool = False) -> str:
+		"""
+		Answer a question about the expenses. With ``explain``, an "explain:"/"profile:"
+		prefix or a --explain/--profile flag the reply is the execution report (plan,
+		fallback row counts, engine and caches used, wall/CPU time per stage) followed
+		by the answer. Every query logs the same report as one JSON "Query profile" line.
+		"""
 		if not self.query_analyzer:
 			return f"Received query: {text}"
-		plan = self.query_analyzer.analyze(text)
-		rows = self.sheets.query_expenses({})
+		prefixed, question = split_explain(text)
+		profile = QueryProfile(question)
+		# Rows do not depend on the plan, so fetch them while the LLM works
+		rows_future = self._prefetch.submit(self._timed_query_engine, profile)
+		trace: Dict[str, Any] = {}
+		try:
+			with profile.stage("analyze"):
+				plan = self.query_analyzer.analyze(question, trace=trace)
+		except Exception:
+			# No usable plan: drop the fetch if it has not started (a running one just warms the cache)
+			rows_future.cancel()
+			raise
+		profile.plan = plan
+		profile.note("plan_source", trace.get("plan_source", "granite"))
+		with profile.stage("wait_rows"):
+			engine = rows_future.result()
+		with profile.stage("execute"):
+			answer = self._answer_query(question, plan, engine, profile)
+		logger.info("Query profile: %s", profile.log_line())
+		return profile.render(answer) if explain or prefixed else answer
+
+	def _answer_query(self, text: str, plan: Dict[str, Any], engine: Any, profile: Optional[QueryProfile] = None) -> str:
+		profile = profile or QueryProfile(text)
 		logger.info("Plan: intent=%s group_by=%s trend=%s top_n=%s filters=%s time_range=%s", plan.get("intent"), plan.get("group_by"), plan.get("trend"), plan.get("top_n"), plan.get("filters"), plan.get("time_range"))
 		filters = dict(plan.get("filters") or {})
 		# Only infer vendor when the plan is vendor-targeted (not category-focused)
@@ -79,76 +281,131 @@ class Controller:
 		group_by = plan.get("group_by")
 		vendor_targeted = (top_dim == "vendor") or (group_by == "vendor") or (plan.get("intent") in {"summary", "search"} and top_dim != "category" and group_by != "category")
 		if vendor_targeted and not (filters.get("vendors") or []):
-			guess = self._infer_vendor_from_query(text, rows)
+			guess = self._infer_vendor_from_query(text, self._vendor_index(engine))
 			if guess:
 				filters["vendors"] = [guess]
 				logger.info("Inferred vendor from query: %s", guess)
+				profile.note("inferred_vendor", guess)
 		time_range = plan.get("time_range") or {}
-		filtered = self._apply_filters(rows, filters, time_range)
-		logger.info("Filtered rows by date: %d", len(filtered))
-		# Fallback: if no matches by receipt date, try processed_date range
-		if not filtered and (time_range or {}).get("relative"):
-			filtered = self._apply_filters(rows, filters, time_range, use_processed_date=True)
-			logger.info("Filtered rows by processed_date: %d", len(filtered))
-			# If still none and a category filter was applied, relax it
-			if not filtered and (filters.get("categories") or []):
+		start_dt, end_dt = self._normalize_time_range(time_range)
+		if self.results is None:
+			profile.note("result_cache", "off")
+			return self._execute_plan(plan, filters, start_dt, end_dt, engine, profile).answer
+		key = plan_key(plan, filters, start_dt, end_dt)
+		version = self.results.version
+		cached = self.results.get(key)
+		if cached is not None:
+			logger.info("Result cache hit (data version %d)", version)
+			profile.note("result_cache", f"hit (data version {version})")
+			return cached.answer
+		result = self._execute_plan(plan, filters, start_dt, end_dt, engine, profile)
+		# A paged answer carries a cursor whose position belongs to this conversation
+		if not isinstance(result.answer, PagedAnswer):
+			self.results.put(key, version, result)
+			profile.note("result_cache", "miss, stored")
+		else:
+			profile.note("result_cache", "miss, paged answer not stored")
+		return result.answer
+
+	def _execute_plan(self, plan: Dict[str, Any], filters: Dict[str, Any], start_dt: Optional[date], end_dt: Optional[date], engine: Any, profile: Optional[QueryProfile] = None) -> QueryResult:
+		profile = profile or QueryProfile("")
+		time_range = plan.get("time_range") or {}
+		use_rollup = self._rollup_answers(plan, filters, start_dt, end_dt) and self._ensure_rollup()
+		if (plan.get("compare") or {}).get("enabled"):
+			return QueryResult(self._execute_compare(engine, plan, rollup=use_rollup, profile=profile))
+		# Receipt date first; for relative ranges fall back to processed_date, then without the category filter
+		variants = [(filters, start_dt, end_dt, False)]
+		if (time_range or {}).get("relative"):
+			variants.append((filters, start_dt, end_dt, True))
+			if filters.get("categories") or []:
 				relaxed = dict(filters)
 				relaxed["categories"] = None
-				filtered = self._apply_filters(rows, relaxed, time_range, use_processed_date=True)
-				logger.info("Relaxed category filter; rows after relax: %d", len(filtered))
+				variants.append((relaxed, start_dt, end_dt, True))
+		scanned: List[int] = []
+		with profile.stage("select", variants=len(variants)):
+			source, filtered, chosen = self._select_first(engine, variants, rollup=use_rollup, scanned=scanned)
+			if source is self.rollup and variants[chosen][3] and (plan.get("intent") == "trend" or (plan.get("trend") or {}).get("enabled")):
+				# The cube would bucket a processed-date selection by processed month; trends bucket by receipt date
+				scanned = []
+				source, filtered, chosen = self._select_first(engine, variants, scanned=scanned)
+		logger.info("Filtered rows: %d via %s (rollup=%s)", scanned[-1], _FALLBACK_STAGES[chosen], source is self.rollup)
+		profile.note("engine", self._engine_name(source))
+		profile.note("fallbacks", [{"stage": _FALLBACK_STAGES[i], "rows": n} for i, n in enumerate(scanned)])
+		if filters.get("text_search") and source is not self.rollup:
+			profile.note("text_index", "trigram index" if source is self.table else "sqlite instr scan")
 		intent = plan.get("intent", "summary")
 		output_fmt = ((plan.get("output") or {}).get("format")) or "summary"
 		vendor_filter = (filters.get("vendors") or []) if isinstance(filters.get("vendors"), list) else []
 
-		if (plan.get("compare") or {}).get("enabled"):
-			return self._execute_compare(rows, plan)
-
 		if intent == "search":
 			if output_fmt in {"table", "detailed"}:
-				return self._render_table(filtered)
-			return f"Found {len(filtered)} matching expenses"
+				# Sorted per the plan and rendered a page at a time; later pages come from the cursor
+				sort = plan.get("sort") or {}
+				with profile.stage("aggregate", op="order"):
+					ordered = source.order(filtered, sort.get("by") or "date", sort.get("direction") or "desc")
+				cursor = SearchCursor(source, ordered, scanned[-1], self.settings.rules.search_page_size, self._render_table)
+				with profile.stage("render", op="first page"):
+					return QueryResult(cursor.first_page())
+			return QueryResult(f"Found {scanned[-1]} matching expenses")
+
+		distribution = self._distribution_query(plan)
+		if distribution:
+			# Median/p90/mean/...: merged month sketches on the rollup cube, exact statistics on the row engines
+			metric, dim = distribution
+			with profile.stage("aggregate", op=f"stats {metric}"):
+				stats = source.stats(filtered, dim)
+			with profile.stage("render"):
+				if dim is None:
+					return QueryResult(self._render_distribution(stats, metric, filters))
+				top_n = plan.get("top_n") or {}
+				limit = int(top_n.get("limit") or 5) if intent == "top_n" or top_n.get("enabled") else None
+				return QueryResult(self._render_distribution_groups(stats, metric, dim, limit))
 
 		if intent == "top_n" or (plan.get("top_n") or {}).get("enabled"):
 			# If a single vendor is specified, answer directly with their total
 			if len(vendor_filter) == 1:
-				total = sum(self._to_float(r.get("amount")) for r in filtered)
-				count = len(filtered)
-				return f"Your total spend on {vendor_filter[0]} is *{_fmt_money(total)}* ({count} transactions)"
+				with profile.stage("aggregate", op="total"):
+					total, count = source.total(filtered)
+				return QueryResult(f"Your total spend on {vendor_filter[0]} is *{_fmt_money(total)}* ({count} transactions)")
 			dim = (plan.get("top_n") or {}).get("dimension") or "vendor"
 			limit = int((plan.get("top_n") or {}).get("limit") or 5)
-			top = self._aggregate_top(filtered, dim, limit)
+			with profile.stage("aggregate", op=f"top {dim}"):
+				top = source.top(filtered, dim, limit)
 			parts = [f"{k}: {v:.2f}" for k, v in top]
-			return f"Summary: Top {limit} {dim}(s): " + "; ".join(parts) if parts else "No data"
+			return QueryResult(f"Summary: Top {limit} {dim}(s): " + "; ".join(parts) if parts else "No data")
 
 		group_by = plan.get("group_by", "none")
 		trend = plan.get("trend") or {"enabled": False, "granularity": "month"}
 		if intent == "trend" or trend.get("enabled"):
 			gran = trend.get("granularity", "month")
-			series = self._aggregate_trend(filtered, gran)
-			if output_fmt == "chart":
-				chart = (plan.get("output") or {}).get("chart") or {}
-				return self._render_chart_series(series, chart)
-			return self._render_grouped(series, key_label="date")
+			with profile.stage("aggregate", op=f"trend {gran}"):
+				series = source.trend(filtered, gran)
+			with profile.stage("render"):
+				if output_fmt == "chart":
+					chart = (plan.get("output") or {}).get("chart") or {}
+					return QueryResult(self._render_chart_series(series, chart), series)
+				return QueryResult(self._render_grouped(series, key_label="date"), series)
 
 		if intent == "aggregate" or group_by in {"vendor", "category", "date"}:
-			series = self._aggregate_group(filtered, group_by if group_by in {"vendor", "category", "date"} else "vendor")
-			if output_fmt == "chart":
-				chart = (plan.get("output") or {}).get("chart") or {}
-				return self._render_chart_series(series, chart)
-			return self._render_grouped(series, key_label=group_by)
+			dim = group_by if group_by in {"vendor", "category", "date"} else "vendor"
+			with profile.stage("aggregate", op=f"group {dim}"):
+				series = source.group(filtered, dim)
+			with profile.stage("render"):
+				if output_fmt == "chart":
+					chart = (plan.get("output") or {}).get("chart") or {}
+					return QueryResult(self._render_chart_series(series, chart), series)
+				return QueryResult(self._render_grouped(series, key_label=group_by), series)
 
 		# Default summary
-		total = sum(self._to_float(r.get("amount")) for r in filtered)
-		count = len(filtered)
+		with profile.stage("aggregate", op="total"):
+			total, count = source.total(filtered)
 		if len(vendor_filter) == 1:
-			return f"Your total spend on {vendor_filter[0]} is *{_fmt_money(total)}* ({count} transactions)"
-		vendor_totals: Dict[str, float] = defaultdict(float)
-		for r in filtered:
-			vendor_totals[str(r.get("vendor", "Unknown"))] += self._to_float(r.get("amount"))
+			return QueryResult(f"Your total spend on {vendor_filter[0]} is *{_fmt_money(total)}* ({count} transactions)")
 		limit = max(1, int(self.settings.rules.top_vendors_limit or 5))
-		top_vendors = sorted(vendor_totals.items(), key=lambda kv: kv[1], reverse=True)[:limit]
+		with profile.stage("aggregate", op="top vendor"):
+			top_vendors = source.top(filtered, "vendor", limit) if count else []
 		vendors_str = "; ".join(f"{v}: {amt:.2f}" for v, amt in top_vendors) if top_vendors else "None"
-		return f"Summary: {count} expenses totaling {total:.2f}. Top vendors: {vendors_str}"
+		return QueryResult(f"Summary: {count} expenses totaling {total:.2f}. Top vendors: {vendors_str}")
 
 	def _render_grouped(self, series: List[Tuple[str, float, int]], key_label: str) -> str:
 		# Simple textual listing
@@ -159,6 +416,24 @@ class Controller:
 		parts = [f"{k}: {_fmt_money(total)} ({cnt} transactions)" for k, total, cnt in series]
 		return "; ".join(parts)
 
+	def _render_distribution(self, stats: Dict[str, Any], metric: str, filters: Dict[str, Any]) -> str:
+		if not stats.get("count"):
+			return "No matching expenses"
+		vendors = filters.get("vendors") or []
+		categories = filters.get("categories") or []
+		subject = f" on {', '.join(vendors)}" if vendors else (f" in {', '.join(categories)}" if categories else "")
+		context = ", ".join(f"{_METRIC_SHORT[m]} {_fmt_money(stats[m])}" for m in DISTRIBUTION_METRICS if m != metric)
+		label = _METRIC_LABELS[metric]
+		return f"The {label}{subject} is *{_fmt_money(stats[metric])}* ({stats['count']} transactions; {context})"
+
+	def _render_distribution_groups(self, series: List[Tuple[str, Dict[str, Any]]], metric: str, dim: str, limit: Optional[int]) -> str:
+		if not series:
+			return "No results"
+		ranked = sorted(series, key=lambda kv: kv[1][metric], reverse=True)
+		parts = [f"{k}: {_fmt_money(stats[metric])} ({stats['count']} transactions)" for k, stats in ranked[:limit]]
+		heading = f"Top {limit} {dim}(s) by {_METRIC_LABELS[metric]}" if limit else f"{_METRIC_LABELS[metric].capitalize()} by {dim}"
+		return f"{heading}: " + "; ".join(parts)
+
 	def _render_chart_series(self, series: List[Tuple[str, float, int]], chart: Dict[str, Any]) -> str:
 		chart_type = (chart or {}).get("type") or "bar"
 		dim = (chart or {}).get("dimension") or "date"
@@ -173,36 +448,13 @@ class Controller:
 			lines.append(" | ".join([
 				str(r.get("date", "")),
 				str(r.get("vendor", "")),
-				f"{self._to_float(r.get('amount')):.2f}",
+				f"{to_float(r.get('amount')):.2f}",
 				str(r.get("category", "")),
 			]))
 		# Log a small preview for debugging
 		logger.info("Rendered table with %d rows", max(0, len(rows) - 1))
 		return "\n".join(lines)
 
-	def _to_float(self, v: Any) -> float:
-		try:
-			return float(v or 0)
-		except Exception:
-			return 0.0
-
-	def _parse_row_date(self, value: Any) -> Optional[date]:
-			try:
-				if not value:
-					return None
-				return datetime.strptime(str(value), "%Y-%m-%d").date()
-			except Exception:
-				return None
-
-	def _parse_processed_date(self, value: Any) -> Optional[date]:
-		try:
-			if not value:
-				return None
-			# processed_date is ISO string
-			return datetime.fromisoformat(str(value)).date()
-		except Exception:
-			return None
-
 	def _normalize_time_range(self, time_range: Dict[str, Any]) -> Tuple[Optional[date], Optional[date]]:
 		tr = time_range or {}
 		start_str = tr.get("start_date")
@@ -253,131 +505,56 @@ class Controller:
 				pass
 		return start_dt, end_dt
 
-	def _apply_filters(self, rows: List[Dict[str, Any]], filters: Dict[str, Any], time_range: Dict[str, Any], use_processed_date: bool = False) -> List[Dict[str, Any]]:
-		categories = set((filters or {}).get("categories") or [])
-		vendors = set((filters or {}).get("vendors") or [])
-		min_amount = (filters or {}).get("min_amount")
-		max_amount = (filters or {}).get("max_amount")
-		text_search = (filters or {}).get("text_search")
-		start_dt, end_dt = self._normalize_time_range(time_range or {})
-
-		needle = str(text_search or "").strip().lower()
-
-		def matches(row: Dict[str, Any]) -> bool:
-			if categories and row.get("category") not in categories:
-				return False
-			if vendors and row.get("vendor") not in vendors:
-				return False
-			amt = self._to_float(row.get("amount"))
-			if min_amount is not None and amt < float(min_amount):
-				return False
-			if max_amount is not None and amt > float(max_amount):
-				return False
-			if start_dt or end_dt:
-				if use_processed_date:
-					rd = self._parse_processed_date(row.get("Processed_Date") or row.get("processed_date"))
-				else:
-					rd = self._parse_row_date(row.get("date"))
-				if start_dt and (rd is None or rd < start_dt):
-					return False
-				if end_dt and (rd is None or rd > end_dt):
-					return False
-			if needle:
-				blob = " ".join([
-					str(row.get("description", "")),
-					str(row.get("vendor", "")),
-					str(row.get("location", "")),
-				]).lower()
-				if needle not in blob:
-					return False
-			return True
-
-		return [r for r in rows if matches(r)]
-
-	def _aggregate_group(self, rows: List[Dict[str, Any]], dim: str) -> List[Tuple[str, float, int]]:
-		totals: Dict[str, float] = defaultdict(float)
-		counts: Dict[str, int] = defaultdict(int)
-		key = dim if dim in {"vendor", "category"} else "date"
-		for r in rows:
-			k = str(r.get(key, ""))
-			val = self._to_float(r.get("amount"))
-			totals[k] += val
-			counts[k] += 1
-		return [(k, totals[k], counts[k]) for k in totals.keys()]
-
-	def _bucket_date(self, d: date, gran: str) -> str:
-		if gran == "day":
-			return d.isoformat()
-		if gran == "week":
-			year, week, _ = d.isocalendar()
-			return f"{year}-W{int(week):02d}"
-		if gran == "month":
-			return f"{d.year}-{d.month:02d}"
-		if gran == "quarter":
-			q = (d.month - 1) // 3 + 1
-			return f"{d.year}-Q{q}"
-		if gran == "year":
-			return f"{d.year}"
-		return d.isoformat()
-
-	def _aggregate_trend(self, rows: List[Dict[str, Any]], granularity: str) -> List[Tuple[str, float, int]]:
-		totals: Dict[str, float] = defaultdict(float)
-		counts: Dict[str, int] = defaultdict(int)
-		gran = granularity or "month"
-		for r in rows:
-			rd = self._parse_row_date(r.get("date"))
-			if not rd:
-				continue
-			key = self._bucket_date(rd, gran)
-			totals[key] += self._to_float(r.get("amount"))
-			counts[key] += 1
-		# Sort keys by date ordering where possible
-		def sort_key(item: Tuple[str, float, int]) -> Tuple[int, str]:
-			k = item[0]
-			# Try to parse common formats
-			try:
-				if gran in {"day"}:
-					return (0, k)
-				if gran == "month":
-					return (0, k)
-				if gran == "year":
-					return (0, k)
-				if gran == "week":
-					return (0, k)
-				if gran == "quarter":
-					return (0, k)
-			except Exception:
-				pass
-			return (1, k)
-		series = [(k, totals[k], counts[k]) for k in totals.keys()]
-		return sorted(series, key=sort_key)
+	def _window_totals(self, engine: Any, filters: Dict[str, Any], windows: List[Tuple[Optional[date], Optional[date]]], rollup: bool = False) -> Tuple[Any, List[Tuple[float, int]]]:
+		"""(source, [(total, count)]) per window from one ``window_totals`` call; a window with no receipt-date match falls back to processed_date in the same pass."""
+		exact = rollup and all(self.rollup.covers(filters, start, end, use_processed) for start, end in windows for use_processed in (False, True))
+		source = self.rollup if exact else engine
+		return source, source.window_totals(filters, windows, processed_fallback=True)
 
-	def _aggregate_top(self, rows: List[Dict[str, Any]], dimension: str, limit: int) -> List[Tuple[str, float]]:
-		dim = dimension if dimension in {"vendor", "category"} else "vendor"
-		totals: Dict[str, float] = defaultdict(float)
-		for r in rows:
-			k = str(r.get(dim, ""))
-			totals[k] += self._to_float(r.get("amount"))
-		items = sorted(totals.items(), key=lambda kv: kv[1], reverse=True)
-		return items[: max(1, int(limit))]
+	def _shift_year(self, d: Optional[date]) -> Optional[date]:
+		if d is None:
+			return None
+		try:
+			return d.replace(year=d.year - 1)
+		except ValueError:
+			# Feb 29 -> Feb 28
+			return d.replace(year=d.year - 1, day=28)
 
-	def _execute_compare(self, all_rows: List[Dict[str, Any]], plan: Dict[str, Any]) -> str:
+	def _execute_compare(self, engine: Any, plan: Dict[str, Any], rollup: bool = False, profile: Optional[QueryProfile] = None) -> str:
+		profile = profile or QueryProfile("")
 		filters = plan.get("filters", {})
 		cmp = plan.get("compare") or {}
-		baseline = cmp.get("baseline") or {}
-		target = cmp.get("target") or {}
-		def _sum_for_range(rng: Dict[str, Any]) -> Tuple[float, int]:
-			rows = self._apply_filters(all_rows, filters, {"start_date": rng.get("start_date"), "end_date": rng.get("end_date"), "relative": None})
-			# Try processed_date if no match
-			if not rows:
-				rows = self._apply_filters(all_rows, filters, {"start_date": rng.get("start_date"), "end_date": rng.get("end_date"), "relative": None}, use_processed_date=True)
-			total = sum(self._to_float(r.get("amount")) for r in rows)
-			return total, len(rows)
-		b_total, b_count = _sum_for_range(baseline)
-		t_total, t_count = _sum_for_range(target)
-		delta = t_total - b_total
-		pct = (delta / b_total * 100.0) if b_total else 0.0
-		return f"Compare: baseline total {b_total:.2f} ({b_count}); target total {t_total:.2f} ({t_count}); delta {delta:.2f} ({pct:.1f}%)"
+		periods = cmp.get("periods") or [{"label": "baseline", **(cmp.get("baseline") or {})}, {"label": "target", **(cmp.get("target") or {})}]
+		windows = [self._normalize_time_range({"start_date": p.get("start_date"), "end_date": p.get("end_date"), "relative": None}) for p in periods]
+		relative_to = cmp.get("relative_to") or "previous"
+		# Year-ago windows ride along in the same pass
+		references = [(self._shift_year(s), self._shift_year(e)) for s, e in windows] if relative_to == "year_ago" else []
+		with profile.stage("aggregate", op="window totals", windows=len(windows) + len(references)):
+			source, totals = self._window_totals(engine, filters, windows + references, rollup)
+		logger.info("Compared %d windows (relative_to=%s, rollup=%s)", len(windows), relative_to, source is self.rollup)
+		profile.note("engine", self._engine_name(source))
+		current = totals[: len(windows)]
+		if len(windows) == 2 and relative_to == "previous":
+			(b_total, b_count), (t_total, t_count) = current
+			delta = t_total - b_total
+			pct = (delta / b_total * 100.0) if b_total else 0.0
+			labels = [str(p.get("label") or name) for p, name in zip(periods, ("baseline", "target"))]
+			return f"Compare: {labels[0]} total {b_total:.2f} ({b_count}); {labels[1]} total {t_total:.2f} ({t_count}); delta {delta:.2f} ({pct:.1f}%)"
+		parts = []
+		for i, (period, (total, count)) in enumerate(zip(periods, current)):
+			part = f"{period.get('label') or i + 1} total {total:.2f} ({count})"
+			if relative_to == "year_ago":
+				ref_total, ref_count = totals[len(windows) + i]
+				part += f" vs year before {ref_total:.2f} ({ref_count})"
+			elif i == 0:
+				parts.append(part)
+				continue
+			else:
+				ref_total = current[i - 1 if relative_to == "previous" else 0][0]
+			delta = total - ref_total
+			pct = (delta / ref_total * 100.0) if ref_total else 0.0
+			parts.append(part + f", delta {delta:.2f} ({pct:.1f}%)")
+		return "Compare: " + "; ".join(parts)
 
 	@retry(stop=stop_after_attempt(3), wait=wait_exponential(multiplier=0.2, min=0.2, max=2))
 	def _extract_text_with_retry(self, path: str) -> str:
@@ -387,25 +564,27 @@ class Controller:
 	def _process_receipt_with_retry(self, text: str) -> Dict[str, Any]:
 		return self.receipt_processor.process(text)
 
-	@retry(stop=stop_after_attempt(3), wait=wait_exponential(multiplier=0.2, min=0.2, max=2))
-	def _append_with_retry(self, expense: Dict[str, Any]) -> None:
-		self.sheets.append_expense(expense)
+	# Appends are not idempotent: retry only writes the Sheets API rejected outright
+	@retry(retry=retry_if_exception(append_rejected), stop=stop_after_attempt(3), wait=wait_exponential(multiplier=0.2, min=0.2, max=2))
+	def _append_with_retry(self, expense: Dict[str, Any], on_result: Optional[Callable[[Dict[str, Any]], None]] = None) -> bool:
+		"""Append the expense; returns False when the sheets layer buffered it for a later batch write."""
+		if on_result is None:
+			return self.sheets.append_expense(expense) is not False
+
+		def _report(written: Dict[str, Any], error: Optional[Exception]) -> None:
+			if error is None:
+				logger.info("Buffered receipt written to sheet: vendor=%s date=%s amount=%s", written.get("vendor"), written.get("date"), written.get("amount"))
+				on_result({"status": "appended", "expense": written})
+			else:
+				on_result({"status": "error", "message": "append_failed", "expense": written})
+
+		return self.sheets.append_expense(expense, on_result=_report) is not False
 
-	def _is_duplicate(self, expense: Dict[str, Any]) -> bool:
+	def _find_duplicate(self, expense: Dict[str, Any]) -> Optional[DuplicateMatch]:
 		if not self.settings.rules.duplicate_detection_enabled:
-			return False
-		rows = self.sheets.query_expenses({})
-		for row in rows:
-			try:
-				if (
-					str(row.get("vendor", "")).strip().lower() == str(expense.get("vendor", "")).strip().lower()
-					and str(row.get("date", "")).strip() == str(expense.get("date", "")).strip()
-					and float(row.get("amount", 0)) == float(expense.get("amount", 0))
-				):
-					return True
-			except Exception:
-				continue
-		return False
+			return None
+		self.duplicates.sync(self.sheets.query_expenses({}))
+		return self.duplicates.find(expense, near=self.settings.rules.near_duplicate_detection_enabled)
 
 	def _infer_vendor_from_text(self, text: str) -> str | None:
 		lines = [ln.strip() for ln in (text or '').splitlines() if ln.strip()]
@@ -469,19 +648,35 @@ class Controller:
 			return "; ".join(item_lines)
 		return None
 
+	def _file_digest(self, path: str) -> Optional[str]:
+		if self.receipt_cache is None or path.lower().startswith(("http://", "https://")):
+			return None
+		try:
+			return file_digest(path)
+		except OSError:
+			return None
+
 	def handle_file_shared(self, body: Dict[str, Any]) -> Dict[str, Any]:
 		"""
 		Process a file upload event.
 		Expected body keys (for tests/local):
 		- local_path: path to the uploaded file (tests use a local path; no network)
 		- receipt_link: optional URL or reference to persist alongside the record
+		- on_result: optional callable receiving the final result dict when the append is
+		  buffered for a batch write (the immediate return value then has status "queued")
 		"""
 		local_path = body.get("local_path")
 		if not local_path:
 			return {"status": "error", "message": "local_path missing"}
 
-		logger.debug("Starting OCR for: %s", local_path)
-		text = self._extract_text_with_retry(local_path)
+		digest = self._file_digest(local_path)
+		cached = (self.receipt_cache.get(digest) if digest else None) or {}
+		if cached.get("transcript"):
+			logger.info("Receipt cache hit for %s; skipping transcription", digest[:12])
+			text = cached["transcript"]
+		else:
+			logger.debug("Starting OCR for: %s", local_path)
+			text = self._extract_text_with_retry(local_path)
 		if not text or len(text.strip()) < 20:
 			logger.error("Transcription returned insufficient text; length=%d", len(text.strip()) if text else 0)
 			return {"status": "error", "message": "insufficient_text"}
@@ -491,6 +686,8 @@ class Controller:
 		if "[IMAGE_BASE64_BEGIN" in upper_preview or upper_preview.startswith("DATA:IMAGE"):
 			logger.error("Transcript appears to be non-text content (base64/placeholder). Aborting processing.")
 			return {"status": "error", "message": "invalid_transcript"}
+		if digest and not cached.get("transcript"):
+			self.receipt_cache.put(digest, transcript=text)  # type: ignore[union-attr]
 
 		# Sanitize markdown-style headings injected by vision model (e.g., '**Header**')
 		def _sanitize_md_headings(raw: str) -> str:
@@ -522,7 +719,12 @@ class Controller:
 
 		logger.debug("Processing receipt text; length=%d", len(text))
 		try:
-			receipt = self._process_receipt_with_retry(text)
+			if isinstance(cached.get("receipt"), dict):
+				receipt = dict(cached["receipt"])
+			else:
+				receipt = self._process_receipt_with_retry(text)
+				if digest:
+					self.receipt_cache.put(digest, receipt=receipt)  # type: ignore[union-attr]
 		except Exception as e:
 			logger.error("LLM extraction failed after retries; falling back to basic heuristics: %s", e)
 			# Basic heuristic fallback
@@ -584,10 +786,29 @@ class Controller:
 			"location": receipt.get("location", ""),
 		}
 
-		if self._is_duplicate(expense):
-			logger.info("Duplicate receipt detected: vendor=%s date=%s amount=%s", expense.get("vendor"), expense.get("date"), expense.get("amount"))
-			return {"status": "duplicate", "expense": expense}
-
-		self._append_with_retry(expense)
+		on_result = body.get("on_result") if callable(body.get("on_result")) else None
+		with self._ingest_lock:
+			match = self._find_duplicate(expense)
+			if match is not None and match.exact:
+				logger.info("Duplicate receipt detected: vendor=%s date=%s amount=%s", expense.get("vendor"), expense.get("date"), expense.get("amount"))
+				return {"status": "duplicate", "expense": expense, "match": match.describe()}
+			# A near match may be OCR noise or a recurring fixed-price expense (daily parking, the same coffee):
+			# append it and let the reply point at the earlier row
+			possible = match.describe() if match is not None else None
+			notify = on_result
+			if possible is not None:
+				logger.info("Possible duplicate appended: vendor=%s date=%s amount=%s score=%.2f", expense.get("vendor"), expense.get("date"), expense.get("amount"), match.score)  # type: ignore[union-attr]
+				if on_result is not None:
+
+					def notify(res: Dict[str, Any]) -> None:
+						on_result({**res, "possible_duplicate": possible} if res.get("status") == "appended" else res)  # type: ignore[misc]
+			appended = self._append_with_retry(expense, notify)
+			self.duplicates.add(expense)
+		result: Dict[str, Any] = {"status": "appended" if appended else "queued", "expense": expense}
+		if possible is not None:
+			result["possible_duplicate"] = possible
+		if not appended:
+			logger.info("Receipt queued for batch append: vendor=%s date=%s amount=%s", expense.get("vendor"), expense.get("date"), expense.get("amount"))
+			return result
 		logger.info("Receipt appended to sheet: vendor=%s date=%s amount=%s", expense.get("vendor"), expense.get("date"), expense.get("amount"))
-		return {"status": "appended", "expense": expense} 
\ No newline at end of file
+		return result 
\ No newline at end of file
@@ -0,0 +1,179 @@
+from __future__ import annotations
+
+from typing import Any, Dict, FrozenSet, List, Optional, Tuple
+from collections import defaultdict
+from dataclasses import dataclass
+import re
+import threading
+
+from tools.query_engine import parse_row_date
+
+
+# Near-duplicate blocking: candidates share a (day, amount bucket) block with the incoming receipt
+_AMOUNT_BUCKET_CENTS = 100
+
+
+def _norm_vendor(value: Any) -> str:
+	return str(value or "").strip().lower()
+
+
+def _amount_cents(value: Any) -> Optional[int]:
+	try:
+		return int(round(float(value) * 100))
+	except Exception:
+		return None
+
+
+def duplicate_key(record: Dict[str, Any]) -> Optional[Tuple[str, str, int]]:
+	"""(normalized vendor, date, amount in cents) for a row or expense; None when the amount is unusable."""
+	cents = _amount_cents(record.get("amount", 0))
+	if cents is None:
+		return None
+	return _norm_vendor(record.get("vendor")), str(record.get("date", "") or "").strip(), cents
+
+
+def receipt_key(record: Dict[str, Any]) -> Optional[Tuple[str, str]]:
+	number = str(record.get("receipt_number") or "").strip().lower()
+	if not number:
+		return None
+	return _norm_vendor(record.get("vendor")), number
+
+
+def vendor_trigrams(value: Any) -> FrozenSet[str]:
+	# Letters and digits only, so "WAL*MART" and "Walmart" normalize to the same string
+	compact = re.sub(r"[^a-z0-9]", "", str(value or "").lower())
+	if not compact:
+		return frozenset()
+	padded = f"  {compact} "
+	return frozenset(padded[i : i + 3] for i in range(len(padded) - 2))
+
+
+def vendor_similarity(a: FrozenSet[str], b: FrozenSet[str]) -> float:
+	"""Dice coefficient of two trigram sets."""
+	if not a or not b:
+		return 0.0
+	return 2.0 * len(a & b) / (len(a) + len(b))
+
+
+@dataclass
+class DuplicateMatch:
+	row: Dict[str, Any]
+	score: float
+	exact: bool
+	vendor_similarity: float = 1.0
+	day_delta: int = 0
+	amount_delta: float = 0.0
+
+	def describe(self) -> Dict[str, Any]:
+		return {
+			"vendor": self.row.get("vendor"),
+			"date": self.row.get("date"),
+			"amount": self.row.get("amount"),
+			"score": round(self.score, 2),
+			"exact": self.exact,
+		}
+
+
+class DuplicateIndex:
+	"""
+	Exact and near-duplicate detection over the expense rows.
+
+	Exact keys are (normalized vendor, date, amount in cents) and, when present,
+	(normalized vendor, receipt number); lookups are O(1). Near duplicates catch
+	OCR noise: rows are blocked by (receipt day, amount bucket), so a lookup only
+	visits the blocks within ``date_window_days`` and the amount tolerance and
+	scores those few candidates by vendor trigram similarity.
+
+	``sync`` follows the SheetsManager row cache list incrementally; ``add``
+	records an expense as soon as it is appended so back-to-back uploads see it
+	before the cache does.
+	"""
+
+	def __init__(self, date_window_days: int = 1, amount_tolerance_cents: int = 5, amount_tolerance_ratio: float = 0.01, min_vendor_similarity: float = 0.5) -> None:
+		self.date_window_days = int(date_window_days)
+		self.amount_tolerance_cents = int(amount_tolerance_cents)
+		self.amount_tolerance_ratio = float(amount_tolerance_ratio)
+		self.min_vendor_similarity = float(min_vendor_similarity)
+		self._lock = threading.RLock()
+		self._keys: Dict[Tuple[str, str, int], Dict[str, Any]] = {}
+		self._receipts: Dict[Tuple[str, str], Dict[str, Any]] = {}
+		self._blocks: Dict[Tuple[int, int], List[Tuple[int, FrozenSet[str], Dict[str, Any]]]] = defaultdict(list)
+		self._trigrams: Dict[str, FrozenSet[str]] = {}
+		self._source_rows: Optional[List[Dict[str, Any]]] = None
+		self._synced = 0
+
+	def __len__(self) -> int:
+		return len(self._keys)
+
+	def sync(self, rows: List[Dict[str, Any]]) -> None:
+		with self._lock:
+			if rows is not self._source_rows or len(rows) < self._synced:
+				self._keys.clear()
+				self._receipts.clear()
+				self._blocks.clear()
+				self._source_rows = rows
+				self._synced = 0
+			for row in rows[self._synced:]:
+				self.add(row)
+			self._synced = len(rows)
+
+	def _vendor_grams(self, vendor: Any) -> FrozenSet[str]:
+		name = str(vendor or "")
+		grams = self._trigrams.get(name)
+		if grams is None:
+			grams = vendor_trigrams(name)
+			self._trigrams[name] = grams
+		return grams
+
+	def add(self, record: Dict[str, Any]) -> None:
+		with self._lock:
+			key = duplicate_key(record)
+			if key is not None:
+				self._keys.setdefault(key, record)
+			rkey = receipt_key(record)
+			if rkey is not None:
+				self._receipts.setdefault(rkey, record)
+			day = parse_row_date(str(record.get("date", "") or "").strip())
+			if key is not None and day is not None:
+				cents = key[2]
+				self._blocks[(day.toordinal(), cents // _AMOUNT_BUCKET_CENTS)].append((cents, self._vendor_grams(record.get("vendor")), record))
+
+	def contains(self, expense: Dict[str, Any]) -> bool:
+		return self.find(expense, near=False) is not None
+
+	def find(self, expense: Dict[str, Any], near: bool = True) -> Optional[DuplicateMatch]:
+		"""Return the exact duplicate of ``expense`` if any, else (with ``near``) the best-scoring near duplicate."""
+		with self._lock:
+			key = duplicate_key(expense)
+			if key is not None and key in self._keys:
+				return DuplicateMatch(row=self._keys[key], score=1.0, exact=True)
+			rkey = receipt_key(expense)
+			if rkey is not None and rkey in self._receipts:
+				return DuplicateMatch(row=self._receipts[rkey], score=1.0, exact=True)
+			if not near or key is None:
+				return None
+			return self._find_near(expense, key[2])
+
+	def _find_near(self, expense: Dict[str, Any], cents: int) -> Optional[DuplicateMatch]:
+		day = parse_row_date(str(expense.get("date", "") or "").strip())
+		if day is None:
+			return None
+		ordinal = day.toordinal()
+		tol = max(self.amount_tolerance_cents, int(round(abs(cents) * self.amount_tolerance_ratio)))
+		grams = self._vendor_grams(expense.get("vendor"))
+		best: Optional[DuplicateMatch] = None
+		for d in range(ordinal - self.date_window_days, ordinal + self.date_window_days + 1):
+			day_delta = abs(d - ordinal)
+			for bucket in range((cents - tol) // _AMOUNT_BUCKET_CENTS, (cents + tol) // _AMOUNT_BUCKET_CENTS + 1):
+				for cand_cents, cand_grams, row in self._blocks.get((d, bucket), ()):
+					cents_delta = abs(cand_cents - cents)
+					# Tolerate OCR noise in the date or the amount, not both
+					if cents_delta > tol or (day_delta and cents_delta):
+						continue
+					sim = vendor_similarity(grams, cand_grams)
+					if sim < self.min_vendor_similarity:
+						continue
+					score = 0.5 * sim + 0.25 * (1 - day_delta / (self.date_window_days + 1)) + 0.25 * (1 - cents_delta / (tol + 1))
+					if best is None or score > best.score:
+						best = DuplicateMatch(row=row, score=score, exact=False, vendor_similarity=sim, day_delta=day_delta, amount_delta=cents_delta / 100.0)
+		return best
@@ -0,0 +1,255 @@
+from __future__ import annotations
+
+from typing import Any, Dict, List, Optional, Tuple
+from datetime import date
+import logging
+import sqlite3
+import threading
+
+from tools.quantile_sketch import exact_stats
+from tools.query_engine import parse_processed_date, parse_row_date, row_processed_date, to_float
+
+
+logger = logging.getLogger(__name__)
+
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS expenses (
+	id INTEGER PRIMARY KEY,
+	date TEXT,
+	date_raw TEXT NOT NULL DEFAULT '',
+	iso_week TEXT,
+	vendor TEXT,
+	category TEXT,
+	amount REAL NOT NULL DEFAULT 0,
+	description TEXT,
+	location TEXT,
+	receipt_number TEXT,
+	processed_date TEXT,
+	search_text TEXT NOT NULL DEFAULT ''
+);
+CREATE INDEX IF NOT EXISTS idx_expenses_date ON expenses(date);
+CREATE INDEX IF NOT EXISTS idx_expenses_vendor ON expenses(vendor);
+CREATE INDEX IF NOT EXISTS idx_expenses_category ON expenses(category);
+CREATE INDEX IF NOT EXISTS idx_expenses_processed_date ON expenses(processed_date);
+"""
+
+_ROW_COLUMNS = ("date_raw", "vendor", "amount", "category", "description", "location", "receipt_number", "processed_date")
+
+# Selection: compiled WHERE clause and its parameters
+Selection = Tuple[str, List[Any]]
+
+
+def _text(value: Any) -> Optional[str]:
+	return None if value is None else str(value)
+
+
+# Group-by dimension -> SQL key; anything else ("date") groups by the raw date text
+_GROUP_KEYS = {"vendor": "COALESCE(vendor, '')", "category": "COALESCE(category, '')"}
+
+
+class ExpenseMirror:
+	"""
+	SQLite mirror of the Expenses worksheet, usable as the controller's query engine.
+
+	Rows are mirrored with typed columns (ISO dates, REAL amounts) and indexed on
+	date, vendor, category and processed_date. ``sync`` consumes the row cache list
+	from ``SheetsManager.query_expenses`` incrementally; query plans compile to
+	parameterized SQL. With a file path the mirror survives restarts and can keep
+	answering from its last contents while the sheet is unreachable.
+	"""
+
+	def __init__(self, path: str = ":memory:") -> None:
+		self.path = path
+		self._conn = sqlite3.connect(path, check_same_thread=False)
+		self._conn.executescript(_SCHEMA)
+		self._lock = threading.RLock()
+		# Identity and consumed length of the source rows list (see sync)
+		self._source_rows: Optional[List[Dict[str, Any]]] = None
+		self._synced = 0
+		# Bumped on every rebuild; ordered selections pinned to older ids are meaningless
+		self.generation = 0
+
+	def sync(self, rows: List[Dict[str, Any]]) -> None:
+		"""Mirror rows appended to ``rows`` since the last call; a different or shrunk list triggers a rebuild."""
+		with self._lock:
+			if rows is not self._source_rows or len(rows) < self._synced:
+				with self._conn:
+					self._conn.execute("DELETE FROM expenses")
+					self._insert(rows)
+				self._source_rows = rows
+				self._synced = len(rows)
+				self.generation += 1
+				logger.info("Rebuilt SQLite mirror with %d rows", len(rows))
+				return
+			if len(rows) > self._synced:
+				with self._conn:
+					self._insert(rows[self._synced:])
+				self._synced = len(rows)
+
+	def _insert(self, rows: List[Dict[str, Any]]) -> None:
+		records = []
+		for r in rows:
+			rd = parse_row_date(r.get("date"))
+			pd = parse_processed_date(row_processed_date(r))
+			week = None
+			if rd:
+				year, wk, _ = rd.isocalendar()
+				week = f"{year}-W{int(wk):02d}"
+			search = " ".join([str(r.get("description", "")), str(r.get("vendor", "")), str(r.get("location", ""))]).lower()
+			records.append((
+				rd.isoformat() if rd else None,
+				str(r.get("date", "")),
+				week,
+				_text(r.get("vendor")),
+				_text(r.get("category")),
+				to_float(r.get("amount")),
+				_text(r.get("description")),
+				_text(r.get("location")),
+				_text(r.get("receipt_number")),
+				pd.isoformat() if pd else None,
+				search,
+			))
+		self._conn.executemany(
+			"INSERT INTO expenses (date, date_raw, iso_week, vendor, category, amount, description, location, receipt_number, processed_date, search_text) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+			records,
+		)
+
+	def _query(self, sql: str, params: List[Any]) -> List[Tuple[Any, ...]]:
+		with self._lock:
+			return self._conn.execute(sql, params).fetchall()
+
+	def vendors(self) -> List[str]:
+		return [v for (v,) in self._query("SELECT DISTINCT trim(vendor) FROM expenses WHERE vendor IS NOT NULL AND vendor != '' ORDER BY 1", [])]
+
+	def select_variants(self, variants: List[Tuple[Dict[str, Any], Optional[date], Optional[date], bool]]) -> List[Selection]:
+		# Selections are lazy SQL fragments; each is answered from the indexes when used
+		return [self.select(*v) for v in variants]
+
+	def select(self, filters: Dict[str, Any], start: Optional[date], end: Optional[date], use_processed_date: bool = False) -> Selection:
+		clauses: List[str] = []
+		params: List[Any] = []
+		for column, key in (("category", "categories"), ("vendor", "vendors")):
+			values = [str(v) for v in ((filters or {}).get(key) or [])]
+			if values:
+				clauses.append(f"{column} IN ({', '.join('?' for _ in values)})")
+				params.extend(values)
+		if (filters or {}).get("min_amount") is not None:
+			clauses.append("amount >= ?")
+			params.append(float(filters["min_amount"]))
+		if (filters or {}).get("max_amount") is not None:
+			clauses.append("amount <= ?")
+			params.append(float(filters["max_amount"]))
+		# NULL dates never satisfy a comparison, matching the row scan
+		date_col = "processed_date" if use_processed_date else "date"
+		if start:
+			clauses.append(f"{date_col} >= ?")
+			params.append(start.isoformat())
+		if end:
+			clauses.append(f"{date_col} <= ?")
+			params.append(end.isoformat())
+		needle = str((filters or {}).get("text_search") or "").strip().lower()
+		if needle:
+			clauses.append("instr(search_text, ?) > 0")
+			params.append(needle)
+		return (" AND ".join(clauses) or "1", params)
+
+	def window_totals(self, filters: Dict[str, Any], windows: List[Tuple[Optional[date], Optional[date]]], use_processed_date: bool = False, processed_fallback: bool = False) -> List[Tuple[float, int]]:
+		"""
+		(total, count) per (start, end) window in one statement: the windows join the
+		date indexes, so each row is read once per window it falls in. An unbounded
+		window also takes undated rows. With ``processed_fallback`` the same join sums
+		processed dates too, and a window without receipt-date rows takes those.
+		"""
+		if not windows:
+			return []
+		where, params = self.select(filters, None, None)
+		columns = ["processed_date" if use_processed_date else "date"]
+		if processed_fallback and not use_processed_date:
+			columns.append("processed_date")
+		values = ", ".join("(?, ?, ?, ?)" for _ in windows)
+		window_params: List[Any] = []
+		for i, (start, end) in enumerate(windows):
+			window_params.extend([i, int(bool(start or end)), start.isoformat() if start else "", end.isoformat() if end else "9999-12-31"])
+		inside = [f"(w.bounded = 0 OR (e.{column} >= w.lo AND e.{column} <= w.hi))" for column in columns]
+		sums = ", ".join(f"COALESCE(SUM(CASE WHEN {cond} THEN e.amount END), 0), COUNT(CASE WHEN {cond} THEN 1 END)" for cond in inside)
+		sql = (
+			f"WITH w(i, bounded, lo, hi) AS (VALUES {values}) "
+			f"SELECT w.i, {sums} FROM w "
+			f"LEFT JOIN expenses e ON ({' OR '.join(inside)}) AND ({where}) "
+			f"GROUP BY w.i ORDER BY w.i"
+		)
+		results: List[Tuple[float, int]] = []
+		for row in self._query(sql, window_params + params):
+			total, count = float(row[1]), int(row[2])
+			if not count and len(columns) > 1:
+				total, count = float(row[3]), int(row[4])
+			results.append((total, count))
+		return results
+
+	def count(self, sel: Selection) -> int:
+		return int(self._query(f"SELECT COUNT(*) FROM expenses WHERE {sel[0]}", sel[1])[0][0])
+
+	def total(self, sel: Selection) -> Tuple[float, int]:
+		total, count = self._query(f"SELECT COALESCE(SUM(amount), 0), COUNT(*) FROM expenses WHERE {sel[0]}", sel[1])[0]
+		return float(total), int(count)
+
+	def rows(self, sel: Selection) -> List[Dict[str, Any]]:
+		return self._fetch_rows(f"WHERE {sel[0]} ORDER BY id", sel[1])
+
+	def _fetch_rows(self, tail: str, params: List[Any]) -> List[Dict[str, Any]]:
+		cols = ", ".join(_ROW_COLUMNS)
+		out = []
+		for rec in self._query(f"SELECT {cols} FROM expenses {tail}", params):
+			row = dict(zip(_ROW_COLUMNS, rec))
+			row["date"] = row.pop("date_raw")
+			out.append(row)
+		return out
+
+	def order(self, sel: Selection, by: str, direction: str) -> Tuple[str, List[Any], str]:
+		"""(where, params, ORDER BY) for paging ``sel``, pinned to the rows mirrored so far so pages stay stable."""
+		column = {"amount": "amount", "total": "amount", "vendor": "lower(vendor)", "category": "lower(category)"}.get(by, "date")
+		last_id = self._query("SELECT COALESCE(MAX(id), 0) FROM expenses", [])[0][0]
+		# NULL dates sort first ascending and last descending, like the undated rows of the table
+		return f"({sel[0]}) AND id <= ?", sel[1] + [last_id], f"{column} {'DESC' if direction == 'desc' else 'ASC'}, id"
+
+	def page(self, ordered: Tuple[str, List[Any], str], offset: int, limit: int) -> List[Dict[str, Any]]:
+		where, params, order_by = ordered
+		return self._fetch_rows(f"WHERE {where} ORDER BY {order_by} LIMIT ? OFFSET ?", params + [int(limit), int(offset)])
+
+	def group(self, sel: Selection, dim: str) -> List[Tuple[str, float, int]]:
+		key = _GROUP_KEYS.get(dim, "date_raw")
+		sql = f"SELECT {key}, SUM(amount), COUNT(*) FROM expenses WHERE {sel[0]} GROUP BY 1 ORDER BY MIN(id)"
+		return [(str(k), float(t), int(c)) for k, t, c in self._query(sql, sel[1])]
+
+	def trend(self, sel: Selection, granularity: str) -> List[Tuple[str, float, int]]:
+		bucket = {
+			"day": "date",
+			"week": "iso_week",
+			"month": "substr(date, 1, 7)",
+			"quarter": "substr(date, 1, 4) || '-Q' || ((CAST(substr(date, 6, 2) AS INTEGER) - 1) / 3 + 1)",
+			"year": "substr(date, 1, 4)",
+		}.get(granularity or "month", "date")
+		sql = f"SELECT {bucket}, SUM(amount), COUNT(*) FROM expenses WHERE ({sel[0]}) AND date IS NOT NULL GROUP BY 1 ORDER BY 1"
+		return [(str(k), float(t), int(c)) for k, t, c in self._query(sql, sel[1])]
+
+	def top(self, sel: Selection, dim: str, limit: int) -> List[Tuple[str, float]]:
+		key = "COALESCE(category, '')" if dim == "category" else "COALESCE(vendor, '')"
+		sql = f"SELECT {key}, SUM(amount) FROM expenses WHERE {sel[0]} GROUP BY 1 ORDER BY SUM(amount) DESC, MIN(id) LIMIT ?"
+		return [(str(k), float(t)) for k, t in self._query(sql, sel[1] + [max(1, int(limit))])]
+
+	def stats(self, sel: Selection, dim: Optional[str] = None) -> Any:
+		"""Exact distribution statistics of the selection, or [(key, stats)] per vendor/category/date in first-seen order."""
+		if dim is None:
+			amounts = [a for (a,) in self._query(f"SELECT amount FROM expenses WHERE {sel[0]} ORDER BY amount", sel[1])]
+			return exact_stats(amounts)
+		key = _GROUP_KEYS.get(dim, "date_raw")
+		groups: Dict[str, List[float]] = {}
+		first_seen = {k: i for i, (k,) in enumerate(self._query(f"SELECT {key} FROM expenses WHERE {sel[0]} GROUP BY 1 ORDER BY MIN(id)", sel[1]))}
+		for k, amount in self._query(f"SELECT {key}, amount FROM expenses WHERE {sel[0]} ORDER BY amount", sel[1]):
+			groups.setdefault(str(k), []).append(float(amount))
+		return [(k, exact_stats(groups[k])) for k in sorted(groups, key=lambda k: first_seen[k])]
+
+	def close(self) -> None:
+		with self._lock:
+			self._conn.close()
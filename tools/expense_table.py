@@ -0,0 +1,385 @@
+from __future__ import annotations
+
+from typing import Any, Dict, Hashable, List, Optional, Tuple
+from datetime import date
+import threading
+
+import numpy as np
+
+from tools.quantile_sketch import exact_stats
+from tools.query_engine import bucket_date, parse_processed_date, parse_row_date, row_processed_date, to_float
+from tools.text_index import TextIndex
+
+
+class _Dictionary:
+	"""Interns raw cell values to dense int codes, in first-seen order."""
+
+	def __init__(self) -> None:
+		self.codes: Dict[Hashable, int] = {}
+		self.values: List[Any] = []
+
+	def encode(self, value: Any) -> int:
+		key = value if isinstance(value, Hashable) else str(value)
+		code = self.codes.get(key)
+		if code is None:
+			code = len(self.values)
+			self.codes[key] = code
+			self.values.append(value)
+		return code
+
+	def lookup(self, values: List[Any]) -> np.ndarray:
+		return np.array([self.codes[v] for v in values if isinstance(v, Hashable) and v in self.codes], dtype=np.int32)
+
+	def labels(self) -> List[str]:
+		return [str(v) for v in self.values]
+
+
+class ExpenseTable:
+	"""
+	Columnar, array-backed expense table used as the default query engine.
+
+	Each sheet row is parsed once into typed NumPy columns: receipt and processed
+	dates as proleptic ordinals (0 when missing or unparseable), amounts as
+	float64, and vendor/category/raw date as interned int codes. Filters become
+	boolean masks and group-bys become ``bincount`` calls, so no row is re-parsed
+	per query. ``sync`` follows the row cache list incrementally.
+
+	Receipt and processed dates also have sorted indexes (ordinals plus row ids,
+	undated rows left out); a time range becomes an O(log N) ``searchsorted``
+	slice and only the rows inside it are visited by the other predicates.
+	``text_search`` goes through an inverted trigram index (``TextIndex``).
+	"""
+
+	_INITIAL_CAPACITY = 1024
+
+	def __init__(self) -> None:
+		self._lock = threading.RLock()
+		self._source: List[Dict[str, Any]] = []
+		# Bumped on every rebuild; row ids from an older generation are meaningless
+		self.generation = 0
+		self._reset()
+
+	def _reset(self) -> None:
+		self._n = 0
+		cap = self._INITIAL_CAPACITY
+		self._date = np.zeros(cap, dtype=np.int32)
+		self._processed = np.zeros(cap, dtype=np.int32)
+		self._amount = np.zeros(cap, dtype=np.float64)
+		self._vendor = np.zeros(cap, dtype=np.int32)
+		self._category = np.zeros(cap, dtype=np.int32)
+		self._date_key = np.zeros(cap, dtype=np.int32)
+		self._vendors = _Dictionary()
+		self._categories = _Dictionary()
+		self._date_keys = _Dictionary()
+		# Built on the first text_search and then kept in step with the rows
+		self._text = TextIndex()
+		# Sorted (ordinals, row ids) per date column, and how many rows each covers
+		self._sorted: Dict[bool, Tuple[np.ndarray, np.ndarray]] = {
+			False: (np.zeros(0, dtype=np.int32), np.zeros(0, dtype=np.int64)),
+			True: (np.zeros(0, dtype=np.int32), np.zeros(0, dtype=np.int64)),
+		}
+		self._sorted_n = {False: 0, True: 0}
+
+	def __len__(self) -> int:
+		return self._n
+
+	def sync(self, rows: List[Dict[str, Any]]) -> None:
+		"""Ingest rows appended to ``rows`` since the last call; a different or shrunk list triggers a rebuild."""
+		with self._lock:
+			if rows is not self._source or len(rows) < self._n:
+				self._reset()
+				self._source = rows
+				self.generation += 1
+			if len(rows) > self._n:
+				self._append(rows[self._n:])
+
+	def _grow(self, needed: int) -> None:
+		cap = len(self._amount)
+		if needed <= cap:
+			return
+		while cap < needed:
+			cap *= 2
+		for name in ("_date", "_processed", "_amount", "_vendor", "_category", "_date_key"):
+			old = getattr(self, name)
+			new = np.zeros(cap, dtype=old.dtype)
+			new[: self._n] = old[: self._n]
+			setattr(self, name, new)
+
+	def _append(self, rows: List[Dict[str, Any]]) -> None:
+		self._grow(self._n + len(rows))
+		i = self._n
+		for r in rows:
+			rd = parse_row_date(r.get("date"))
+			pd = parse_processed_date(row_processed_date(r))
+			self._date[i] = rd.toordinal() if rd else 0
+			self._processed[i] = pd.toordinal() if pd else 0
+			self._amount[i] = to_float(r.get("amount"))
+			self._vendor[i] = self._vendors.encode(r.get("vendor", ""))
+			self._category[i] = self._categories.encode(r.get("category", ""))
+			self._date_key[i] = self._date_keys.encode(str(r.get("date", "")))
+			i += 1
+		self._n = i
+
+	def _date_index(self, use_processed_date: bool) -> Tuple[np.ndarray, np.ndarray]:
+		"""Sorted ordinals and their row ids for one date column, extended with rows appended since the last call."""
+		ords, ids = self._sorted[use_processed_date]
+		done = self._sorted_n[use_processed_date]
+		if done < self._n:
+			column = (self._processed if use_processed_date else self._date)[done : self._n]
+			new_ids = np.flatnonzero(column > 0) + done
+			ids = np.concatenate([ids, new_ids])
+			ords = np.concatenate([ords, column[new_ids - done]])
+			# Appends arrive mostly in date order, so the stable (run-merging) sort is close to linear
+			order = np.argsort(ords, kind="stable")
+			ords, ids = ords[order], ids[order]
+			self._sorted[use_processed_date] = (ords, ids)
+			self._sorted_n[use_processed_date] = self._n
+		return ords, ids
+
+	def _candidates(self, start: Optional[date], end: Optional[date], use_processed_date: bool) -> np.ndarray:
+		if not (start or end):
+			return np.arange(self._n, dtype=np.int64)
+		ords, ids = self._date_index(use_processed_date)
+		lo = int(np.searchsorted(ords, start.toordinal(), side="left")) if start else 0
+		hi = int(np.searchsorted(ords, end.toordinal(), side="right")) if end else len(ords)
+		# Back to sheet order, which rows() and tie-breaking rely on
+		return np.sort(ids[lo:hi]) if hi > lo else np.zeros(0, dtype=np.int64)
+
+	def vendors(self) -> List[str]:
+		with self._lock:
+			return sorted({str(v).strip() for v in self._vendors.values if v})
+
+	def select(self, filters: Dict[str, Any], start: Optional[date], end: Optional[date], use_processed_date: bool = False) -> np.ndarray:
+		with self._lock:
+			# The date index leaves out missing dates, which never satisfy a bound
+			return self._filter(self._candidates(start, end, use_processed_date), filters)
+
+	def _filter(self, idx: np.ndarray, filters: Dict[str, Any]) -> np.ndarray:
+		"""The row ids of ``idx`` that pass the non-date filters."""
+		with self._lock:
+			mask = np.ones(len(idx), dtype=bool)
+			categories = (filters or {}).get("categories") or []
+			if categories:
+				mask &= np.isin(self._category[idx], self._categories.lookup(list(categories)))
+			vendors = (filters or {}).get("vendors") or []
+			if vendors:
+				mask &= np.isin(self._vendor[idx], self._vendors.lookup(list(vendors)))
+			if (filters or {}).get("min_amount") is not None or (filters or {}).get("max_amount") is not None:
+				amount = self._amount[idx]
+				if (filters or {}).get("min_amount") is not None:
+					mask &= amount >= float(filters["min_amount"])
+				if (filters or {}).get("max_amount") is not None:
+					mask &= amount <= float(filters["max_amount"])
+			idx = idx[mask]
+			needle = str((filters or {}).get("text_search") or "").strip().lower()
+			if needle and len(idx):
+				self._text.sync(self._source)
+				idx = self._text.search(needle, idx)
+			return idx
+
+	def select_variants(self, variants: List[Tuple[Dict[str, Any], Optional[date], Optional[date], bool]]) -> List[np.ndarray]:
+		"""
+		Selections for several (filters, start, end, use_processed_date) variants in one pass.
+
+		The union of the variants' date-index slices is visited once: each distinct
+		predicate (a date window on one column, a category set, a vendor set, an
+		amount bound, a text needle) is evaluated once over it, and every variant is
+		the conjunction of its predicates' masks.
+		"""
+		with self._lock:
+			if len(variants) == 1:
+				return [self.select(*variants[0])]
+			parts = [self._candidates(start, end, use_processed) for _, start, end, use_processed in variants]
+			idx = np.unique(np.concatenate(parts)) if parts else np.zeros(0, dtype=np.int64)
+			masks: Dict[Tuple[Any, ...], np.ndarray] = {}
+
+			def predicate(key: Tuple[Any, ...]) -> np.ndarray:
+				mask = masks.get(key)
+				if mask is None:
+					kind = key[0]
+					if kind == "date":
+						_, start, end, use_processed = key
+						ords = (self._processed if use_processed else self._date)[idx]
+						mask = ords > 0
+						if start:
+							mask &= ords >= start.toordinal()
+						if end:
+							mask &= ords <= end.toordinal()
+					elif kind == "categories":
+						mask = np.isin(self._category[idx], self._categories.lookup(list(key[1])))
+					elif kind == "vendors":
+						mask = np.isin(self._vendor[idx], self._vendors.lookup(list(key[1])))
+					elif kind == "min_amount":
+						mask = self._amount[idx] >= key[1]
+					elif kind == "max_amount":
+						mask = self._amount[idx] <= key[1]
+					else:
+						self._text.sync(self._source)
+						mask = np.isin(idx, self._text.search(key[1], idx))
+					masks[key] = mask
+				return mask
+
+			results: List[np.ndarray] = []
+			for filters, start, end, use_processed in variants:
+				f = filters or {}
+				mask = np.ones(len(idx), dtype=bool)
+				if start or end:
+					mask &= predicate(("date", start, end, bool(use_processed)))
+				for key in ("categories", "vendors"):
+					if f.get(key):
+						mask &= predicate((key, tuple(f[key])))
+				for key in ("min_amount", "max_amount"):
+					if f.get(key) is not None:
+						mask &= predicate((key, float(f[key])))
+				needle = str(f.get("text_search") or "").strip().lower()
+				if needle:
+					mask &= predicate(("text", needle))
+				results.append(idx[mask])
+			return results
+
+	def window_totals(self, filters: Dict[str, Any], windows: List[Tuple[Optional[date], Optional[date]]], use_processed_date: bool = False, processed_fallback: bool = False) -> List[Tuple[float, int]]:
+		"""
+		(total, count) of the rows matching ``filters`` in each (start, end) window, in one pass.
+
+		The span of all windows is selected once; each row's date is located among
+		the windows' sorted boundaries with ``searchsorted`` and binned into the
+		elementary segment it falls in, and a window's total is the sum of the
+		segments it spans. Windows may overlap; the cost is O(rows log windows),
+		not rows x windows. With ``processed_fallback`` the processed dates of the
+		same selected rows are binned too, and a window without receipt-date rows
+		takes its processed-date totals.
+		"""
+		with self._lock:
+			if not windows:
+				return []
+			columns = [use_processed_date] + ([True] if processed_fallback and not use_processed_date else [])
+			starts = [s for s, _ in windows]
+			ends = [e for _, e in windows]
+			# An unbounded window also takes undated rows, so then every row is a candidate
+			span_start = None if any(s is None for s in starts) else min(starts)  # type: ignore[type-var]
+			span_end = None if any(e is None for e in ends) else max(ends)  # type: ignore[type-var]
+			parts = [self._candidates(span_start, span_end, column) for column in columns]
+			idx = self._filter(parts[0] if len(parts) == 1 else np.unique(np.concatenate(parts)), filters)
+			amounts = self._amount[idx]
+			binned = [self._binned((self._processed if column else self._date)[idx], amounts, windows) for column in columns]
+			if len(binned) == 1:
+				return binned[0]
+			return [r if r[1] else p for r, p in zip(*binned)]
+
+	@staticmethod
+	def _binned(ords: np.ndarray, amounts: np.ndarray, windows: List[Tuple[Optional[date], Optional[date]]]) -> List[Tuple[float, int]]:
+		"""(total, count) per window of rows with the given date ordinals (0: undated, only in unbounded windows)."""
+		# Half-open [start, end + 1) ordinal bounds; open sides reach past every real date
+		bounds = [(s.toordinal() if s else 1, e.toordinal() + 1 if e else date.max.toordinal() + 1) for s, e in windows]
+		edges = np.unique(np.array([b for pair in bounds for b in pair], dtype=np.int64))
+		segment = np.searchsorted(edges, ords, side="right") - 1
+		inside = (ords > 0) & (segment >= 0) & (segment < len(edges) - 1)
+		seg_totals = np.bincount(segment[inside], weights=amounts[inside], minlength=len(edges))
+		seg_counts = np.bincount(segment[inside], minlength=len(edges))
+		results: List[Tuple[float, int]] = []
+		for (start, end), (lo, hi) in zip(windows, bounds):
+			if not (start or end):
+				results.append((float(amounts.sum()), int(len(amounts))))
+				continue
+			a, b = int(np.searchsorted(edges, lo)), int(np.searchsorted(edges, hi))
+			results.append((float(seg_totals[a:b].sum()), int(seg_counts[a:b].sum())) if b > a else (0.0, 0))
+		return results
+
+	def count(self, sel: np.ndarray) -> int:
+		return int(len(sel))
+
+	def total(self, sel: np.ndarray) -> Tuple[float, int]:
+		with self._lock:
+			return float(self._amount[sel].sum()), int(len(sel))
+
+	def rows(self, sel: np.ndarray) -> List[Dict[str, Any]]:
+		with self._lock:
+			return [self._source[i] for i in sel]
+
+	def order(self, sel: np.ndarray, by: str, direction: str) -> np.ndarray:
+		"""The selection's row ids sorted by amount, date, vendor or category; ties keep sheet order."""
+		with self._lock:
+			if by in {"amount", "total"}:
+				key = self._amount[sel]
+			elif by in {"vendor", "category"}:
+				codes, dictionary = self._codes_for(by)
+				labels = np.array([label.lower() for label in dictionary.labels()], dtype=object)
+				rank = np.empty(len(labels), dtype=np.int64)
+				rank[np.argsort(labels, kind="stable")] = np.arange(len(labels))
+				key = rank[codes[sel]]
+			else:
+				# Undated rows have ordinal 0 and sort as the oldest
+				key = self._date[sel].astype(np.int64)
+			order = np.argsort(-key if direction == "desc" else key, kind="stable")
+			return sel[order]
+
+	def page(self, ordered: np.ndarray, offset: int, limit: int) -> List[Dict[str, Any]]:
+		return self.rows(ordered[offset : offset + limit])
+
+	def _codes_for(self, dim: str) -> Tuple[np.ndarray, _Dictionary]:
+		if dim == "vendor":
+			return self._vendor, self._vendors
+		if dim == "category":
+			return self._category, self._categories
+		return self._date_key, self._date_keys
+
+	def group(self, sel: np.ndarray, dim: str) -> List[Tuple[str, float, int]]:
+		with self._lock:
+			codes, dictionary = self._codes_for(dim)
+			size = len(dictionary.values)
+			totals = np.bincount(codes[sel], weights=self._amount[sel], minlength=size)
+			counts = np.bincount(codes[sel], minlength=size)
+			labels = dictionary.labels()
+			return [(labels[c], float(totals[c]), int(counts[c])) for c in np.flatnonzero(counts)]
+
+	def trend(self, sel: np.ndarray, granularity: str) -> List[Tuple[str, float, int]]:
+		with self._lock:
+			gran = granularity or "month"
+			ords = self._date[sel]
+			dated = ords > 0
+			ords = ords[dated]
+			amounts = self._amount[sel][dated]
+			if not len(ords):
+				return []
+			# Bucket each distinct day once, then aggregate per bucket
+			days, inverse = np.unique(ords, return_inverse=True)
+			bucket_of_day = [bucket_date(date.fromordinal(int(d)), gran) for d in days]
+			buckets = sorted(set(bucket_of_day))
+			position = {b: i for i, b in enumerate(buckets)}
+			day_to_bucket = np.array([position[b] for b in bucket_of_day], dtype=np.int64)
+			bucket_idx = day_to_bucket[inverse.ravel()]
+			totals = np.bincount(bucket_idx, weights=amounts, minlength=len(buckets))
+			counts = np.bincount(bucket_idx, minlength=len(buckets))
+			return [(b, float(totals[i]), int(counts[i])) for i, b in enumerate(buckets)]
+
+	def top(self, sel: np.ndarray, dim: str, limit: int) -> List[Tuple[str, float]]:
+		with self._lock:
+			codes, dictionary = self._codes_for("category" if dim == "category" else "vendor")
+			size = len(dictionary.values)
+			totals = np.bincount(codes[sel], weights=self._amount[sel], minlength=size)
+			present = np.flatnonzero(np.bincount(codes[sel], minlength=size))
+			k = max(1, int(limit))
+			if len(present) > k:
+				# Partial selection (the vectorized nlargest): keep totals at or above the k-th largest, ties included
+				kth = np.partition(totals[present], len(present) - k)[len(present) - k]
+				present = present[totals[present] >= kth]
+			# Stable sort of the survivors keeps first-seen order among equal totals
+			order = present[np.argsort(-totals[present], kind="stable")][:k]
+			labels = dictionary.labels()
+			return [(labels[c], float(totals[c])) for c in order]
+
+	def stats(self, sel: np.ndarray, dim: Optional[str] = None) -> Any:
+		"""Exact distribution statistics of the selection, or [(key, stats)] per vendor/category in first-seen order."""
+		with self._lock:
+			amounts = self._amount[sel]
+			if dim is None:
+				return exact_stats(np.sort(amounts))
+			codes, dictionary = self._codes_for(dim)
+			keys = codes[sel]
+			# One sort groups the rows by key with each group's amounts ascending
+			order = np.lexsort((amounts, keys))
+			keys, amounts = keys[order], amounts[order]
+			starts = np.flatnonzero(np.r_[True, keys[1:] != keys[:-1]]) if len(keys) else np.zeros(0, dtype=np.int64)
+			ends = np.r_[starts[1:], len(keys)]
+			labels = dictionary.labels()
+			return [(labels[keys[a]], exact_stats(amounts[a:b])) for a, b in zip(starts, ends)]
@@ -0,0 +1,267 @@
+from __future__ import annotations
+
+from typing import Any, Dict, List, Optional, Tuple
+from pathlib import Path
+import json
+import re
+
+from tools.vendor_index import VendorIndex, normalize_name
+
+
+_CATEGORIES_PATH = Path(__file__).resolve().parents[1] / "data" / "templates" / "expense_categories.json"
+
+# Period phrases -> the relative values _resolve_relative_range understands (longest phrases first)
+_PERIODS: List[Tuple[str, str]] = [
+	("in the last 90 days", "last_90_days"),
+	("in the past 90 days", "last_90_days"),
+	("in the last 7 days", "last_7_days"),
+	("in the past 7 days", "last_7_days"),
+	("last 90 days", "last_90_days"),
+	("past 90 days", "last_90_days"),
+	("last 7 days", "last_7_days"),
+	("past 7 days", "last_7_days"),
+	("previous quarter", "last_quarter"),
+	("last quarter", "last_quarter"),
+	("previous month", "last_month"),
+	("last month", "last_month"),
+	("this month", "this_month"),
+	("year to date", "this_year"),
+	("this year", "this_year"),
+	("ytd", "this_year"),
+]
+
+_DIMENSIONS = {
+	"vendor": "vendor", "vendors": "vendor", "merchant": "vendor", "merchants": "vendor", "store": "vendor", "stores": "vendor",
+	"category": "category", "categories": "category",
+}
+_GRANULARITIES = {
+	"daily": "day", "day": "day", "weekly": "week", "week": "week", "monthly": "month", "month": "month",
+	"quarterly": "quarter", "quarter": "quarter", "yearly": "year", "year": "year", "annually": "year",
+}
+_SUMMARY_WORDS = {"total", "spend", "spent", "spending", "sum", "much", "cost", "costs"}
+_SEARCH_WORDS = {"show", "list", "find"}
+# Words asking for a distribution statistic instead of the sum
+_METRIC_WORDS = {
+	"average": "mean", "avg": "mean", "mean": "mean", "typical": "median", "median": "median", "p90": "p90",
+	"smallest": "min", "cheapest": "min", "minimum": "min", "priciest": "max", "maximum": "max",
+}
+# Words that carry no plan information in the recognized question shapes
+_FILLER = {
+	"what", "what's", "whats", "is", "was", "are", "were", "my", "our", "we", "i", "me", "us", "did", "do", "does",
+	"have", "has", "how", "the", "a", "an", "in", "on", "at", "from", "for", "to", "of", "with", "all", "so", "far",
+	"expenses", "expense", "transactions", "receipts", "money", "please", "give", "tell", "amount", "overall",
+	"by", "per", "each", "trend", "over", "time", "breakdown", "spends",
+}
+_NUMBER = re.compile(r"^\d+(?:\.\d+)?$")
+_AMOUNT = re.compile(r"\b(over|above|more than|at least|under|below|less than|at most)\s+\$?(\d+(?:\.\d+)?)\b")
+_TOP = re.compile(r"\b(?:top|biggest|largest)\s+(?:(\d{1,2})\s+)?(vendors?|merchants?|stores?|categories|category)\b")
+
+
+# A masked entity: (slot type, value); slot types are vendor, category, period and number
+Slot = Tuple[str, Any]
+
+
+def _words(query: str) -> List[str]:
+	text = re.sub(r"[?!,$]", " ", (query or "").lower())
+	return [w for w in (w.strip(".'-") for w in text.split()) if w]
+
+
+def mask_query(query: str, vendors: Optional[VendorIndex] = None, categories: Optional[Dict[str, str]] = None) -> Tuple[List[str], List[Slot]]:
+	"""
+	Replace entities in ``query`` with slot tokens, left to right, longest match first.
+
+	Returns the masked words ("<vendor>", "<period>", ...) and the slots in order,
+	e.g. "Staples spend last month" -> (["<vendor>", "spend", "<period>"],
+	[("vendor", "Staples"), ("period", "last_month")]).
+	"""
+	words = _words(query)
+	periods = sorted(((p.split(" "), rel) for p, rel in _PERIODS), key=lambda item: -len(item[0]))
+	masked: List[str] = []
+	slots: List[Slot] = []
+	i = 0
+	while i < len(words):
+		match: Optional[Tuple[int, Slot]] = None
+		for phrase, rel in periods:
+			if words[i : i + len(phrase)] == phrase:
+				match = (len(phrase), ("period", rel))
+				break
+		if match is None and _NUMBER.match(words[i]):
+			value = float(words[i])
+			match = (1, ("number", int(value) if value.is_integer() else value))
+		for size in range(min(6, len(words) - i), 0, -1):
+			if match is not None:
+				break
+			phrase = " ".join(words[i : i + size])
+			found = vendors.exact(phrase) if vendors is not None else None
+			if found:
+				match = (size, ("vendor", found))
+			elif categories and phrase in categories:
+				match = (size, ("category", categories[phrase]))
+		if match is None:
+			masked.append(words[i])
+			i += 1
+			continue
+		size, slot = match
+		masked.append(f"<{slot[0]}>")
+		slots.append(slot)
+		i += size
+	return masked, slots
+
+
+def _load_categories() -> List[str]:
+	try:
+		with open(_CATEGORIES_PATH, "r", encoding="utf-8") as f:
+			categories = [str(c) for c in json.load(f)]
+	except Exception:
+		categories = []
+	# The query prompt also offers Groceries
+	if "Groceries" not in categories:
+		categories.append("Groceries")
+	return categories
+
+
+class FastQueryParser:
+	"""
+	Rule-based parser for formulaic expense questions, used before the LLM.
+
+	Recognizes totals ("total at Walmart this month"), top-N leaderboards ("top 5
+	vendors last quarter"), breakdowns ("spend by category this year"), trends
+	("monthly spend this year") and listings ("show expenses at Uber"), with
+	optional amount bounds. Vendors must match a known name exactly, categories
+	their name or first word, and periods the relative vocabulary of
+	``QueryAnalyzer._resolve_relative_range``. ``parse`` returns a raw plan in
+	the Granite output format and a confidence: the share of query words the
+	rules accounted for. ``QueryAnalyzer`` falls back to Granite below
+	``min_confidence``.
+	"""
+
+	def __init__(self, vendors: Optional[VendorIndex] = None, categories: Optional[List[str]] = None, min_confidence: float = 1.0) -> None:
+		self.vendors = vendors
+		self.min_confidence = float(min_confidence)
+		self.hits = 0
+		self.misses = 0
+		self._categories: Dict[str, str] = {}
+		names = categories if categories is not None else _load_categories()
+		first_words: Dict[str, List[str]] = {}
+		for name in names:
+			self._categories[normalize_name(name)] = name
+			first = normalize_name(name).split(" ")[0]
+			if len(first) >= 5 and first != "other":
+				first_words.setdefault(first, []).append(name)
+		for word, matches in first_words.items():
+			# "travel" -> Travel & Transportation, unless the word starts several categories
+			if len(matches) == 1:
+				self._categories.setdefault(word, matches[0])
+
+	def mask(self, query: str) -> Tuple[List[str], List[Slot]]:
+		"""``mask_query`` with this parser's vendor and category vocabulary."""
+		return mask_query(query, self.vendors, self._categories)
+
+	def parse(self, query: str) -> Tuple[Optional[Dict[str, Any]], float]:
+		raw, confidence = self._parse(query)
+		if raw is None:
+			self.misses += 1
+		else:
+			self.hits += 1
+		return raw, confidence
+
+	def _parse(self, query: str) -> Tuple[Optional[Dict[str, Any]], float]:
+		text = " " + re.sub(r"\s+", " ", (query or "").lower().replace("?", " ").replace("!", " ").replace(",", " ")).strip() + " "
+		relative = None
+		for phrase, rel in _PERIODS:
+			if f" {phrase} " in text:
+				relative = rel
+				text = text.replace(f" {phrase} ", " ", 1)
+				break
+		min_amount = max_amount = None
+		for m in list(_AMOUNT.finditer(text)):
+			if m.group(1) in {"over", "above", "more than", "at least"}:
+				min_amount = float(m.group(2))
+			else:
+				max_amount = float(m.group(2))
+		text = _AMOUNT.sub(" ", text)
+		top = _TOP.search(text)
+		if top:
+			text = text[: top.start()] + " " + text[top.end():]
+		words = [w.strip(".'-") for w in text.replace("$", " ").split()]
+		words = [w for w in words if w]
+		if not words and not top:
+			return None, 0.0
+
+		vendor, category, group_by, granularity, metric = None, None, None, None, None
+		summary = search = False
+		used = [False] * len(words)
+		# Entities first, longest window first, so "office depot" is a vendor and not a category word
+		for size in range(min(6, len(words)), 0, -1):
+			for i in range(len(words) - size + 1):
+				if any(used[i : i + size]):
+					continue
+				phrase = " ".join(words[i : i + size])
+				found_vendor = self.vendors.exact(phrase) if self.vendors is not None else None
+				if found_vendor and vendor is None:
+					vendor = found_vendor
+				elif phrase in self._categories and category is None:
+					category = self._categories[phrase]
+				else:
+					continue
+				for j in range(i, i + size):
+					used[j] = True
+		for i, w in enumerate(words):
+			if used[i]:
+				continue
+			prev = words[i - 1] if i else ""
+			if prev in {"by", "per", "each"} and w in _DIMENSIONS:
+				group_by = _DIMENSIONS[w]
+			elif prev in {"by", "per", "each"} and w in _GRANULARITIES:
+				granularity = _GRANULARITIES[w]
+			elif w in {"daily", "weekly", "monthly", "quarterly", "yearly", "annually"}:
+				granularity = _GRANULARITIES[w]
+			elif w in _SUMMARY_WORDS:
+				summary = True
+			elif w in _METRIC_WORDS:
+				metric = _METRIC_WORDS[w]
+			elif w in _SEARCH_WORDS:
+				search = True
+			elif w not in _FILLER:
+				continue
+			used[i] = True
+		confidence = (sum(used) + (1 if top else 0)) / float(len(words) + (1 if top else 0))
+		if confidence < self.min_confidence:
+			return None, confidence
+
+		raw: Dict[str, Any] = {
+			"intent": "summary",
+			"time_range": {"start_date": None, "end_date": None, "relative": relative},
+			"filters": {
+				"vendors": [vendor] if vendor else None,
+				"categories": [category] if category else None,
+				"min_amount": min_amount,
+				"max_amount": max_amount,
+				"text_search": None,
+			},
+			"group_by": "none",
+			"trend": {"enabled": False, "granularity": "month"},
+			"top_n": {"enabled": False, "dimension": "vendor", "limit": 5},
+			"compare": {"enabled": False, "baseline": None, "target": None},
+			"sort": {"by": "date", "direction": "desc"},
+			"output": {"format": "summary", "chart": {"type": None, "dimension": None, "metric": None}},
+		}
+		if top:
+			dim = _DIMENSIONS[top.group(2)]
+			raw.update({"intent": "top_n", "group_by": dim, "top_n": {"enabled": True, "dimension": dim, "limit": int(top.group(1) or 5)}})
+			raw["sort"] = {"by": "total", "direction": "desc"}
+		elif granularity:
+			raw.update({"intent": "trend", "trend": {"enabled": True, "granularity": granularity}})
+			raw["sort"] = {"by": "total", "direction": "desc"}
+		elif group_by:
+			raw.update({"intent": "aggregate", "group_by": group_by})
+			raw["sort"] = {"by": "total", "direction": "desc"}
+		elif search:
+			raw.update({"intent": "search"})
+			raw["output"]["format"] = "table"
+		elif not (summary or metric or vendor or category):
+			# Only filler and a period: not a question shape we recognize
+			return None, 0.0
+		if metric:
+			raw["metric"] = metric
+		return raw, confidence
@@ -0,0 +1,164 @@
+from __future__ import annotations
+
+from typing import Any, List, Optional, Tuple
+from collections import OrderedDict
+from pathlib import Path
+import json
+import os
+import threading
+
+import numpy as np
+from PIL import Image, ImageOps
+
+
+def phash(image: Image.Image, hash_size: int = 16, highfreq_factor: int = 4) -> int:
+	"""
+	DCT perceptual hash of a downscaled grayscale image.
+
+	The low-frequency ``hash_size`` x ``hash_size`` DCT block (minus the DC term)
+	is thresholded at its median, giving a ``hash_size ** 2 - 1``-bit integer.
+	Unlike a difference hash it is stable on the flat white areas of a receipt,
+	so re-framed or re-exposed photos of the same receipt differ in few bits.
+	"""
+	n = hash_size * highfreq_factor
+	pixels = np.asarray(ImageOps.grayscale(image).resize((n, n), Image.LANCZOS), dtype=np.float64)
+	k = np.arange(n)
+	basis = np.cos(np.pi * (2 * k[None, :] + 1) * k[:, None] / (2 * n))
+	coeffs = (basis @ pixels @ basis.T)[:hash_size, :hash_size].ravel()[1:]
+	bits = 0
+	for bit in coeffs > np.median(coeffs):
+		bits = (bits << 1) | int(bit)
+	return bits
+
+
+def hamming(a: int, b: int) -> int:
+	return bin(a ^ b).count("1")
+
+
+class BKTree:
+	"""Burkhard-Keller tree over integer hashes for Hamming-distance range queries."""
+
+	def __init__(self) -> None:
+		# Node: [hash, values, {distance: child}]
+		self._root: Optional[List[Any]] = None
+		self._size = 0
+
+	def __len__(self) -> int:
+		return self._size
+
+	def add(self, h: int, value: Any) -> None:
+		self._size += 1
+		if self._root is None:
+			self._root = [h, [value], {}]
+			return
+		node = self._root
+		while True:
+			d = hamming(h, node[0])
+			if d == 0:
+				node[1].append(value)
+				return
+			child = node[2].get(d)
+			if child is None:
+				node[2][d] = [h, [value], {}]
+				return
+			node = child
+
+	def search(self, h: int, max_distance: int) -> List[Tuple[int, Any]]:
+		"""All values within ``max_distance`` of ``h`` as (distance, value), closest first."""
+		found: List[Tuple[int, Any]] = []
+		stack = [self._root] if self._root is not None else []
+		while stack:
+			node = stack.pop()
+			d = hamming(h, node[0])
+			if d <= max_distance:
+				found.extend((d, v) for v in node[1])
+			# Triangle inequality: only children at distance within [d - k, d + k] can match
+			for edge, child in node[2].items():
+				if d - max_distance <= edge <= d + max_distance:
+					stack.append(child)
+		found.sort(key=lambda item: item[0])
+		return found
+
+
+class PerceptualHashIndex:
+	"""
+	Transcripts of previously processed receipt images, looked up by perceptual hash.
+
+	Entries are kept in a BK-tree and, with a ``path``, appended to a JSON Lines
+	file so they survive restarts. At most ``max_entries`` are kept: a lookup hit
+	or re-add marks an entry recently used, the least recently used ones are
+	evicted, and the file is rewritten with the live entries once it holds more
+	than twice that many lines.
+	"""
+
+	def __init__(self, path: Optional[str] = None, max_distance: int = 20, max_entries: int = 1000) -> None:
+		self.path = Path(path) if path else None
+		self.max_distance = int(max_distance)
+		self.max_entries = max(1, int(max_entries))
+		self._tree = BKTree()
+		# hash -> transcript, least recently used first
+		self._entries: "OrderedDict[int, str]" = OrderedDict()
+		self._lines = 0
+		self._lock = threading.Lock()
+		if self.path is not None and self.path.exists():
+			with open(self.path, "r", encoding="utf-8") as f:
+				for line in f:
+					self._lines += 1
+					try:
+						entry = json.loads(line)
+						h = int(entry["hash"], 16)
+						self._entries[h] = entry["transcript"]
+						self._entries.move_to_end(h)
+					except Exception:
+						continue
+			while len(self._entries) > self.max_entries:
+				self._entries.popitem(last=False)
+			self._rebuild()
+			if self._lines > 2 * self.max_entries:
+				self._compact()
+
+	def __len__(self) -> int:
+		return len(self._entries)
+
+	def _rebuild(self) -> None:
+		self._tree = BKTree()
+		for h in self._entries:
+			self._tree.add(h, h)
+
+	def _compact(self) -> None:
+		tmp = self.path.with_suffix(".tmp")
+		with open(tmp, "w", encoding="utf-8") as f:
+			for h, transcript in self._entries.items():
+				f.write(json.dumps({"hash": format(h, "x"), "transcript": transcript}) + "\n")
+		os.replace(tmp, self.path)
+		self._lines = len(self._entries)
+
+	def lookup(self, h: int) -> Optional[Tuple[int, str]]:
+		"""Closest stored (distance, transcript) within ``max_distance``, if any."""
+		with self._lock:
+			matches = self._tree.search(h, self.max_distance)
+			if not matches:
+				return None
+			distance, key = matches[0]
+			self._entries.move_to_end(key)
+			return distance, self._entries[key]
+
+	def add(self, h: int, transcript: str) -> None:
+		with self._lock:
+			known = h in self._entries
+			self._entries[h] = transcript
+			self._entries.move_to_end(h)
+			if len(self._entries) > self.max_entries:
+				while len(self._entries) > self.max_entries:
+					self._entries.popitem(last=False)
+				# BK-trees cannot delete; rebuild from the surviving entries
+				self._rebuild()
+			elif not known:
+				self._tree.add(h, h)
+			if self.path is not None:
+				self.path.parent.mkdir(parents=True, exist_ok=True)
+				with open(self.path, "a", encoding="utf-8") as f:
+					f.write(json.dumps({"hash": format(h, "x"), "transcript": transcript}) + "\n")
+				self._lines += 1
+				if self._lines > 2 * self.max_entries:
+					self._compact()
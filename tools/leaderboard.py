@@ -0,0 +1,59 @@
+from __future__ import annotations
+
+from typing import Any, Dict, List, Optional, Tuple
+import heapq
+
+
+class Leaderboard:
+	"""
+	Running totals per key with a max-heap for top-k reads.
+
+	``add`` updates a key's total in O(1) and pushes its new (total, rank, key)
+	onto the heap; superseded heap entries stay behind and are dropped when a
+	read pops them, or all at once when they outnumber live keys (compaction).
+	``top(k)`` therefore costs O(k log n) amortized instead of sorting every key.
+	Equal totals are ordered by ``rank``: the key's first-seen position, taken
+	from a shared ``ranks`` dict when given so several boards agree with the
+	row engines' tie-breaking. Not thread-safe; the owner serializes access.
+	"""
+
+	def __init__(self, ranks: Optional[Dict[Any, int]] = None) -> None:
+		self._ranks: Dict[Any, int] = ranks if ranks is not None else {}
+		self._totals: Dict[Any, float] = {}
+		self._heap: List[Tuple[float, int, Any]] = []
+
+	def __len__(self) -> int:
+		return len(self._totals)
+
+	def totals(self) -> Dict[Any, float]:
+		return self._totals
+
+	def add(self, key: Any, amount: float) -> None:
+		rank = self._ranks.setdefault(key, len(self._ranks))
+		total = self._totals.get(key, 0.0) + amount
+		self._totals[key] = total
+		heapq.heappush(self._heap, (-total, rank, key))
+		if len(self._heap) > 2 * len(self._totals) + 64:
+			self._heap = [(-t, self._ranks[k], k) for k, t in self._totals.items()]
+			heapq.heapify(self._heap)
+
+	def top(self, k: int) -> List[Tuple[Any, float]]:
+		"""The ``k`` largest (key, total) pairs, largest first."""
+		leaders: List[Tuple[float, int, Any]] = []
+		seen = set()
+		while self._heap and len(leaders) < k:
+			entry = heapq.heappop(self._heap)
+			neg_total, _, key = entry
+			# A superseded total, or a second entry for a key already taken: drop it for good
+			if key in seen or self._totals.get(key) != -neg_total:
+				continue
+			seen.add(key)
+			leaders.append(entry)
+		for entry in leaders:
+			heapq.heappush(self._heap, entry)
+		return [(key, -neg_total) for neg_total, _, key in leaders]
+
+
+def top_totals(totals: Dict[Any, float], ranks: Dict[Any, int], k: int) -> List[Tuple[Any, float]]:
+	"""Top ``k`` of an ad-hoc totals dict with ``heapq.nlargest`` (O(n log k)); equal totals by rank."""
+	return [(key, total) for key, total in heapq.nlargest(k, totals.items(), key=lambda kv: (kv[1], -ranks[kv[0]]))]
@@ -0,0 +1,78 @@
+from __future__ import annotations
+
+from typing import Any, Dict, Optional
+from collections import OrderedDict
+from pathlib import Path
+import json
+import logging
+import os
+import threading
+import time
+
+
+logger = logging.getLogger(__name__)
+
+
+class PlanCache:
+	"""
+	TTL + LRU cache of raw query plans returned by Granite.
+
+	Keys are built by ``QueryAnalyzer``. With a ``path`` the entries (and their
+	creation times, so the TTL still applies) are rewritten to one JSON file on
+	every change and reloaded at startup.
+	"""
+
+	def __init__(self, path: Optional[str] = None, ttl_seconds: float = 86400.0, max_entries: int = 512) -> None:
+		self.path = Path(path) if path else None
+		self.ttl_seconds = float(ttl_seconds)
+		self.max_entries = max(1, int(max_entries))
+		self._lock = threading.Lock()
+		self._entries: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+		self.hits = 0
+		self.misses = 0
+		if self.path is not None and self.path.exists():
+			try:
+				with open(self.path, "r", encoding="utf-8") as f:
+					for key, entry in json.load(f):
+						self._entries[key] = entry
+			except Exception as e:
+				logger.warning("Ignoring unreadable plan cache %s: %s", self.path, e)
+
+	def __len__(self) -> int:
+		return len(self._entries)
+
+	def _expired(self, entry: Dict[str, Any], now: float) -> bool:
+		return now - float(entry.get("created", 0)) > self.ttl_seconds
+
+	def get(self, key: str) -> Optional[Dict[str, Any]]:
+		with self._lock:
+			entry = self._entries.get(key)
+			if entry is None or self._expired(entry, time.time()):
+				if entry is not None:
+					del self._entries[key]
+					self._save()
+				self.misses += 1
+				return None
+			self._entries.move_to_end(key)
+			self.hits += 1
+			return json.loads(json.dumps(entry["plan"]))
+
+	def put(self, key: str, plan: Dict[str, Any]) -> None:
+		with self._lock:
+			self._entries[key] = {"plan": json.loads(json.dumps(plan)), "created": time.time()}
+			self._entries.move_to_end(key)
+			while len(self._entries) > self.max_entries:
+				self._entries.popitem(last=False)
+			self._save()
+
+	def _save(self) -> None:
+		if self.path is None:
+			return
+		try:
+			self.path.parent.mkdir(parents=True, exist_ok=True)
+			tmp = self.path.with_suffix(".tmp")
+			with open(tmp, "w", encoding="utf-8") as f:
+				json.dump(list(self._entries.items()), f)
+			os.replace(tmp, self.path)
+		except Exception as e:
+			logger.warning("Could not persist plan cache to %s: %s", self.path, e)
@@ -0,0 +1,161 @@
+from __future__ import annotations
+
+from typing import Dict, Optional, Sequence
+import math
+
+
+# Distribution metrics a query plan can ask for, besides the "total" and "count" sums
+DISTRIBUTION_METRICS = ("mean", "median", "p90", "min", "max", "stddev")
+
+_QUANTILES = {"median": 0.5, "p90": 0.9}
+# Shifts bucket indexes of amounts below 1 (down to ~1e-8 at 1% accuracy) above zero, so one dict keyed by
+# signed index holds negatives, zero and positives in value order
+_OFFSET = 1000
+
+
+class QuantileSketch:
+	"""
+	Mergeable streaming summary of amounts.
+
+	Count, total, mean, standard deviation (population), min and max are exact;
+	quantiles come from logarithmic buckets (DDSketch): a value x lands in bucket
+	ceil(log(|x|) / log(gamma)) with gamma = (1 + a) / (1 - a), and the bucket's
+	representative is within relative error ``a`` of every value in it. Merging
+	adds bucket counts and combines the moments (Chan et al.), so month sketches
+	merge into any month range exactly as if built from the combined stream, and
+	the size depends on the spread of amounts (~230 buckets per decade at 1%),
+	never on how many were added. Zero and negative amounts (refunds) get their
+	own buckets. Sketches that take the same amount can share one ``bucket``
+	computation. Not thread-safe; the owner serializes access.
+	"""
+
+	__slots__ = ("relative_accuracy", "_log_gamma", "count", "total", "_mean", "_m2", "min", "max", "_buckets")
+
+	def __init__(self, relative_accuracy: float = 0.01) -> None:
+		self.relative_accuracy = float(relative_accuracy)
+		self._log_gamma = math.log((1 + self.relative_accuracy) / (1 - self.relative_accuracy))
+		self.count = 0
+		self.total = 0.0
+		self._mean = 0.0
+		self._m2 = 0.0
+		self.min = math.inf
+		self.max = -math.inf
+		self._buckets: Dict[int, int] = {}
+
+	def __len__(self) -> int:
+		return self.count
+
+	def bucket(self, value: float) -> int:
+		"""Signed bucket index of ``value``, increasing with the value; 0 holds zero."""
+		x = float(value)
+		if x > 0:
+			return max(1, math.ceil(math.log(x) / self._log_gamma) + _OFFSET)
+		if x < 0:
+			return min(-1, -math.ceil(math.log(-x) / self._log_gamma) - _OFFSET)
+		return 0
+
+	def add(self, value: float, bucket: Optional[int] = None) -> None:
+		"""Add one amount; ``bucket`` may pass a precomputed ``self.bucket(value)`` when one amount feeds several sketches."""
+		x = float(value)
+		n = self.count = self.count + 1
+		self.total += x
+		# Welford's running mean and sum of squared deviations
+		mean = self._mean
+		delta = x - mean
+		mean += delta / n
+		self._mean = mean
+		self._m2 += delta * (x - mean)
+		if x < self.min:
+			self.min = x
+		if x > self.max:
+			self.max = x
+		if bucket is None:
+			bucket = self.bucket(x)
+		buckets = self._buckets
+		buckets[bucket] = buckets.get(bucket, 0) + 1
+
+	def merge(self, other: "QuantileSketch") -> "QuantileSketch":
+		"""Fold ``other`` (same relative accuracy) into this sketch; returns self."""
+		if other.relative_accuracy != self.relative_accuracy:
+			raise ValueError("Cannot merge sketches of different relative accuracy")
+		if not other.count:
+			return self
+		n = self.count + other.count
+		delta = other._mean - self._mean
+		self._m2 += other._m2 + delta * delta * self.count * other.count / n
+		self._mean += delta * other.count / n
+		self.count = n
+		self.total += other.total
+		self.min = min(self.min, other.min)
+		self.max = max(self.max, other.max)
+		for i, c in other._buckets.items():
+			self._buckets[i] = self._buckets.get(i, 0) + c
+		return self
+
+	def _value(self, i: int) -> float:
+		if not i:
+			return 0.0
+		# Midpoint (in relative terms) of (gamma^(k-1), gamma^k], the magnitudes in bucket i
+		k = abs(i) - _OFFSET
+		value = 2.0 * math.exp(k * self._log_gamma) / (1.0 + math.exp(self._log_gamma))
+		return value if i > 0 else -value
+
+	def quantile(self, q: float) -> Optional[float]:
+		"""Value at rank floor(q * (count - 1)) of the sorted amounts, within the relative accuracy."""
+		if not self.count:
+			return None
+		q = min(1.0, max(0.0, float(q)))
+		if q == 0.0:
+			return self.min
+		if q == 1.0:
+			return self.max
+		rank = math.floor(q * (self.count - 1))
+		seen = 0
+		for i in sorted(self._buckets):
+			seen += self._buckets[i]
+			if seen > rank:
+				return min(self.max, max(self.min, self._value(i)))
+		return self.max
+
+	def stats(self) -> Dict[str, Optional[float]]:
+		"""count and total plus every metric in ``DISTRIBUTION_METRICS`` (None when empty)."""
+		if not self.count:
+			return empty_stats()
+		out: Dict[str, Optional[float]] = {
+			"count": self.count,
+			"total": self.total,
+			"mean": self._mean,
+			"min": self.min,
+			"max": self.max,
+			"stddev": math.sqrt(max(0.0, self._m2) / self.count),
+		}
+		for metric, q in _QUANTILES.items():
+			out[metric] = self.quantile(q)
+		return out
+
+
+def empty_stats() -> Dict[str, Optional[float]]:
+	out: Dict[str, Optional[float]] = {metric: None for metric in DISTRIBUTION_METRICS}
+	out.update({"count": 0, "total": 0.0})
+	return out
+
+
+def exact_stats(sorted_amounts: Sequence[float]) -> Dict[str, Optional[float]]:
+	"""The same statistics as ``QuantileSketch.stats`` computed exactly from amounts sorted ascending."""
+	values = [float(v) for v in sorted_amounts]
+	n = len(values)
+	if not n:
+		return empty_stats()
+	total = math.fsum(values)
+	mean = total / n
+	out: Dict[str, Optional[float]] = {
+		"count": n,
+		"total": total,
+		"mean": mean,
+		"min": values[0],
+		"max": values[-1],
+		"stddev": math.sqrt(math.fsum((v - mean) ** 2 for v in values) / n),
+	}
+	for metric, q in _QUANTILES.items():
+		out[metric] = values[math.floor(q * (n - 1))]
+	return out
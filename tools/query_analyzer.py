@@ -7,6 +7,11 @@ import logging
 import re
 
 from config.prompts import QUERY_ANALYSIS_PROMPT
+from tools.fast_query_parser import FastQueryParser, mask_query
+from tools.plan_cache import PlanCache
+from tools.quantile_sketch import DISTRIBUTION_METRICS
+from tools.query_engine import bucket_date
+from tools.semantic_plan_cache import SemanticPlanCache
 
 
 logger = logging.getLogger(__name__)
@@ -21,11 +26,26 @@ _ALLOWED_OUTPUT_FMT = {"summary", "table", "detailed", "chart"}
 _ALLOWED_CHART_TYPE = {"bar", "line", "pie", "area", None}
 _ALLOWED_CHART_DIM = {"vendor", "category", "date", None}
 _ALLOWED_CHART_METRIC = {"amount", "count", "total", None}
+# What a summary/aggregate/top_n answer measures: the sum (default), the count, or a distribution statistic
+_ALLOWED_METRICS = {"total", "count", *DISTRIBUTION_METRICS}
+_METRIC_ALIASES = {"sum": "total", "average": "mean", "avg": "mean", "p50": "median", "minimum": "min", "maximum": "max", "std": "stddev"}
+# What each compare window's delta is measured against
+_ALLOWED_COMPARE_REF = {"previous", "first", "year_ago"}
+_ALLOWED_SERIES_GRAN = {"week", "month", "quarter", "year"}
+_MAX_COMPARE_PERIODS = 36
+# Relative ranges _resolve_relative_range can turn into dates on any day
+_RESOLVABLE_RELATIVE = {"this_month", "last_month", "this_year", "last_7_days", "last_90_days", "last_quarter"}
 
 
 class QueryAnalyzer:
-	def __init__(self, granite_client: Any) -> None:
+	def __init__(self, granite_client: Any, plan_cache: Optional[PlanCache] = None, fast_parser: Optional[FastQueryParser] = None, semantic_cache: Optional[SemanticPlanCache] = None) -> None:
 		self.granite = granite_client
+		# Optional rule-based parser that answers formulaic questions without Granite
+		self.fast_parser = fast_parser
+		# Optional MinHash/LSH cache that reuses plans of paraphrased questions
+		self.semantic_cache = semantic_cache
+		# Optional cache of raw Granite plans so repeated questions skip the LLM round trip
+		self.plan_cache = plan_cache
 
 	def _default_plan(self) -> Dict[str, Any]:
 		return {
@@ -33,9 +53,10 @@ class QueryAnalyzer:
 			"time_range": {"start_date": None, "end_date": None, "relative": None},
 			"filters": {"vendors": None, "categories": None, "min_amount": None, "max_amount": None, "text_search": None},
 			"group_by": "none",
+			"metric": "total",
 			"trend": {"enabled": False, "granularity": "month"},
 			"top_n": {"enabled": False, "dimension": "vendor", "limit": 5},
-			"compare": {"enabled": False, "baseline": None, "target": None},
+			"compare": {"enabled": False, "baseline": None, "target": None, "periods": [], "relative_to": "previous"},
 			"sort": {"by": "date", "direction": "desc"},
 			"output": {"format": "summary", "chart": {"type": None, "dimension": None, "metric": None}},
 		}
@@ -179,6 +200,9 @@ class QueryAnalyzer:
 		}
 		# group_by
 		plan["group_by"] = self._ensure_enum((raw or {}).get("group_by"), _ALLOWED_GROUP_BY, "none")
+		# metric
+		raw_metric = str((raw or {}).get("metric") or "").strip().lower()
+		plan["metric"] = self._ensure_enum(_METRIC_ALIASES.get(raw_metric, raw_metric), _ALLOWED_METRICS, "total")
 		# trend
 		raw_trend = (raw or {}).get("trend") or {}
 		plan["trend"] = {
@@ -203,6 +227,8 @@ class QueryAnalyzer:
 			"enabled": bool(raw_cmp.get("enabled", False)),
 			"baseline": raw_cmp.get("baseline") if isinstance(raw_cmp.get("baseline"), dict) else None,
 			"target": raw_cmp.get("target") if isinstance(raw_cmp.get("target"), dict) else None,
+			"periods": [],
+			"relative_to": self._ensure_enum(raw_cmp.get("relative_to"), _ALLOWED_COMPARE_REF, "previous"),
 		}
 		# sort
 		raw_sort = (raw or {}).get("sort") or {}
@@ -234,17 +260,142 @@ class QueryAnalyzer:
 
 		# Fill dates from relative
 		self._maybe_fill_dates(plan, today)
+		# Compare windows may be cut from the (filled) time range
+		plan["compare"]["periods"] = self._compare_periods(raw_cmp, plan, today)
 		return plan
 
-	def analyze(self, user_query: str, current_date: Optional[str] = None) -> Dict[str, Any]:
+	def _bucket_start(self, d: date, gran: str) -> date:
+		if gran == "week":
+			return d - timedelta(days=d.weekday())
+		if gran == "quarter":
+			return date(d.year, 3 * ((d.month - 1) // 3) + 1, 1)
+		if gran == "year":
+			return date(d.year, 1, 1)
+		return d.replace(day=1)
+
+	def _shift_bucket(self, d: date, gran: str, steps: int) -> date:
+		"""The bucket start ``steps`` buckets after (or before) the bucket start ``d``."""
+		if gran == "week":
+			return d + timedelta(days=7 * steps)
+		months = d.year * 12 + d.month - 1 + steps * {"month": 1, "quarter": 3, "year": 12}[gran]
+		return date(months // 12, months % 12 + 1, 1)
+
+	def _compare_periods(self, raw_cmp: Dict[str, Any], plan: Dict[str, Any], today: date) -> List[Dict[str, Any]]:
+		"""
+		Ordered compare windows as {label, start_date, end_date}, from (first match):
+		an explicit ``periods`` list (each with dates or a relative range); a
+		``series`` {granularity, count} cutting the plan's time range into buckets,
+		or giving the last ``count`` complete buckets when it has no dates; or the
+		baseline and target pair.
+		"""
+		periods: List[Dict[str, Any]] = []
+		raw_periods = raw_cmp.get("periods")
+		series = raw_cmp.get("series") if isinstance(raw_cmp.get("series"), dict) else None
+		if isinstance(raw_periods, list) and raw_periods:
+			for p in raw_periods:
+				if not isinstance(p, dict):
+					continue
+				start, end = p.get("start_date"), p.get("end_date")
+				if p.get("relative") and not (start and end):
+					start, end = self._resolve_relative_range(p.get("relative"), today)
+				periods.append({"label": str(p.get("label") or p.get("relative") or f"{start}..{end}"), "start_date": start, "end_date": end})
+		elif series:
+			gran = self._ensure_enum(series.get("granularity"), _ALLOWED_SERIES_GRAN, "month")
+			try:
+				count = max(1, int(series.get("count") or 4))
+			except Exception:
+				count = 4
+			tr = plan.get("time_range") or {}
+			try:
+				start = datetime.strptime(str(tr.get("start_date")), "%Y-%m-%d").date()
+				end = datetime.strptime(str(tr.get("end_date")), "%Y-%m-%d").date()
+			except Exception:
+				# No range: the last `count` complete buckets
+				end = self._bucket_start(today, gran) - timedelta(days=1)
+				start = self._shift_bucket(self._bucket_start(today, gran), gran, -count)
+			bucket = self._bucket_start(start, gran)
+			while bucket <= end:
+				following = self._shift_bucket(bucket, gran, 1)
+				periods.append({
+					"label": bucket_date(bucket, gran),
+					"start_date": max(bucket, start).isoformat(),
+					"end_date": min(following - timedelta(days=1), end).isoformat(),
+				})
+				bucket = following
+		elif isinstance(raw_cmp.get("baseline"), dict) or isinstance(raw_cmp.get("target"), dict):
+			for label in ("baseline", "target"):
+				rng = raw_cmp.get(label) if isinstance(raw_cmp.get(label), dict) else {}
+				periods.append({"label": label, "start_date": rng.get("start_date"), "end_date": rng.get("end_date")})
+		# Most recent windows win when a range is cut too finely
+		return periods[-_MAX_COMPARE_PERIODS:]
+
+	def _normalize_query(self, user_query: str) -> str:
+		return re.sub(r"\s+", " ", (user_query or "").strip().lower()).rstrip("?!. ")
+
+	def _cacheable_plan(self, raw: Dict[str, Any]) -> Tuple[Dict[str, Any], bool]:
+		"""
+		(plan to cache, whether it holds on any day). A resolvable relative range is
+		stored without its dates so they are re-resolved on each hit; explicit dates
+		(including compare periods) tie the plan to the day it was analyzed.
+		"""
+		plan = json.loads(json.dumps(raw))
+		tr = plan.get("time_range") if isinstance(plan.get("time_range"), dict) else {}
+		rel = tr.get("relative") or tr.get("period")
+		if rel and str(rel).lower() in _RESOLVABLE_RELATIVE:
+			tr["start_date"] = None
+			tr["end_date"] = None
+		has_dates = bool(tr.get("start_date") or tr.get("end_date"))
+		compare = plan.get("compare") if isinstance(plan.get("compare"), dict) else {}
+		return plan, not (has_dates or compare.get("enabled"))
+
+	def analyze(self, user_query: str, current_date: Optional[str] = None, trace: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+		"""Normalized plan for ``user_query``; ``trace``, when given, receives ``plan_source`` (fast_path, plan_cache, semantic_cache or granite)."""
+		trace = trace if trace is not None else {}
+		today = date.fromisoformat(current_date) if current_date else date.today()
+		if self.fast_parser is not None:
+			fast, confidence = self.fast_parser.parse(user_query)
+			if fast is not None:
+				logger.info("Fast-path plan (confidence=%.2f); skipping Granite", confidence)
+				trace["plan_source"] = "fast_path"
+				return self._normalize(fast, today)
+		normalized = self._normalize_query(user_query)
+		if self.plan_cache is not None:
+			# Day-independent plans first, then plans resolved against today's date
+			for key in (f"*|{normalized}", f"{today.isoformat()}|{normalized}"):
+				cached = self.plan_cache.get(key)
+				if cached is not None:
+					logger.info("Plan cache hit for query (key=%s)", key.split("|", 1)[0])
+					trace["plan_source"] = "plan_cache"
+					return self._normalize(cached, today)
+		masked = None
+		if self.semantic_cache is not None:
+			masked = self.fast_parser.mask(user_query) if self.fast_parser is not None else mask_query(user_query)
+			similar = self.semantic_cache.get(*masked)
+			if similar is not None:
+				logger.info("Semantic plan cache hit for query (slots=%s)", [kind for kind, _ in masked[1]])
+				trace["plan_source"] = "semantic_cache"
+				return self._normalize(similar, today)
 		prompt = QUERY_ANALYSIS_PROMPT.format(
 			user_query=user_query,
-			current_date=current_date or date.today().isoformat(),
+			current_date=today.isoformat(),
 		)
 		logger.debug("Analyzing query via Granite; len(query)=%d", len(user_query))
+		trace["plan_source"] = "granite"
 		text = self.granite.generate(prompt)
 		raw = self._parse_json(text)
+		raw = raw if isinstance(raw, dict) else {}
+		# Unparseable or intent-less output normalizes to a default summary; caching it would pin that guess
+		valid = (raw.get("intent") or raw.get("query_type")) in _ALLOWED_INTENTS
+		if not valid:
+			logger.warning("Granite returned no usable plan; not caching it")
+		elif self.plan_cache is not None or self.semantic_cache is not None:
+			cacheable, any_day = self._cacheable_plan(raw)
+			if self.plan_cache is not None:
+				self.plan_cache.put(f"{'*' if any_day else today.isoformat()}|{normalized}", cacheable)
+			# Only day-independent plans generalize to other phrasings
+			if masked is not None and any_day:
+				self.semantic_cache.put(masked[0], masked[1], cacheable)  # type: ignore[union-attr]
+			raw = cacheable
 		# Normalize and validate
-		today = date.fromisoformat(current_date) if current_date else date.today()
-		plan = self._normalize(raw if isinstance(raw, dict) else {}, today)
+		plan = self._normalize(raw, today)
 		return plan 
\ No newline at end of file
@@ -0,0 +1,67 @@
+from __future__ import annotations
+
+from typing import Any, Dict, Optional
+from datetime import date, datetime
+
+
+# Query engines (ExpenseTable, ExpenseMirror) evaluate the filter/aggregate part
+# of a normalized query plan. Both expose the same methods so the controller can
+# swap backends; this module holds the row parsing helpers they share:
+#   vendors() -> list of known vendor names
+#   generation -> int bumped whenever sync rebuilds instead of appending
+#   select(filters, start, end, use_processed_date) -> opaque selection
+#   select_variants([(filters, start, end, use_processed_date), ...]) -> [selection, ...]
+#   count(sel) / total(sel) / rows(sel)
+#   order(sel, by, direction) -> ordered selection; page(ordered, offset, limit) -> rows of one page
+#   window_totals(filters, [(start, end), ...], use_processed_date, processed_fallback) -> [(total, count)]
+#   group(sel, dim) / trend(sel, granularity) -> [(key, total, count)]
+#   top(sel, dim, limit) -> [(key, total)]
+#   stats(sel, dim=None) -> {count, total, mean, median, p90, min, max, stddev}, or [(key, stats)] per dim
+# RollupCube (tools/rollup_cube.py) is aggregate-only: it has no rows, order, page
+# or generation, and the controller never routes search or paging plans to it.
+
+
+def to_float(v: Any) -> float:
+	try:
+		return float(v or 0)
+	except Exception:
+		return 0.0
+
+
+def parse_row_date(value: Any) -> Optional[date]:
+	try:
+		if not value:
+			return None
+		return datetime.strptime(str(value), "%Y-%m-%d").date()
+	except Exception:
+		return None
+
+
+def parse_processed_date(value: Any) -> Optional[date]:
+	try:
+		if not value:
+			return None
+		# processed_date is ISO string
+		return datetime.fromisoformat(str(value)).date()
+	except Exception:
+		return None
+
+
+def row_processed_date(row: Dict[str, Any]) -> Any:
+	return row.get("Processed_Date") or row.get("processed_date")
+
+
+def bucket_date(d: date, gran: str) -> str:
+	if gran == "day":
+		return d.isoformat()
+	if gran == "week":
+		year, week, _ = d.isocalendar()
+		return f"{year}-W{int(week):02d}"
+	if gran == "month":
+		return f"{d.year}-{d.month:02d}"
+	if gran == "quarter":
+		q = (d.month - 1) // 3 + 1
+		return f"{d.year}-Q{q}"
+	if gran == "year":
+		return f"{d.year}"
+	return d.isoformat()
@@ -0,0 +1,98 @@
+from __future__ import annotations
+
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+import json
+import re
+import threading
+import time
+
+
+# "explain: <question>" / "profile: <question>", or a --explain / --profile flag anywhere, asks for the
+# execution report. A bare leading word does not: "explain my travel spending" is an ordinary question
+_EXPLAIN_PREFIX = re.compile(r"^\s*(?:explain|profile)\s*:\s*(?P<query>\S.*)$", re.IGNORECASE | re.DOTALL)
+_EXPLAIN_FLAG = re.compile(r"(?:^|\s)--(?:explain|profile)(?=\s|$)", re.IGNORECASE)
+
+
+def split_explain(text: str) -> Tuple[bool, str]:
+	"""(explain requested, question without the marker)."""
+	m = _EXPLAIN_PREFIX.match(text or "")
+	if m:
+		return True, m.group("query").strip()
+	question = _EXPLAIN_FLAG.sub(" ", text or "").strip()
+	if question and question != (text or "").strip():
+		return True, question
+	return False, text
+
+
+class QueryProfile:
+	"""
+	Wall and CPU time per stage of one query, plus notes on how it was answered.
+
+	Stages are recorded with ``stage(name)`` from whichever thread runs them (the
+	row prefetch overlaps plan generation), each with its start offset, wall time
+	and that thread's CPU time; a stage's dict can take extra fields such as row
+	counts. ``record()`` is the structured form logged for every query and
+	``render()`` the EXPLAIN reply.
+	"""
+
+	def __init__(self, query: str) -> None:
+		self.query = query
+		self.plan: Optional[Dict[str, Any]] = None
+		self.notes: Dict[str, Any] = {}
+		self.stages: List[Dict[str, Any]] = []
+		self._started = time.perf_counter()
+		self._lock = threading.Lock()
+
+	@contextmanager
+	def stage(self, name: str, **fields: Any) -> Iterator[Dict[str, Any]]:
+		entry: Dict[str, Any] = {"stage": name, "thread": threading.current_thread().name, **fields}
+		wall, cpu = time.perf_counter(), time.thread_time()
+		try:
+			yield entry
+		finally:
+			entry["start_ms"] = round((wall - self._started) * 1000, 3)
+			entry["wall_ms"] = round((time.perf_counter() - wall) * 1000, 3)
+			entry["cpu_ms"] = round((time.thread_time() - cpu) * 1000, 3)
+			with self._lock:
+				self.stages.append(entry)
+
+	def note(self, key: str, value: Any) -> None:
+		self.notes[key] = value
+
+	def record(self) -> Dict[str, Any]:
+		with self._lock:
+			# Parents before the stages they contain
+			stages = sorted(self.stages, key=lambda s: (s["start_ms"], -s["wall_ms"]))
+		return {
+			"query": self.query[:200],
+			"intent": (self.plan or {}).get("intent"),
+			"total_ms": round((time.perf_counter() - self._started) * 1000, 3),
+			"stages": stages,
+			"notes": dict(self.notes),
+		}
+
+	def log_line(self) -> str:
+		return json.dumps(self.record(), sort_keys=True, default=str)
+
+	def render(self, answer: str) -> str:
+		record = self.record()
+		lines = [f"EXPLAIN {self.query}"]
+		if self.plan is not None:
+			lines.append(f"Plan ({self.notes.get('plan_source', 'unknown')}): {json.dumps(self.plan, sort_keys=True, default=str)}")
+		for key, value in record["notes"].items():
+			if key != "plan_source":
+				lines.append(f"{key.replace('_', ' ').capitalize()}: {value if isinstance(value, str) else json.dumps(value, default=str)}")
+		lines.append("Stages (wall ms / cpu ms):")
+		open_stages: List[Tuple[str, float]] = []
+		for s in record["stages"]:
+			# Indent a stage under the earlier ones of its thread that enclose it
+			end = s["start_ms"] + s["wall_ms"]
+			open_stages = [(thread, e) for thread, e in open_stages if e >= end or thread != s["thread"]]
+			depth = sum(1 for thread, _ in open_stages if thread == s["thread"])
+			extra = ", ".join(f"{k}={v}" for k, v in s.items() if k not in {"stage", "thread", "start_ms", "wall_ms", "cpu_ms"})
+			lines.append(f"{'  ' * depth}- {s['stage']}: {s['wall_ms']:.1f} / {s['cpu_ms']:.1f}" + (f" ({extra})" if extra else ""))
+			open_stages.append((s["thread"], end))
+		lines.append(f"Total: {record['total_ms']:.1f} ms")
+		lines.append(f"Answer: {answer}")
+		return "\n".join(lines)
@@ -0,0 +1,89 @@
+from __future__ import annotations
+
+from typing import Any, Dict, Optional
+from collections import OrderedDict
+from pathlib import Path
+import hashlib
+import json
+import logging
+import os
+import threading
+
+
+logger = logging.getLogger(__name__)
+
+
+def file_digest(path: str) -> str:
+	"""SHA-256 hex digest of a file's bytes."""
+	h = hashlib.sha256()
+	with open(path, "rb") as f:
+		for chunk in iter(lambda: f.read(1 << 20), b""):
+			h.update(chunk)
+	return h.hexdigest()
+
+
+class ReceiptCache:
+	"""
+	Content-addressed, on-disk cache of receipt processing results.
+
+	Entries are keyed by the SHA-256 of the uploaded file and hold the vision/PDF
+	transcript and, once available, the structured receipt from Granite. Each
+	entry is one JSON file; file mtimes record recency so the LRU order survives
+	restarts, and the least recently used entries are evicted beyond
+	``max_entries``.
+	"""
+
+	def __init__(self, directory: str, max_entries: int = 1000) -> None:
+		self.directory = Path(directory)
+		self.directory.mkdir(parents=True, exist_ok=True)
+		self.max_entries = max(1, int(max_entries))
+		self._lock = threading.Lock()
+		entries = sorted(self.directory.glob("*.json"), key=lambda p: p.stat().st_mtime)
+		self._lru: "OrderedDict[str, None]" = OrderedDict((p.stem, None) for p in entries)
+		self.hits = 0
+		self.misses = 0
+
+	def _path(self, key: str) -> Path:
+		return self.directory / f"{key}.json"
+
+	def get(self, key: str) -> Optional[Dict[str, Any]]:
+		with self._lock:
+			if key not in self._lru:
+				self.misses += 1
+				return None
+			path = self._path(key)
+			try:
+				with open(path, "r", encoding="utf-8") as f:
+					entry = json.load(f)
+				os.utime(path)
+			except Exception as e:
+				logger.warning("Dropping unreadable receipt cache entry %s: %s", key, e)
+				self._lru.pop(key, None)
+				path.unlink(missing_ok=True)
+				self.misses += 1
+				return None
+			self._lru.move_to_end(key)
+			self.hits += 1
+			return entry
+
+	def put(self, key: str, **fields: Any) -> None:
+		"""Merge ``fields`` into the entry for ``key`` (e.g. ``transcript=...`` then ``receipt=...``)."""
+		with self._lock:
+			path = self._path(key)
+			entry: Dict[str, Any] = {}
+			if key in self._lru:
+				try:
+					with open(path, "r", encoding="utf-8") as f:
+						entry = json.load(f)
+				except Exception:
+					entry = {}
+			entry.update(fields)
+			tmp = path.with_suffix(".tmp")
+			with open(tmp, "w", encoding="utf-8") as f:
+				json.dump(entry, f)
+			os.replace(tmp, path)
+			self._lru[key] = None
+			self._lru.move_to_end(key)
+			while len(self._lru) > self.max_entries:
+				old, _ = self._lru.popitem(last=False)
+				self._path(old).unlink(missing_ok=True)
@@ -0,0 +1,94 @@
+from __future__ import annotations
+
+from typing import Any, Dict, List, NamedTuple, Optional, Tuple
+from collections import OrderedDict
+from datetime import date
+import hashlib
+import json
+import threading
+
+
+class QueryResult(NamedTuple):
+	"""A rendered query answer and, for trend and aggregate plans, the series behind it."""
+
+	answer: str
+	series: Optional[List[Tuple[str, float, int]]] = None
+
+
+def plan_key(plan: Dict[str, Any], filters: Dict[str, Any], start: Optional[date], end: Optional[date]) -> str:
+	"""
+	Canonical hash of an executable plan: the normalized plan with its effective
+	filters (after vendor inference) and its time range resolved to dates, so a
+	relative range like "this_month" keys differently on different days.
+	"""
+	canonical = dict(plan)
+	canonical["filters"] = filters
+	canonical["time_range"] = {"start_date": start.isoformat() if start else None, "end_date": end.isoformat() if end else None}
+	payload = json.dumps(canonical, sort_keys=True, separators=(",", ":"), default=str)
+	return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class ResultCache:
+	"""
+	LRU cache of executed query results keyed by ``plan_key``.
+
+	``version`` is a monotonically increasing data version: the controller calls
+	``bump`` whenever the expense rows change. Each entry remembers the version it
+	was computed at and is only served while that is still current, so an answer
+	computed before an append is never returned after it. ``hits``, ``misses``,
+	``stale`` and ``evictions`` count lookups for monitoring.
+	"""
+
+	def __init__(self, max_entries: int = 256) -> None:
+		self.max_entries = max(1, int(max_entries))
+		self._lock = threading.Lock()
+		self._entries: "OrderedDict[str, Tuple[int, QueryResult]]" = OrderedDict()
+		self.version = 0
+		self.hits = 0
+		self.misses = 0
+		self.stale = 0
+		self.evictions = 0
+
+	def __len__(self) -> int:
+		return len(self._entries)
+
+	def bump(self) -> int:
+		with self._lock:
+			self.version += 1
+			return self.version
+
+	def get(self, key: str) -> Optional[QueryResult]:
+		with self._lock:
+			entry = self._entries.get(key)
+			if entry is not None and entry[0] != self.version:
+				del self._entries[key]
+				self.stale += 1
+				entry = None
+			if entry is None:
+				self.misses += 1
+				return None
+			self._entries.move_to_end(key)
+			self.hits += 1
+			return entry[1]
+
+	def put(self, key: str, version: int, result: QueryResult) -> None:
+		"""Store ``result`` computed against data ``version``; dropped if the data has moved on since."""
+		with self._lock:
+			if version != self.version:
+				return
+			self._entries[key] = (version, result)
+			self._entries.move_to_end(key)
+			while len(self._entries) > self.max_entries:
+				self._entries.popitem(last=False)
+				self.evictions += 1
+
+	def stats(self) -> Dict[str, int]:
+		with self._lock:
+			return {
+				"entries": len(self._entries),
+				"version": self.version,
+				"hits": self.hits,
+				"misses": self.misses,
+				"stale": self.stale,
+				"evictions": self.evictions,
+			}
@@ -0,0 +1,399 @@
+from __future__ import annotations
+
+from typing import Any, Dict, FrozenSet, Hashable, Iterator, List, NamedTuple, Optional, Tuple
+from datetime import date
+import threading
+
+from tools.leaderboard import Leaderboard, top_totals
+from tools.quantile_sketch import QuantileSketch
+from tools.query_engine import bucket_date, parse_processed_date, parse_row_date, row_processed_date, to_float
+
+
+# A cell is (month key, vendor, category, total, count); month key is year * 12 + month - 1, None when undated
+Cell = Tuple[Optional[int], Any, Any, float, int]
+
+ROLLUP_GRANULARITIES = {"month", "quarter", "year"}
+
+
+def _month_key(d: date) -> int:
+	return d.year * 12 + d.month - 1
+
+
+def _hashable(value: Any) -> Any:
+	return value if isinstance(value, Hashable) else str(value)
+
+
+class _Rollup:
+	"""
+	(month x vendor x category) -> [total, count] for one date column, plus each
+	month's first and last day, its overall [total, count] and (once read) its
+	vendor/category leaderboards.
+	"""
+
+	def __init__(self, vendor_rank: Dict[Any, int], category_rank: Dict[Any, int]) -> None:
+		self.months: Dict[Optional[int], Dict[Tuple[Any, Any], List[float]]] = {}
+		self.bounds: Dict[int, List[int]] = {}
+		self.totals: Dict[Optional[int], List[float]] = {}
+		self.boards: Dict[Optional[int], Dict[str, Leaderboard]] = {}
+		self._ranks = {"vendor": vendor_rank, "category": category_rank}
+
+	def add(self, day: Optional[date], vendor: Any, category: Any, amount: float) -> None:
+		month = _month_key(day) if day else None
+		cell = self.months.setdefault(month, {}).setdefault((vendor, category), [0.0, 0])
+		cell[0] += amount
+		cell[1] += 1
+		total = self.totals.setdefault(month, [0.0, 0])
+		total[0] += amount
+		total[1] += 1
+		boards = self.boards.get(month)
+		if boards is not None:
+			boards["vendor"].add(vendor, amount)
+			boards["category"].add(category, amount)
+		if day:
+			ordinal = day.toordinal()
+			bounds = self.bounds.get(month)
+			if bounds is None:
+				self.bounds[month] = [ordinal, ordinal]
+			else:
+				bounds[0] = min(bounds[0], ordinal)
+				bounds[1] = max(bounds[1], ordinal)
+
+
+	def month_boards(self, month: Optional[int]) -> Dict[str, Leaderboard]:
+		"""The month's leaderboards, built from its cells on first use and kept current by ``add`` from then on."""
+		boards = self.boards.get(month)
+		if boards is None:
+			boards = self.boards[month] = {dim: Leaderboard(ranks) for dim, ranks in self._ranks.items()}
+			for (vendor, category), (total, _) in self.months.get(month, {}).items():
+				boards["vendor"].add(vendor, total)
+				boards["category"].add(category, total)
+		return boards
+
+
+class _SketchIndex:
+	"""
+	Quantile sketches of the amounts per date column and month: overall, per
+	vendor and per category. Follows the row cache list like the cube does, but
+	only once ``stats`` is first called, so plain totals never pay for it.
+	"""
+
+	def __init__(self) -> None:
+		self._source_rows: Optional[List[Dict[str, Any]]] = None
+		self._geometry = QuantileSketch()
+		self._reset()
+
+	def _reset(self) -> None:
+		self._n = 0
+		# use_processed_date -> month -> {"all": {None: sketch}, "vendor": {vendor: sketch}, "category": {category: sketch}}
+		self.columns: Dict[bool, Dict[Optional[int], Dict[str, Dict[Any, QuantileSketch]]]] = {False: {}, True: {}}
+
+	def sync(self, rows: List[Dict[str, Any]]) -> None:
+		if rows is not self._source_rows or len(rows) < self._n:
+			self._reset()
+			self._source_rows = rows
+		for r in rows[self._n:]:
+			vendor = _hashable(r.get("vendor", ""))
+			category = _hashable(r.get("category", ""))
+			amount = to_float(r.get("amount"))
+			# One bucket lookup serves all six sketches the row lands in
+			bucket = self._geometry.bucket(amount)
+			for processed, day in ((False, parse_row_date(r.get("date"))), (True, parse_processed_date(row_processed_date(r)))):
+				month = _month_key(day) if day else None
+				sketches = self.columns[processed].get(month)
+				if sketches is None:
+					sketches = self.columns[processed][month] = {"all": {}, "vendor": {}, "category": {}}
+				for dim, key in (("all", None), ("vendor", vendor), ("category", category)):
+					sketch = sketches[dim].get(key)
+					if sketch is None:
+						sketch = sketches[dim][key] = QuantileSketch()
+					sketch.add(amount, bucket)
+		self._n = len(rows)
+
+
+class _Selection(NamedTuple):
+	"""A lazy cube selection: evaluated by the aggregate methods, never materialized as cells up front."""
+
+	vendors: FrozenSet[Any]
+	categories: FrozenSet[Any]
+	lo: Optional[int]
+	hi: Optional[int]
+	bounded: bool
+	use_processed_date: bool
+
+
+class RollupCube:
+	"""
+	Pre-aggregated (month x vendor x category) -> (sum, count) rollup of the expense rows.
+
+	Built once from the row cache and extended in O(1) per appended row by
+	``sync``. It exposes the query engine methods except ``rows``, and answers a
+	selection exactly when ``covers`` holds: no amount or text filters, and the
+	time range either unbounded or spanning whole months of data (a partial
+	month is fine if no row falls outside the range). Receipt and processed
+	dates are rolled up separately so the processed_date fallback can use it too.
+
+	Vendor and category leaderboards, overall and per month, are kept on append
+	(a month's boards from the first top-N read of that month on), so an
+	unfiltered top-N over all time or one month costs O(k log n). Several months
+	merge their board totals, and vendor/category-filtered selections total their
+	cells; both then pick with ``heapq.nlargest``.
+
+	Mergeable quantile sketches of each month's amounts, overall, per vendor and
+	per category, are built on the first ``stats`` call and kept in step from
+	then on; ``stats`` answers median/p90/mean/stddev questions by merging month
+	sketches instead of sorting amounts. Sketched quantiles are within 1% of the
+	exact value; the other statistics are exact.
+	"""
+
+	def __init__(self) -> None:
+		self._lock = threading.RLock()
+		self._source_rows: Optional[List[Dict[str, Any]]] = None
+		self._reset()
+
+	def _reset(self) -> None:
+		self._n = 0
+		self._source: List[Dict[str, Any]] = []
+		self._sketches = _SketchIndex()
+		# First-seen order of vendors and categories, used to break ties like the row engines do
+		self._vendor_rank: Dict[Any, int] = {}
+		self._category_rank: Dict[Any, int] = {}
+		self._by_date = _Rollup(self._vendor_rank, self._category_rank)
+		self._by_processed = _Rollup(self._vendor_rank, self._category_rank)
+		# All-time boards; the same for both date columns
+		self._boards = {"vendor": Leaderboard(self._vendor_rank), "category": Leaderboard(self._category_rank)}
+
+	def __len__(self) -> int:
+		return self._n
+
+	def sync(self, rows: List[Dict[str, Any]]) -> None:
+		with self._lock:
+			if rows is not self._source_rows or len(rows) < self._n:
+				self._reset()
+				self._source_rows = rows
+			self._source = rows
+			for r in rows[self._n:]:
+				self.add(r)
+
+	def add(self, r: Dict[str, Any]) -> None:
+		with self._lock:
+			vendor = _hashable(r.get("vendor", ""))
+			category = _hashable(r.get("category", ""))
+			self._vendor_rank.setdefault(vendor, len(self._vendor_rank))
+			self._category_rank.setdefault(category, len(self._category_rank))
+			amount = to_float(r.get("amount"))
+			self._by_date.add(parse_row_date(r.get("date")), vendor, category, amount)
+			self._by_processed.add(parse_processed_date(row_processed_date(r)), vendor, category, amount)
+			self._boards["vendor"].add(vendor, amount)
+			self._boards["category"].add(category, amount)
+			self._n += 1
+
+	def covers(self, filters: Dict[str, Any], start: Optional[date], end: Optional[date], use_processed_date: bool = False) -> bool:
+		"""True when ``select`` with these arguments is exact (no row-level predicate is needed)."""
+		f = filters or {}
+		if f.get("min_amount") is not None or f.get("max_amount") is not None:
+			return False
+		if str(f.get("text_search") or "").strip():
+			return False
+		with self._lock:
+			bounds = (self._by_processed if use_processed_date else self._by_date).bounds
+			if start:
+				b = bounds.get(_month_key(start))
+				if b and b[0] < start.toordinal():
+					return False
+			if end:
+				b = bounds.get(_month_key(end))
+				if b and b[1] > end.toordinal():
+					return False
+			return True
+
+	def vendors(self) -> List[str]:
+		with self._lock:
+			return sorted({str(v).strip() for v in self._vendor_rank if v})
+
+	def select(self, filters: Dict[str, Any], start: Optional[date], end: Optional[date], use_processed_date: bool = False) -> _Selection:
+		return _Selection(
+			frozenset(_hashable(v) for v in ((filters or {}).get("vendors") or [])),
+			frozenset(_hashable(c) for c in ((filters or {}).get("categories") or [])),
+			_month_key(start) if start else None,
+			_month_key(end) if end else None,
+			bool(start or end),
+			bool(use_processed_date),
+		)
+
+	def select_variants(self, variants: List[Tuple[Dict[str, Any], Optional[date], Optional[date], bool]]) -> List[_Selection]:
+		# Each variant touches only the cells of its months, never rows
+		return [self.select(*v) for v in variants]
+
+	def _rollup(self, sel: _Selection) -> _Rollup:
+		return self._by_processed if sel.use_processed_date else self._by_date
+
+	def _months(self, sel: _Selection) -> List[Optional[int]]:
+		months = []
+		for month in self._rollup(sel).months:
+			if sel.bounded:
+				# Rows without a usable date never satisfy a bound
+				if month is None or (sel.lo is not None and month < sel.lo) or (sel.hi is not None and month > sel.hi):
+					continue
+			months.append(month)
+		return months
+
+	def _cells(self, sel: _Selection) -> Iterator[Cell]:
+		rollup = self._rollup(sel)
+		for month in self._months(sel):
+			for (vendor, category), (total, count) in rollup.months[month].items():
+				if sel.vendors and vendor not in sel.vendors:
+					continue
+				if sel.categories and category not in sel.categories:
+					continue
+				yield (month, vendor, category, total, int(count))
+
+	def _month_totals(self, sel: _Selection) -> Dict[Optional[int], List[float]]:
+		with self._lock:
+			if not (sel.vendors or sel.categories):
+				totals = self._rollup(sel).totals
+				return {month: totals[month] for month in self._months(sel)}
+			by_month: Dict[Optional[int], List[float]] = {}
+			for month, _, _, total, count in self._cells(sel):
+				entry = by_month.setdefault(month, [0.0, 0])
+				entry[0] += total
+				entry[1] += count
+			return by_month
+
+	def window_totals(self, filters: Dict[str, Any], windows: List[Tuple[Optional[date], Optional[date]]], use_processed_date: bool = False, processed_fallback: bool = False) -> List[Tuple[float, int]]:
+		"""
+		(total, count) per (start, end) window from month totals; exact when ``covers`` holds for every window.
+		With ``processed_fallback`` a window without receipt-date rows takes its processed-month totals.
+		"""
+		if processed_fallback and not use_processed_date:
+			by_receipt = self.window_totals(filters, windows)
+			by_processed = self.window_totals(filters, windows, True)
+			return [r if r[1] else p for r, p in zip(by_receipt, by_processed)]
+		with self._lock:
+			by_month = self._month_totals(self.select(filters, None, None, use_processed_date))
+			results: List[Tuple[float, int]] = []
+			for start, end in windows:
+				lo = _month_key(start) if start else None
+				hi = _month_key(end) if end else None
+				total, count = 0.0, 0
+				for month, (t, c) in by_month.items():
+					if start or end:
+						if month is None or (lo is not None and month < lo) or (hi is not None and month > hi):
+							continue
+					total += t
+					count += int(c)
+				results.append((float(total), count))
+			return results
+
+	def count(self, sel: _Selection) -> int:
+		return self.total(sel)[1]
+
+	def total(self, sel: _Selection) -> Tuple[float, int]:
+		with self._lock:
+			entries = self._month_totals(sel).values()
+			return float(sum(e[0] for e in entries)), int(sum(e[1] for e in entries))
+
+	def _grouped(self, sel: _Selection, dim: str) -> Dict[Any, List[float]]:
+		if dim not in {"vendor", "category"}:
+			raise ValueError(f"RollupCube cannot group by {dim!r}")
+		pos = 1 if dim == "vendor" else 2
+		acc: Dict[Any, List[float]] = {}
+		for cell in self._cells(sel):
+			entry = acc.setdefault(cell[pos], [0.0, 0])
+			entry[0] += cell[3]
+			entry[1] += cell[4]
+		return acc
+
+	def group(self, sel: _Selection, dim: str) -> List[Tuple[str, float, int]]:
+		with self._lock:
+			rank = self._vendor_rank if dim == "vendor" else self._category_rank
+			acc = self._grouped(sel, dim)
+			return [(str(k), float(v[0]), int(v[1])) for k, v in sorted(acc.items(), key=lambda kv: rank[kv[0]])]
+
+	def trend(self, sel: _Selection, granularity: str) -> List[Tuple[str, float, int]]:
+		gran = granularity or "month"
+		if gran not in ROLLUP_GRANULARITIES:
+			raise ValueError(f"RollupCube cannot bucket by {gran!r}")
+		acc: Dict[str, List[float]] = {}
+		for month, (total, count) in self._month_totals(sel).items():
+			if month is None:
+				continue
+			bucket = bucket_date(date(month // 12, month % 12 + 1, 1), gran)
+			entry = acc.setdefault(bucket, [0.0, 0])
+			entry[0] += total
+			entry[1] += count
+		return [(b, float(acc[b][0]), int(acc[b][1])) for b in sorted(acc)]
+
+	def top(self, sel: _Selection, dim: str, limit: int) -> List[Tuple[str, float]]:
+		dim = "category" if dim == "category" else "vendor"
+		k = max(1, int(limit))
+		with self._lock:
+			rank = self._vendor_rank if dim == "vendor" else self._category_rank
+			if sel.vendors or sel.categories:
+				totals = {key: v[0] for key, v in self._grouped(sel, dim).items()}
+				return [(str(key), float(t)) for key, t in top_totals(totals, rank, k)]
+			if not sel.bounded:
+				leaders = self._boards[dim].top(k)
+			else:
+				months = self._months(sel)
+				rollup = self._rollup(sel)
+				if len(months) == 1:
+					leaders = rollup.month_boards(months[0])[dim].top(k)
+				else:
+					# Several months: merge their board totals, then select without a full sort
+					merged: Dict[Any, float] = {}
+					for month in months:
+						for key, t in rollup.month_boards(month)[dim].totals().items():
+							merged[key] = merged.get(key, 0.0) + t
+					leaders = top_totals(merged, rank, k)
+			return [(str(key), float(t)) for key, t in leaders]
+
+	def stats(self, sel: _Selection, dim: Optional[str] = None) -> Any:
+		"""
+		Distribution statistics (see ``QuantileSketch.stats``) merged from month
+		sketches: one dict for the selection, or [(key, stats)] per vendor/category
+		in first-seen order. Sketches are kept per single dimension, so a selection
+		filtered on both vendor and category, or grouped by one dimension and
+		filtered on the other, raises ValueError (``stats_cover`` tells in advance).
+		"""
+		if not self.stats_cover(sel, dim):
+			raise ValueError("RollupCube keeps sketches per vendor or per category, not per combination")
+		with self._lock:
+			self._sketches.sync(self._source)
+			columns = self._sketches.columns[sel.use_processed_date]
+			months = self._months(sel)
+			if sel.vendors or sel.categories:
+				filter_dim, keys = ("vendor", sel.vendors) if sel.vendors else ("category", sel.categories)
+			else:
+				filter_dim, keys = None, frozenset()
+			if dim is None:
+				merged = QuantileSketch()
+				for month in months:
+					sketches = columns[month]
+					if filter_dim is None:
+						merged.merge(sketches["all"][None])
+						continue
+					for key in keys:
+						sketch = sketches[filter_dim].get(key)
+						if sketch is not None:
+							merged.merge(sketch)
+				return merged.stats()
+			acc: Dict[Any, QuantileSketch] = {}
+			for month in months:
+				for key, sketch in columns[month][dim].items():
+					if keys and key not in keys:
+						continue
+					acc.setdefault(key, QuantileSketch()).merge(sketch)
+			rank = self._vendor_rank if dim == "vendor" else self._category_rank
+			return [(str(key), acc[key].stats()) for key in sorted(acc, key=lambda k: rank[k])]
+
+	def stats_cover(self, sel: _Selection, dim: Optional[str] = None) -> bool:
+		"""True when ``stats(sel, dim)`` can be answered from the per-dimension sketches."""
+		if dim is not None and dim not in {"vendor", "category"}:
+			return False
+		if sel.vendors and sel.categories:
+			return False
+		if dim == "vendor" and sel.categories:
+			return False
+		if dim == "category" and sel.vendors:
+			return False
+		return True
@@ -0,0 +1,92 @@
+from __future__ import annotations
+
+from typing import Any, Callable, Dict, List, Optional
+import threading
+
+
+EXPIRED_MESSAGE = "The expenses changed since this search, so its remaining pages are gone. Ask again for a fresh result."
+
+
+class PagedAnswer(str):
+	"""A query answer holding the first page of a longer result; ``cursor`` serves the following pages."""
+
+	cursor: "SearchCursor"
+
+	def __new__(cls, text: str, cursor: "SearchCursor") -> "PagedAnswer":
+		answer = super().__new__(cls, text)
+		answer.cursor = cursor
+		return answer
+
+
+class SearchCursor:
+	"""
+	Lazily rendered pages of a sorted search result.
+
+	``ordered`` is the engine's ordered selection (see ``order``); the rows of a
+	page are fetched with ``engine.page`` only when that page is rendered, so a
+	large result never exists as one list or one message. ``next_page`` advances
+	through the pages and is safe to call from concurrent handler threads.
+
+	The cursor remembers the engine's ``generation``: once the engine rebuilds
+	(the sheet shrank or was reloaded) the ordered row ids no longer name the
+	same expenses, so the cursor expires instead of serving the wrong rows.
+	"""
+
+	def __init__(self, engine: Any, ordered: Any, total: int, page_size: int, render: Callable[[List[Dict[str, Any]]], str]) -> None:
+		self.engine = engine
+		self.ordered = ordered
+		self.total = int(total)
+		self.page_size = max(1, int(page_size))
+		self.render = render
+		self._next = 0
+		self._lock = threading.Lock()
+		self._generation = getattr(engine, "generation", None)
+
+	@property
+	def pages(self) -> int:
+		return max(1, -(-self.total // self.page_size))
+
+	@property
+	def has_more(self) -> bool:
+		return self._next < self.pages
+
+	@property
+	def expired(self) -> bool:
+		return getattr(self.engine, "generation", None) != self._generation
+
+	def page(self, number: int) -> str:
+		"""Page ``number`` (0-based) with a footer telling which rows it shows."""
+		offset = number * self.page_size
+		rows: List[Dict[str, Any]] = []
+		if not self.expired:
+			try:
+				rows = self.engine.page(self.ordered, offset, self.page_size)
+			except IndexError:
+				pass
+		# Checked again: a rebuild may have landed while the page was read
+		if self.expired:
+			with self._lock:
+				self._next = self.pages
+			return EXPIRED_MESSAGE
+		text = self.render(rows)
+		if self.pages == 1:
+			return text
+		footer = f"Showing rows {offset + 1}-{offset + len(rows)} of {self.total}."
+		if number + 1 < self.pages:
+			footer += ' Reply "more" for the next page.'
+		return f"{text}\n{footer}"
+
+	def first_page(self) -> str:
+		"""The first page, as a ``PagedAnswer`` when more pages follow."""
+		with self._lock:
+			self._next = 1
+		text = self.page(0)
+		return PagedAnswer(text, self) if self.has_more else text
+
+	def next_page(self) -> Optional[str]:
+		with self._lock:
+			if not self.has_more:
+				return None
+			number = self._next
+			self._next += 1
+		return self.page(number)
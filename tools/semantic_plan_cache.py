@@ -0,0 +1,191 @@
+from __future__ import annotations
+
+from typing import Any, Dict, FrozenSet, List, Optional, Tuple
+from collections import OrderedDict
+import hashlib
+import json
+import random
+import threading
+import time
+
+from tools.fast_query_parser import Slot
+
+
+# Words that never change a plan; dropped before shingling
+_STOP = {
+	"how", "much", "what", "what's", "whats", "is", "was", "are", "were", "did", "do", "does", "have", "has", "had",
+	"we", "i", "my", "our", "me", "us", "the", "a", "an", "at", "on", "in", "from", "for", "to", "of", "with",
+	"please", "can", "you", "tell", "give", "so", "far", "all", "money", "amount",
+}
+# Inflections folded together so "spent"/"spending" paraphrase "spend"
+_STEMS = {
+	"spent": "spend", "spending": "spend", "spends": "spend", "expenses": "expense", "costs": "cost",
+	"vendors": "vendor", "merchants": "vendor", "merchant": "vendor", "stores": "vendor", "store": "vendor",
+	"categories": "category", "receipts": "receipt", "transactions": "transaction",
+}
+_PRIME = (1 << 61) - 1
+# Filters whose values become slots; any other filter (``text_search``) is free text a paraphrase would not share
+_SLOT_FILTERS = {"vendors", "categories", "min_amount", "max_amount"}
+
+
+def _token_hash(token: str) -> int:
+	return int.from_bytes(hashlib.blake2b(token.encode("utf-8"), digest_size=8).digest(), "big") % _PRIME
+
+
+def _slot_ref(kind: str, index: int) -> str:
+	return f"\u0000{kind}:{index}"
+
+
+class SemanticPlanCache:
+	"""
+	Paraphrase-tolerant cache of raw query plans.
+
+	Queries arrive entity-masked (see ``mask_query``): vendors, categories,
+	periods and numbers become slots. The remaining words are stemmed and
+	stop-word filtered into a shingle set. A MinHash signature of the set goes
+	into LSH band buckets. A lookup accepts a bucket candidate only when it has
+	the same slot types and exactly the same shingle set: paraphrases differ in
+	word order, stop words and inflection, while any extra content word ("on
+	ink", "in Dallas") is a qualifier the cached plan would silently drop, so it
+	falls through to Granite. The cached plan is a template whose entity values
+	point at slots, so the new query's vendor, period or amounts are filled in.
+	"""
+
+	def __init__(self, num_perm: int = 32, bands: int = 16, ttl_seconds: float = 86400.0, max_entries: int = 512) -> None:
+		if num_perm % bands:
+			raise ValueError("num_perm must be a multiple of bands")
+		self.num_perm = int(num_perm)
+		self.bands = int(bands)
+		self.ttl_seconds = float(ttl_seconds)
+		self.max_entries = max(1, int(max_entries))
+		rng = random.Random(1729)
+		self._perms = [(rng.randrange(1, _PRIME), rng.randrange(0, _PRIME)) for _ in range(self.num_perm)]
+		self._lock = threading.Lock()
+		self._entries: "OrderedDict[int, Dict[str, Any]]" = OrderedDict()
+		self._buckets: Dict[Tuple[int, Tuple[int, ...]], set] = {}
+		self._next_id = 0
+		self.hits = 0
+		self.misses = 0
+
+	def __len__(self) -> int:
+		return len(self._entries)
+
+	def _shingles(self, masked: List[str]) -> FrozenSet[str]:
+		return frozenset(_STEMS.get(w, w) for w in masked if w not in _STOP)
+
+	def _signature(self, shingles: FrozenSet[str]) -> List[int]:
+		hashes = [_token_hash(s) for s in shingles] or [0]
+		return [min((a * h + b) % _PRIME for h in hashes) for a, b in self._perms]
+
+	def _bands(self, signature: List[int]) -> List[Tuple[int, Tuple[int, ...]]]:
+		rows = self.num_perm // self.bands
+		return [(band, tuple(signature[band * rows : (band + 1) * rows])) for band in range(self.bands)]
+
+	def get(self, masked: List[str], slots: List[Slot]) -> Optional[Dict[str, Any]]:
+		shingles = self._shingles(masked)
+		kinds = tuple(kind for kind, _ in slots)
+		now = time.time()
+		with self._lock:
+			candidates = set()
+			for key in self._bands(self._signature(shingles)):
+				candidates |= self._buckets.get(key, set())
+			# Newest first, so a re-asked question gets its latest plan
+			for entry_id in sorted(candidates, reverse=True):
+				entry = self._entries[entry_id]
+				if now - entry["created"] <= self.ttl_seconds and entry["kinds"] == kinds and entry["shingles"] == shingles:
+					self._entries.move_to_end(entry_id)
+					self.hits += 1
+					return self._fill(entry["template"], slots)
+			self.misses += 1
+			return None
+
+	def put(self, masked: List[str], slots: List[Slot], plan: Dict[str, Any]) -> None:
+		template = self._template(plan, slots)
+		if template is None:
+			return
+		shingles = self._shingles(masked)
+		signature = self._signature(shingles)
+		with self._lock:
+			entry_id = self._next_id
+			self._next_id += 1
+			self._entries[entry_id] = {
+				"shingles": shingles,
+				"kinds": tuple(kind for kind, _ in slots),
+				"template": template,
+				"bands": self._bands(signature),
+				"created": time.time(),
+			}
+			for key in self._entries[entry_id]["bands"]:
+				self._buckets.setdefault(key, set()).add(entry_id)
+			while len(self._entries) > self.max_entries:
+				old_id, old = self._entries.popitem(last=False)
+				for key in old["bands"]:
+					bucket = self._buckets.get(key)
+					if bucket is not None:
+						bucket.discard(old_id)
+						if not bucket:
+							del self._buckets[key]
+
+	def _template(self, plan: Dict[str, Any], slots: List[Slot]) -> Optional[str]:
+		"""
+		The plan as JSON, with entity values that came from the query replaced by slot
+		references; None when the plan names a vendor or category the query did not
+		(e.g. a misspelling Granite corrected), ignores the query's period, or holds
+		free text such as ``text_search`` that is not a slot, since that would not
+		carry over to other queries.
+		"""
+		template = json.loads(json.dumps(plan))
+
+		def ref(kind: str, value: Any) -> Any:
+			same = [v for k, v in slots if k == kind]
+			for i, v in enumerate(same):
+				if (str(v).lower() == str(value).lower()) if kind in {"vendor", "category", "period"} else _same_number(v, value):
+					return _slot_ref(kind, i)
+			return value
+
+		filters = template.get("filters") if isinstance(template.get("filters"), dict) else {}
+		if any(value not in (None, "", []) for field, value in filters.items() if field not in _SLOT_FILTERS):
+			return None
+		for field, kind in (("vendors", "vendor"), ("categories", "category")):
+			if isinstance(filters.get(field), list):
+				filters[field] = [ref(kind, v) for v in filters[field]]
+			if any(not str(v).startswith("\u0000") for v in filters.get(field) or []):
+				return None
+		for field in ("min_amount", "max_amount"):
+			if filters.get(field) is not None:
+				filters[field] = ref("number", filters[field])
+		tr = template.get("time_range") if isinstance(template.get("time_range"), dict) else {}
+		if tr.get("relative"):
+			tr["relative"] = ref("period", tr["relative"])
+		if any(kind == "period" for kind, _ in slots) and not str(tr.get("relative") or "").startswith("\u0000"):
+			# The query named a period the plan did not take from it
+			return None
+		top = template.get("top_n") if isinstance(template.get("top_n"), dict) else {}
+		if top.get("limit") is not None:
+			top["limit"] = ref("number", top["limit"])
+		return json.dumps(template)
+
+	def _fill(self, template: str, slots: List[Slot]) -> Dict[str, Any]:
+		by_ref: Dict[str, Any] = {}
+		counts: Dict[str, int] = {}
+		for kind, value in slots:
+			by_ref[_slot_ref(kind, counts.get(kind, 0))] = value
+			counts[kind] = counts.get(kind, 0) + 1
+
+		def fill(node: Any) -> Any:
+			if isinstance(node, dict):
+				return {k: fill(v) for k, v in node.items()}
+			if isinstance(node, list):
+				return [fill(v) for v in node]
+			if isinstance(node, str) and node in by_ref:
+				return by_ref[node]
+			return node
+
+		return fill(json.loads(template))
+
+
+def _same_number(a: Any, b: Any) -> bool:
+	try:
+		return float(a) == float(b)
+	except (TypeError, ValueError):
+		return False
@@ -1,7 +1,14 @@
-from typing import Dict, Any, List
+from typing import Dict, Any, Callable, List, Optional
+from dataclasses import dataclass
+import atexit
 import logging
+import threading
+import time
 
-from integrations.google_sheets_api import GoogleSheetsClient
+from tenacity import retry, retry_if_exception, stop_after_attempt, wait_exponential
+
+from config.settings import load_settings
+from integrations.google_sheets_api import GoogleSheetsClient, WrittenRows, append_rejected
 
 
 logger = logging.getLogger(__name__)
@@ -42,17 +49,288 @@ def _canon_row(row: Dict[str, Any]) -> Dict[str, Any]:
 	return canon
 
 
+# Called once per buffered expense with the write error, or None when the row reached the sheet
+AppendCallback = Callable[[Dict[str, Any], Optional[Exception]], None]
+
+
+@dataclass
+class _PendingAppend:
+	expense: Dict[str, Any]
+	row: Dict[str, Any]
+	callback: Optional[AppendCallback]
+
+
 class SheetsManager:
-	def __init__(self, client: GoogleSheetsClient) -> None:
+	"""
+	Read/append access to the Expenses worksheet with a process-wide row cache.
+
+	The first query downloads the whole sheet once; afterwards only rows appended
+	since the last known row count are pulled, and only when the cache is older
+	than ``max_staleness_seconds``. Appends made through this manager are added to
+	the cache immediately. Call ``invalidate_cache`` to force a full reload.
+
+	With ``batch_size`` > 1 appends are write-behind: expenses are buffered and
+	written with one ``append_rows`` call when the buffer is full, when the oldest
+	entry is ``batch_max_age_seconds`` old, or on ``flush``/``close``. Buffered
+	rows are visible to ``query_expenses`` before they are written. The write
+	runs outside the lock, so queries do not wait on Sheets latency or backoff.
+	"""
+
+	def __init__(self, client: GoogleSheetsClient, max_staleness_seconds: Optional[float] = None, batch_size: Optional[int] = None, batch_max_age_seconds: Optional[float] = None) -> None:
 		self.client = client
+		cache_cfg = load_settings().cache
+		if max_staleness_seconds is None:
+			max_staleness_seconds = cache_cfg.rows_max_staleness_seconds
+		if batch_size is None:
+			batch_size = cache_cfg.write_batch_size
+		if batch_max_age_seconds is None:
+			batch_max_age_seconds = cache_cfg.write_batch_max_age_seconds
+		self.max_staleness_seconds = float(max_staleness_seconds)
+		self.batch_size = max(1, int(batch_size))
+		self.batch_max_age_seconds = float(batch_max_age_seconds)
+		self._rows: Optional[List[Dict[str, Any]]] = None
+		# Number of data rows known to exist in the sheet (excludes buffered rows); offset for tail pulls
+		self._sheet_rows = 0
+		self._synced_at = 0.0
+		self._pending: List[_PendingAppend] = []
+		# Batches being written by flush outside the lock; still served from the cache
+		self._writing: List[_PendingAppend] = []
+		# Incremented on every read of the sheet, so a flush can tell the sheet was read during its write
+		self._sheet_reads = 0
+		# Incremented whenever the row cache changes
+		self.data_version = 0
+		# How the last query_expenses call got its rows: "cached", "incremental" or "full", with download/_canon_row timings
+		self.last_refresh: Dict[str, Any] = {"refresh": "none"}
+		self._flush_timer: Optional[threading.Timer] = None
+		self._lock = threading.RLock()
+		if self.batch_size > 1:
+			atexit.register(self.close)
+
+	def append_expense(self, expense: Dict[str, Any], on_result: Optional[AppendCallback] = None) -> bool:
+		"""
+		Append an expense to the sheet.
 
-	def append_expense(self, expense: Dict[str, Any]) -> None:
+		Returns True when the row was written before returning, or False when it was
+		buffered; ``on_result`` is then called once the batch containing it is written.
+		"""
 		logger.debug("Appending expense to Google Sheets: vendor=%s amount=%s date=%s", expense.get("vendor"), expense.get("amount"), expense.get("date"))
-		self.client.append_row(expense)
+		if self.batch_size <= 1:
+			written = self.client.append_row(expense)
+			with self._lock:
+				if self._rows is not None:
+					self._rows.append(_canon_row(written if isinstance(written, dict) else self._record_from_expense(expense)))
+					self.data_version += 1
+				self._note_written(getattr(written, "offset", None), 1)
+			return True
+		expense = dict(expense)
+		stamp = getattr(self.client, "processed_timestamp", None)
+		if callable(stamp) and not expense.get("processed_date"):
+			# Stamped now rather than by the write, so the buffered row already matches the written one
+			expense["processed_date"] = stamp()
+		with self._lock:
+			if self._rows is None:
+				self._load_all()
+			row = _canon_row(self._record_from_expense(expense))
+			self._pending.append(_PendingAppend(expense, row, on_result))
+			self._rows.append(row)  # type: ignore[union-attr]
+			self.data_version += 1
+			full = len(self._pending) >= self.batch_size
+			if not full and self._flush_timer is None:
+				self._flush_timer = threading.Timer(self.batch_max_age_seconds, self.flush)
+				self._flush_timer.daemon = True
+				self._flush_timer.start()
+		if full:
+			self.flush()
+		return False
+
+	def flush(self) -> None:
+		"""
+		Write all buffered expenses with one batch append and report each outcome.
+
+		The write (and its retries) runs outside the lock, so queries and duplicate
+		checks keep reading the cache meanwhile; the rows stay visible as in-flight.
+		"""
+		with self._lock:
+			if self._flush_timer is not None:
+				self._flush_timer.cancel()
+				self._flush_timer = None
+			batch, self._pending = self._pending, []
+			if not batch:
+				return
+			self._writing.extend(batch)
+			reads = self._sheet_reads
+		error: Optional[Exception] = None
+		written: Any = None
+		try:
+			written = self._write_batch([p.expense for p in batch])
+		except Exception as e:
+			error = e
+			logger.error("Batch append of %d expenses failed: %s", len(batch), e)
+		with self._lock:
+			flushed = {id(p) for p in batch}
+			self._writing = [p for p in self._writing if id(p) not in flushed]
+			if error is not None:
+				# Drop the rows that never reached the sheet; a new list signals consumers to rebuild
+				failed = {id(p.row) for p in batch}
+				if self._rows is not None:
+					self._rows = [r for r in self._rows if id(r) not in failed]
+					self.data_version += 1
+			elif self._sheet_reads != reads:
+				# The sheet was read while the batch was being written and may already hold it
+				logger.info("Sheet was read during a batch write; reloading the row cache")
+				self._rows = None
+				self._synced_at = 0.0
+			else:
+				self._note_written(getattr(written, "offset", None), len(batch))
+				# Columns the buffered row lacked and the sheet left blank are filled in place. A value the
+				# write changed replaces the row in a new list instead: indexes following the list by
+				# identity and length would not see an in-place change
+				updated: Dict[int, Dict[str, Any]] = {}
+				for p, record in zip(batch, written or []):
+					if not isinstance(record, dict):
+						continue
+					canon = _canon_row(record)
+					if any(p.row.get(k) != v for k, v in canon.items() if k in p.row or v not in ("", None)):
+						updated[id(p.row)] = {**p.row, **canon}
+					else:
+						for k, v in canon.items():
+							p.row.setdefault(k, v)
+				if updated and self._rows is not None:
+					self._rows = [updated.get(id(r), r) for r in self._rows]
+					self.data_version += 1
+				logger.info("Flushed %d buffered expenses to sheet", len(batch))
+		for p in batch:
+			if p.callback is None:
+				continue
+			try:
+				p.callback(p.expense, error)
+			except Exception:
+				logger.exception("Append result callback failed")
+
+	def _note_written(self, offset: Optional[int], count: int) -> None:
+		"""
+		Count ``count`` rows just written by this manager, placed after ``offset`` data rows; the caller holds ``_lock``.
+
+		Our rows normally land right after the rows already known. When the append
+		response places them further down, rows were added from outside in between:
+		the tail is pulled so those rows are cached and later tail pulls start after
+		our own rows. When it places them higher up, rows were removed, and the
+		cache is reloaded on the next query.
+		"""
+		if offset is None or offset == self._sheet_rows:
+			self._sheet_rows += count
+			return
+		fetch_since = getattr(self.client, "query_since", None)
+		if offset > self._sheet_rows and self._rows is not None and fetch_since is not None:
+			gap = offset - self._sheet_rows
+			self._sheet_reads += 1
+			try:
+				raw = fetch_since(self._sheet_rows)
+			except Exception as e:
+				logger.warning("Could not pull rows added to the sheet before our append; reloading: %s", e)
+				raw = []
+			if len(raw) >= gap + count:
+				# raw[gap:gap + count] are the rows we wrote, already cached
+				outside = raw[:gap] + raw[gap + count:]
+				self._rows.extend(_canon_row(r) for r in outside)
+				self._sheet_rows += len(raw)
+				self._synced_at = time.monotonic()
+				self.data_version += 1
+				logger.info("Pulled %d rows added to the sheet around our append", len(outside))
+				return
+		logger.info("Sheet row count changed outside the bot (append landed after %d rows, %d cached); reloading", offset, self._sheet_rows)
+		self._rows = None
+		self._synced_at = 0.0
+
+	def close(self) -> None:
+		"""Flush any buffered expenses; call at shutdown."""
+		self.flush()
+
+	# Only rejected writes are retried; after a timeout or 5xx the rows may already be in the sheet
+	@retry(retry=retry_if_exception(append_rejected), stop=stop_after_attempt(3), wait=wait_exponential(multiplier=0.2, min=0.2, max=2))
+	def _write_batch(self, expenses: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+		append_rows = getattr(self.client, "append_rows", None)
+		if append_rows is not None:
+			return append_rows(expenses)
+		written = WrittenRows(self.client.append_row(e) for e in expenses)
+		offsets = [getattr(r, "offset", None) for r in written]
+		if offsets and offsets[0] is not None and offsets == list(range(offsets[0], offsets[0] + len(offsets))):
+			written.offset = offsets[0]
+		return written
 
 	def query_expenses(self, filters: Dict[str, Any]) -> List[Dict[str, Any]]:
+		"""
+		Return all expense rows with canonical keys, including buffered appends.
+
+		The returned list is the live cache; callers must treat it as read-only.
+		New rows are appended to it, and any other change (a full reload, dropped
+		rows of a failed flush, rows rewritten with the values a flush wrote)
+		replaces it with a new list, so consumers can follow it by identity and
+		length.
+		"""
 		logger.debug("Querying expenses with filters: %s", list(filters.keys()))
-		raw = self.client.query(filters)
-		rows = [_canon_row(r) for r in raw]
-		logger.info("Fetched %d rows from sheet", len(rows))
-		return rows 
\ No newline at end of file
+		with self._lock:
+			self.last_refresh = {"refresh": "cached"}
+			if self._rows is None:
+				self._load_all()
+			elif time.monotonic() - self._synced_at > self.max_staleness_seconds:
+				self._pull_new_rows()
+			return self._rows  # type: ignore[return-value]
+
+	def invalidate_cache(self) -> None:
+		with self._lock:
+			self._rows = None
+			self._synced_at = 0.0
+
+	def _load_all(self) -> None:
+		started = time.perf_counter()
+		raw = self.client.query({})
+		downloaded = time.perf_counter()
+		self._rows = [_canon_row(r) for r in raw]
+		self._note_refresh("full", len(raw), started, downloaded)
+		self._sheet_rows = len(self._rows)
+		self._sheet_reads += 1
+		# Rows still waiting in the write buffer, or being written, are not in the sheet yet
+		self._rows.extend(p.row for p in self._writing + self._pending)
+		self._synced_at = time.monotonic()
+		self.data_version += 1
+		logger.info("Fetched %d rows from sheet", self._sheet_rows)
+
+	def _pull_new_rows(self) -> None:
+		assert self._rows is not None
+		fetch_since = getattr(self.client, "query_since", None)
+		if fetch_since is None:
+			self._load_all()
+			return
+		started = time.perf_counter()
+		try:
+			raw = fetch_since(self._sheet_rows)
+		except Exception as e:
+			# Keep serving the cached rows; the next query retries the pull
+			logger.warning("Incremental sheet refresh failed; serving cached rows: %s", e)
+			self.last_refresh = {"refresh": "cached", "error": type(e).__name__}
+			return
+		downloaded = time.perf_counter()
+		self._sheet_reads += 1
+		self._rows.extend(_canon_row(r) for r in raw)
+		self._note_refresh("incremental", len(raw), started, downloaded)
+		self._sheet_rows += len(raw)
+		self._synced_at = time.monotonic()
+		if raw:
+			self.data_version += 1
+			logger.info("Fetched %d new rows from sheet (total %d)", len(raw), len(self._rows))
+
+	def _note_refresh(self, kind: str, fetched: int, started: float, downloaded: float) -> None:
+		self.last_refresh = {
+			"refresh": kind,
+			"fetched": fetched,
+			"download_ms": round((downloaded - started) * 1000, 3),
+			"canon_ms": round((time.perf_counter() - downloaded) * 1000, 3),
+		}
+
+	@staticmethod
+	def _record_from_expense(expense: Dict[str, Any]) -> Dict[str, Any]:
+		record = dict(expense)
+		if "confidence" in record and "confidence_score" not in record:
+			record["confidence_score"] = record.pop("confidence")
+		return record
@@ -1,6 +1,8 @@
-from typing import Any, Optional
+from typing import Any, Optional, Tuple
+from collections import OrderedDict
 import os
 import tempfile
+import threading
 
 import requests
 from slack_bolt import App
@@ -8,6 +10,10 @@ from slack_bolt.adapter.socket_mode import SocketModeHandler
 from slack_sdk import WebClient
 
 
+_MORE_REPLIES = {"more", "next", "next page", "show more"}
+_MAX_OPEN_CURSORS = 256
+
+
 class SlackInterface:
 	def __init__(self, bot_token: str, app_token: str, signing_secret: str, controller: Any, verify_tokens: bool = False) -> None:
 		# Disable network-based token verification by default (tests)
@@ -23,31 +29,37 @@ class SlackInterface:
 		self.controller = controller
 		self.client = WebClient(token=bot_token)
 		self._test_mode = not verify_tokens
+		# Open search cursors by (channel, user), so a "more" reply continues the last paged result
+		self._cursors: "OrderedDict[Tuple[Any, Any], Any]" = OrderedDict()
+		self._cursors_lock = threading.Lock()
 		self._register_handlers()
 
 	def _register_handlers(self) -> None:
 		@app_event(self.app, "message")
 		def handle_message_events(body, say, logger):
-			text = body.get("event", {}).get("text", "")
-			if text:
-				response = self.controller.handle_query(text)
-				say(response)
+			event = body.get("event", {})
+			text = event.get("text", "")
+			if not text:
+				return
+			conversation = (event.get("channel"), event.get("user"))
+			if text.strip().lower().rstrip(".!") in _MORE_REPLIES:
+				page = self._next_page(conversation)
+				if page is not None:
+					say(page)
+					return
+			response = self.controller.handle_query(text)
+			self._remember_cursor(conversation, getattr(response, "cursor", None))
+			say(str(response))
 
 		@app_event(self.app, "file_shared")
 		def handle_file_shared(body, say, logger):
 			# In unit tests (verify_tokens=False), bypass Slack API calls and pass through
 			if self._test_mode:
-				result = self.controller.handle_file_shared(body)
+				result = self.controller.handle_file_shared({**body, "on_result": lambda res: self._say_result(res, say)})
 				if isinstance(result, str):
 					say(result)
 				else:
-					status = (result or {}).get("status")
-					if status == "appended":
-						say("✅ Your receipt has been added to Google Sheets")
-					elif status == "duplicate":
-						say("⚠️ Possible duplicate detected. Sent for review.")
-					else:
-						say("❌ Could not process the receipt. Please try again or contact support.")
+					self._say_result(result, say)
 				return
 			# Slack sends a minimal payload; fetch full file info via WebClient
 			try:
@@ -81,20 +93,51 @@ class SlackInterface:
 							if chunk:
 								out.write(chunk)
 
-				payload = {"local_path": tmp_path, "receipt_link": permalink}
+				# Buffered (write-behind) appends report their outcome later through on_result
+				payload = {"local_path": tmp_path, "receipt_link": permalink, "on_result": lambda res: self._say_result(res, say)}
 				result = self.controller.handle_file_shared(payload)
-
-				status = (result or {}).get("status")
-				if status == "appended":
-					say("✅ Your receipt has been added to Google Sheets")
-				elif status == "duplicate":
-					say("⚠️ Possible duplicate detected. Sent for review.")
-				else:
-					say("❌ Could not process the receipt. Please try again or contact support.")
+				self._say_result(result, say)
 			except Exception as e:
 				logger.exception("Error handling file_shared: %s", e)
 				say("❌ An error occurred while processing the receipt.")
 
+	def _remember_cursor(self, conversation: Tuple[Any, Any], cursor: Any) -> None:
+		with self._cursors_lock:
+			self._cursors.pop(conversation, None)
+			if cursor is not None and cursor.has_more:
+				self._cursors[conversation] = cursor
+				while len(self._cursors) > _MAX_OPEN_CURSORS:
+					self._cursors.popitem(last=False)
+
+	def _next_page(self, conversation: Tuple[Any, Any]) -> Optional[str]:
+		"""The next page of the conversation's last paged search, or None when there is none."""
+		with self._cursors_lock:
+			cursor = self._cursors.get(conversation)
+		if cursor is None:
+			return None
+		page = cursor.next_page()
+		if not cursor.has_more:
+			with self._cursors_lock:
+				self._cursors.pop(conversation, None)
+		return page
+
+	@staticmethod
+	def _say_result(result: Any, say: Any) -> None:
+		status = (result or {}).get("status")
+		if status == "queued":
+			# Final outcome arrives via the on_result callback once the batch is written
+			return
+		if status == "appended":
+			match = (result or {}).get("possible_duplicate") or {}
+			if match:
+				say(f"✅ Your receipt has been added to Google Sheets. ⚠️ It resembles {match.get('vendor')} on {match.get('date')} for {match.get('amount')} (match score {match.get('score'):.2f}); delete one if this was a re-upload.")
+			else:
+				say("✅ Your receipt has been added to Google Sheets")
+		elif status == "duplicate":
+			say("⚠️ Possible duplicate detected. Sent for review.")
+		else:
+			say("❌ Could not process the receipt. Please try again or contact support.")
+
 	def start(self) -> None:
 		handler = SocketModeHandler(self.app, self.app_token)
 		handler.start()
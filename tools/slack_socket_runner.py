@@ -10,11 +10,19 @@ from config.settings import load_settings
 from integrations.google_sheets_api import GoogleSheetsClient
 from models.granite_client import GraniteClient
 from tools.controller import Controller
+from tools.expense_mirror import ExpenseMirror
+from tools.fast_query_parser import FastQueryParser
+from tools.image_hash import PerceptualHashIndex
+from tools.plan_cache import PlanCache
+from tools.receipt_cache import ReceiptCache
 from tools.receipt_processor import ReceiptProcessor
 from tools.sheets_manager import SheetsManager
 from tools.slack_interface import SlackInterface
 from tools.text_extractor import TextExtractor
 from tools.query_analyzer import QueryAnalyzer
+from tools.result_cache import ResultCache
+from tools.semantic_plan_cache import SemanticPlanCache
+from tools.vendor_index import VendorIndex
 
 
 def main() -> None:
@@ -25,10 +33,21 @@ def main() -> None:
 	logging.basicConfig(level=logging.INFO)
 	settings = load_settings()
 
+	# Opt-in: perceptual hashes of transcribed images, kept next to the receipt cache. Different receipts from one
+	# store can hash as close as a re-crop of the same receipt, so reuse is off unless a distance is configured
+	image_index = None
+	if settings.cache.receipt_cache_dir and settings.cache.image_hash_max_distance >= 0:
+		image_index = PerceptualHashIndex(
+			str(project_root / settings.cache.receipt_cache_dir / "image_hashes.jsonl"),
+			settings.cache.image_hash_max_distance,
+			max_entries=settings.cache.receipt_cache_max_entries,
+		)
+
 	# Text extractor defaults to vision backend when OCR_BACKEND is not set
 	text_extractor = TextExtractor(
 		tesseract_cmd=settings.ocr.tesseract_cmd or None,
 		lang=settings.ocr.tesseract_lang,
+		image_index=image_index,
 	)
 
 	granite = GraniteClient()
@@ -37,14 +56,41 @@ def main() -> None:
 	gs.connect()
 	sheets_manager = SheetsManager(gs)
 
-	# Wire QueryAnalyzer for NL queries
-	query_analyzer = QueryAnalyzer(granite)
+	# Wire QueryAnalyzer for NL queries; repeated questions reuse cached plans (0 entries disables the cache)
+	plan_cache = None
+	if settings.cache.plan_cache_max_entries > 0:
+		plan_cache = PlanCache(
+			str(project_root / settings.cache.plan_cache_path) if settings.cache.plan_cache_path else None,
+			ttl_seconds=settings.cache.plan_cache_ttl_seconds,
+			max_entries=settings.cache.plan_cache_max_entries,
+		)
+	# Known vendors, kept current by the controller, let formulaic questions skip Granite
+	vendor_index = VendorIndex()
+	# Paraphrases of earlier questions reuse their plans with the new vendor/period/amounts filled in
+	semantic_cache = None
+	if settings.cache.semantic_plan_cache_enabled:
+		semantic_cache = SemanticPlanCache(
+			ttl_seconds=settings.cache.plan_cache_ttl_seconds,
+			max_entries=max(1, settings.cache.plan_cache_max_entries),
+		)
+	query_analyzer = QueryAnalyzer(granite, plan_cache=plan_cache, fast_parser=FastQueryParser(vendor_index), semantic_cache=semantic_cache)
+
+	# Optional SQLite mirror used as the query backend
+	mirror = ExpenseMirror(settings.cache.sqlite_mirror_path) if settings.cache.sqlite_mirror_path else None
+	# Content-addressed cache so re-uploaded or re-delivered files skip the model calls
+	receipt_cache = ReceiptCache(str(project_root / settings.cache.receipt_cache_dir), settings.cache.receipt_cache_max_entries) if settings.cache.receipt_cache_dir else None
+	# Repeated questions are answered from earlier results until the expense rows change
+	result_cache = ResultCache(settings.cache.result_cache_max_entries) if settings.cache.result_cache_max_entries > 0 else None
 
 	controller = Controller(
 		text_extractor=text_extractor,
 		receipt_processor=receipt_processor,
 		sheets_manager=sheets_manager,
 		query_analyzer=query_analyzer,
+		mirror=mirror,
+		receipt_cache=receipt_cache,
+		vendor_index=vendor_index,
+		result_cache=result_cache,
 	)
 
 	slack = SlackInterface(
@@ -55,7 +101,11 @@ def main() -> None:
 		verify_tokens=True,
 	)
 	# Blocking start; run this in a dedicated terminal
-	slack.start()
+	try:
+		slack.start()
+	finally:
+		# Write out any expenses still waiting in the write-behind buffer
+		sheets_manager.close()
 
 
 if __name__ == "__main__":
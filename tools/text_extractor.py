@@ -9,6 +9,7 @@ from PIL import Image, ImageOps, ImageFilter
 import pdfplumber
 
 from models.vision_client import VisionClient
+from tools.image_hash import PerceptualHashIndex, phash
 
 
 logger = logging.getLogger(__name__)
@@ -23,11 +24,13 @@ VISION_IMAGE_MAX_DIM = 2048
 
 
 class TextExtractor:
-	def __init__(self, tesseract_cmd: Optional[str] = None, lang: str = "eng", backend: Optional[str] = None) -> None:
+	def __init__(self, tesseract_cmd: Optional[str] = None, lang: str = "eng", backend: Optional[str] = None, image_index: Optional[PerceptualHashIndex] = None) -> None:
 		if tesseract_cmd:
 			pytesseract.pytesseract.tesseract_cmd = tesseract_cmd
 		self.lang = lang
 		self.backend = (backend or os.getenv("OCR_BACKEND", "vision")).strip().lower()
+		# Perceptual hashes of transcribed images; a re-photographed receipt reuses its transcript
+		self.image_index = image_index
 		self._vision: Optional[VisionClient] = None
 		if self.backend == "vision":
 			self._vision = VisionClient(
@@ -46,6 +49,13 @@ class TextExtractor:
 			logger.debug("Image preprocessing failed; proceeding without preprocessing: %s", str(e))
 			return image
 
+	def _image_hash(self, image: Image.Image) -> Optional[int]:
+		try:
+			return phash(image)
+		except Exception as e:
+			logger.debug("Perceptual hashing failed; transcribing without lookup: %s", str(e))
+			return None
+
 	def _image_to_bytes(self, image: Image.Image) -> bytes:
 		w, h = image.size
 		max_dim = max(w, h)
@@ -87,14 +97,25 @@ class TextExtractor:
 	def extract_from_image(self, image_path: str) -> str:
 		if self.backend == "vision":
 			img = Image.open(image_path)
+			image_hash: Optional[int] = None
+			# Reuse is opt-in; without an index the hash would never be read
+			if self.image_index is not None:
+				image_hash = self._image_hash(img)
+				match = self.image_index.lookup(image_hash) if image_hash is not None else None
+				if match is not None:
+					distance, transcript = match
+					logger.info("Perceptual hash match for %s (distance=%d); reusing prior transcript", image_path, distance)
+					return transcript
 			images = [self._image_to_bytes(img)]
 			instruction = (
 				"Transcribe all visible text from the attached receipt image.\n"
 				"Preserve line breaks, spacing for amounts, and currency symbols.\n"
 				"Return only the transcribed text."
 			)
-			text = self._vision_transcribe_images(images, instruction)
-			return (text or "").strip()
+			text = (self._vision_transcribe_images(images, instruction) or "").strip()
+			if text and image_hash is not None:
+				self.image_index.add(image_hash, text)
+			return text
 		# tesseract path (legacy)
 		try:
 			image = Image.open(image_path)
@@ -0,0 +1,80 @@
+from __future__ import annotations
+
+from typing import Any, Dict, List, Optional, Set
+import threading
+
+import numpy as np
+
+
+def search_text(row: Dict[str, Any]) -> str:
+	"""The lowercase text a ``text_search`` filter is matched against."""
+	return " ".join([
+		str(row.get("description", "")),
+		str(row.get("vendor", "")),
+		str(row.get("location", "")),
+	]).lower()
+
+
+def _trigrams(text: str) -> Set[str]:
+	return {text[i : i + 3] for i in range(len(text) - 2)}
+
+
+class TextIndex:
+	"""
+	Inverted trigram index over each row's description, vendor and location.
+
+	A search intersects the posting lists of the needle's trigrams (smallest
+	first) and confirms each candidate with the same substring test the row scan
+	uses, so results are identical to ``needle in search_text(row)``, partial
+	words and phrases included. Needles shorter than three characters are
+	checked directly against the stored texts. ``sync`` follows the row cache
+	list incrementally.
+	"""
+
+	def __init__(self) -> None:
+		self._lock = threading.RLock()
+		self._source_rows: Optional[List[Dict[str, Any]]] = None
+		self._reset()
+
+	def _reset(self) -> None:
+		self._texts: List[str] = []
+		self._postings: Dict[str, List[int]] = {}
+
+	def __len__(self) -> int:
+		return len(self._texts)
+
+	def sync(self, rows: List[Dict[str, Any]]) -> None:
+		with self._lock:
+			if rows is not self._source_rows or len(rows) < len(self._texts):
+				self._reset()
+				self._source_rows = rows
+			for row in rows[len(self._texts):]:
+				row_id = len(self._texts)
+				text = search_text(row)
+				self._texts.append(text)
+				for gram in _trigrams(text):
+					self._postings.setdefault(gram, []).append(row_id)
+
+	def search(self, needle: str, candidates: Optional[np.ndarray] = None) -> np.ndarray:
+		"""Sorted ids of rows whose text contains ``needle`` (already lowercased), optionally restricted to ``candidates``."""
+		with self._lock:
+			texts = self._texts
+			grams = _trigrams(needle)
+			if grams:
+				postings = sorted((self._postings.get(g, []) for g in grams), key=len)
+				if not postings[0]:
+					return np.zeros(0, dtype=np.int64)
+				if candidates is not None and len(candidates) <= len(postings[0]):
+					# A narrow selection (e.g. one month) is cheaper to check directly
+					return np.array([i for i in candidates.tolist() if needle in texts[i]], dtype=np.int64)
+				ids = set(postings[0])
+				for posting in postings[1:]:
+					ids.intersection_update(posting)
+					if not ids:
+						return np.zeros(0, dtype=np.int64)
+				if candidates is not None:
+					ids.intersection_update(candidates.tolist())
+				pool = sorted(ids)
+			else:
+				pool = candidates.tolist() if candidates is not None else range(len(texts))
+			return np.array([i for i in pool if needle in texts[i]], dtype=np.int64)
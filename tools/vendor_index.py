@@ -0,0 +1,150 @@
+from __future__ import annotations
+
+from typing import Any, Dict, List, Optional, Set
+import re
+import threading
+
+
+_TOKEN_SPLIT = re.compile(r"[^A-Za-z0-9&'.-]+")
+# Trie node key marking the end of a token
+_END = ""
+
+
+def vendor_tokens(name: str) -> Set[str]:
+	return {t.lower() for t in _TOKEN_SPLIT.split(name or "") if t}
+
+
+def normalize_name(name: str) -> str:
+	"""Lowercase tokens in order, trailing punctuation dropped ("Wal-Mart Inc." -> "wal-mart inc")."""
+	return " ".join(t for t in (t.lower().strip(".'-") for t in _TOKEN_SPLIT.split(name or "")) if t)
+
+
+def _max_edits(token: str) -> int:
+	# Short words are too easy to confuse ("food" vs "ford"), so only longer ones are corrected
+	if len(token) >= 8:
+		return 2
+	if len(token) >= 5:
+		return 1
+	return 0
+
+
+class VendorIndex:
+	"""
+	Known vendor names indexed for resolving vendor mentions in queries.
+
+	Each vendor's lowercase tokens map to the vendors containing them, and the
+	tokens themselves live in a trie. ``resolve`` intersects the posting lists of
+	a candidate's tokens, so its cost depends on the candidate, not on the number
+	of vendors; a token with no exact entry is corrected to the nearest trie
+	tokens within a small edit distance. ``sync`` follows the row cache list
+	incrementally and ``add`` registers a single name.
+	"""
+
+	def __init__(self) -> None:
+		self._lock = threading.RLock()
+		self._source_rows: Optional[List[Dict[str, Any]]] = None
+		self._synced = 0
+		self._names: Set[str] = set()
+		self._postings: Dict[str, Set[str]] = {}
+		self._sizes: Dict[str, int] = {}
+		self._trie: Dict[str, Any] = {}
+		self._by_name: Dict[str, str] = {}
+
+	def __len__(self) -> int:
+		return len(self._names)
+
+	def sync(self, rows: List[Dict[str, Any]]) -> None:
+		with self._lock:
+			if rows is not self._source_rows or len(rows) < self._synced:
+				# Vendors only accumulate; a reloaded cache just re-registers names already known
+				self._source_rows = rows
+				self._synced = 0
+			for row in rows[self._synced:]:
+				self.add(row.get("vendor"))
+			self._synced = len(rows)
+
+	def add(self, name: Any) -> None:
+		vendor = str(name or "").strip()
+		if not vendor:
+			return
+		with self._lock:
+			if vendor in self._names:
+				return
+			self._names.add(vendor)
+			self._by_name.setdefault(normalize_name(vendor), vendor)
+			tokens = vendor_tokens(vendor)
+			self._sizes[vendor] = len(tokens)
+			for token in tokens:
+				posting = self._postings.get(token)
+				if posting is None:
+					posting = self._postings[token] = set()
+					node = self._trie
+					for ch in token:
+						node = node.setdefault(ch, {})
+					node[_END] = token
+				posting.add(vendor)
+
+	def exact(self, phrase: str) -> Optional[str]:
+		"""The vendor whose normalized name is exactly ``phrase`` (see ``normalize_name``)."""
+		with self._lock:
+			return self._by_name.get(normalize_name(phrase))
+
+	def _fuzzy(self, token: str, max_edits: int) -> List[str]:
+		"""Indexed tokens within ``max_edits`` Levenshtein edits of ``token``, closest first."""
+		found: List[tuple] = []
+		first_row = list(range(len(token) + 1))
+
+		def walk(node: Dict[str, Any], ch: str, prev_row: List[int]) -> None:
+			row = [prev_row[0] + 1]
+			for i in range(1, len(token) + 1):
+				row.append(min(row[i - 1] + 1, prev_row[i] + 1, prev_row[i - 1] + (token[i - 1] != ch)))
+			if _END in node and row[-1] <= max_edits:
+				found.append((row[-1], node[_END]))
+			# Every extension costs at least the row minimum, so prune once it exceeds the budget
+			if min(row) <= max_edits:
+				for next_ch, child in node.items():
+					if next_ch != _END:
+						walk(child, next_ch, row)
+
+		for ch, child in self._trie.items():
+			if ch != _END:
+				walk(child, ch, first_row)
+		found.sort()
+		return [t for d, t in found if d == found[0][0]] if found else []
+
+	def _matching(self, tokens: Set[str], fuzzy: bool) -> Set[str]:
+		matches: Optional[Set[str]] = None
+		for token in sorted(tokens, key=lambda t: len(self._postings.get(t, ()))):
+			posting = self._postings.get(token)
+			if posting is None and fuzzy:
+				posting = set()
+				for corrected in self._fuzzy(token, _max_edits(token)):
+					posting |= self._postings[corrected]
+			if not posting:
+				return set()
+			matches = set(posting) if matches is None else matches & posting
+			if not matches:
+				return set()
+		return matches or set()
+
+	def resolve(self, candidates: List[str]) -> Optional[str]:
+		"""
+		Best vendor for the candidate phrases: every candidate token must appear in the
+		vendor's name, and the vendor with the most tokens wins (ties by name).
+		Exact token matches are preferred; misspelled tokens are corrected only when
+		no candidate matches exactly.
+		"""
+		with self._lock:
+			for fuzzy in (False, True):
+				best: Optional[tuple] = None
+				for cand in candidates:
+					tokens = vendor_tokens(cand)
+					if not tokens:
+						continue
+					for vendor in self._matching(tokens, fuzzy):
+						key = (-self._sizes[vendor], vendor)
+						if best is None or key < best:
+							best = key
+				if best is not None:
+					return best[1]
+			return None